@@ -0,0 +1,223 @@
+import argparse
+import os
+import sys
+import sqlite3
+from datetime import datetime
+
+from backup_engine import (
+    BackupEngine, RestoreEngine, BackupCatalog, RunHistory, CATALOG_FILE, CUSTOM_FORMAT, DIRECTORY_FORMAT,
+    DEFAULT_COMPRESSION_LEVEL, DEFAULT_RETENTION, FAST_RESTORE_MAINTENANCE_MEM, INCREMENTAL_BACKUP, COPY_BACKUP,
+    COMPRESSION_METHODS, default_backup_workers, find_catalog_root, format_duration, format_retention, format_size,
+    is_below, parse_retention, prune_backups, verify_backup
+)
+from task_schedulers import read_env_file
+
+# Headless entry point for cron, systemd and scheduled tasks, on the same engine as the GUI.
+# Exit codes: 0 success, 1 a backup, restore, verification or prune failed, 2 bad usage.
+
+BACKUP_TYPES = {'full': 'Data', 'schema': 'Schema', 'incremental': INCREMENTAL_BACKUP, 'copy': COPY_BACKUP}
+COPY_FORMATS = ('binary', 'csv')
+BACKUP_FORMATS = ('sql', CUSTOM_FORMAT, DIRECTORY_FORMAT)
+
+def add_connection_arguments(parser):
+    parser.add_argument('--host', default='localhost', help="PostgreSQL host (default: localhost)")
+    parser.add_argument('--port', default='5432', help="PostgreSQL port (default: 5432)")
+    parser.add_argument('--user', default='postgres', help="PostgreSQL user (default: postgres)")
+    # A password on the command line shows up in the process list, PGPASSWORD does not
+    parser.add_argument('--password', help="PostgreSQL password (default: $PGPASSWORD)")
+    # Scheduled tasks that cannot set an environment pass theirs in a private file, see write_env_file
+    parser.add_argument('--env-file', help="read PGPASSWORD and other variables from this file first")
+
+def status_printer(args):
+    if args.quiet:
+        return lambda message: None
+    return lambda message: print(message, flush=True)
+
+def run_backup(args):
+    engine = BackupEngine(BACKUP_TYPES[args.type], args.format, args.db or '', args.host, args.port, args.user,
+                          args.password, args.dir, max_workers=args.workers, dump_jobs=args.jobs,
+                          compression_level=args.level, compression=args.compression,
+                          deduplicate=args.deduplicate, source='cli', label=args.label,
+                          copy_format=args.copy_format)
+    engine.status.connect(status_printer(args))
+    success, message = engine.run()
+    print(message)
+    if success and args.keep is not None:
+        # Only the backups of what was just backed up are pruned
+        for line in prune_backups(args.dir, args.keep, host=args.host, db_name=args.db):
+            print(line)
+    return 0 if success else 1
+
+def run_restore(args):
+    engine = RestoreEngine(args.host, args.port, args.user, args.password, args.dir, restore_jobs=args.jobs,
+                           restore_workers=args.workers, fast_restore=args.fast, restore_point=args.at,
+                           source='cli', label=args.label, maintenance_work_mem=args.maintenance_mem)
+    engine.status.connect(status_printer(args))
+    success, message = engine.run()
+    print(message)
+    return 0 if success else 1
+
+def open_catalog(directory):
+    # The catalog the backups below directory were written with, found at or above it. list and
+    # verify only read, they never leave a new catalog in a subfolder or a mistyped path.
+    root = find_catalog_root(directory) if os.path.isdir(directory) else None
+    if root is None:
+        print(f"Error: {directory} is not a backup directory, no {CATALOG_FILE} in or above it", file=sys.stderr)
+        return None
+    return BackupCatalog(root)
+
+def run_list(args):
+    catalog = open_catalog(args.dir)
+    if catalog is None:
+        return 2
+    with catalog:
+        catalog.sync()
+        entries = catalog.entries(args.db)
+    directory = os.path.abspath(args.dir)
+    for entry in entries:
+        if not is_below(entry['path'], directory):
+            continue
+        print("\t".join([entry['timestamp'] or '-', entry['db_name'], entry['backup_type'] or '-',
+                         format_size(entry['size'] or 0), entry['path']]))
+    return 0
+
+def run_verify(args):
+    catalog = open_catalog(args.dir)
+    if catalog is None:
+        return 2
+    with catalog:
+        catalog.sync()
+        backups = catalog.backups(args.db)
+    directory = os.path.abspath(args.dir)
+    backups = [(db_name, path) for db_name, path in backups if is_below(path, directory)]
+    failed = unverified = 0
+    for _db_name, backup_path in backups:
+        problems = verify_backup(backup_path)
+        if problems is None:
+            unverified += 1
+            print(f"UNVERIFIED {backup_path} (no manifest)")
+        elif problems:
+            failed += 1
+            print(f"FAILED {backup_path}")
+            for problem in problems:
+                print(f"  {problem}")
+        elif not args.quiet:
+            print(f"OK {backup_path}")
+    passed = len(backups) - failed - unverified
+    print(f"{len(backups)} backup(s): {passed} passed, {failed} failed, {unverified} unverified")
+    # Backups without a manifest prove nothing either way, a run that checked none of them fails
+    if failed or (unverified and (args.strict or not passed)):
+        return 1
+    return 0
+
+def run_prune(args):
+    report = prune_backups(args.dir, args.keep, host=args.host, db_name=args.db,
+                           dry_run=args.dry_run)
+    for line in report:
+        print(line)
+    return 1 if any(line.startswith("Error") for line in report) else 0
+
+def run_history(args):
+    with RunHistory() as history:
+        runs = history.runs(limit=args.limit)
+        summary = history.summary(days=args.days)
+    for run in runs:
+        names = ','.join(database['db_name'] for database in run['databases']) or '-'
+        result = 'ok' if run['success'] else 'FAILED'
+        if run['slow']:
+            result += f" slow, baseline {format_duration(run['baseline_seconds'])}"
+        print("\t".join([run['started_at'], run['kind'], run['label'] or run['source'] or '-', names,
+                         format_duration(run['seconds']), format_size(run['bytes']), result]))
+    rate = f"{summary['success_rate']:.0%}" if summary['success_rate'] is not None else '-'
+    speed = f"{format_size(summary['throughput'])}/s" if summary['throughput'] else '-'
+    print(f"Last {args.days} days: {summary['runs']} run(s), {summary['failed']} failed, {rate} succeeded, "
+          f"backup throughput {speed}, {len(summary['slow_runs'])} slower than their baseline")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Back up and restore PostgreSQL databases without the GUI.")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only print results and errors")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backup = commands.add_parser('backup', help="back up one database or every database of a server")
+    add_connection_arguments(backup)
+    backup.add_argument('--db', help="database to back up (default: all databases)")
+    backup.add_argument('--dir', required=True, help="base backup directory")
+    backup.add_argument('--type', choices=sorted(BACKUP_TYPES), default='full')
+    backup.add_argument('--format', choices=BACKUP_FORMATS, default=CUSTOM_FORMAT,
+                        help="ignored by --type copy, which always writes a COPY export directory")
+    backup.add_argument('--compression', choices=sorted(COMPRESSION_METHODS), default='none',
+                        help="codec for the sql format and the data files of --type copy")
+    backup.add_argument('--level', type=int, default=DEFAULT_COMPRESSION_LEVEL, help="compression level")
+    backup.add_argument('--deduplicate', action='store_true', help="store sql dumps in the chunk store")
+    backup.add_argument('--workers', type=int, default=default_backup_workers(),
+                        help="databases backed up at once")
+    backup.add_argument('--jobs', type=int,
+                        help="pg_dump jobs per database for the directory format, connections for --type copy "
+                             "(default: the --workers default split over the databases dumped at once)")
+    backup.add_argument('--copy-format', choices=COPY_FORMATS, default='binary',
+                        help="data file format for --type copy")
+    backup.add_argument('--keep', type=parse_retention,
+                        help=f"prune afterwards with this retention, e.g. {format_retention(DEFAULT_RETENTION)}")
+    backup.add_argument('--label', help="name recorded with the run in the history, e.g. the scheduled task")
+    backup.set_defaults(func=run_backup)
+
+    restore = commands.add_parser('restore', help="restore the latest backup of each database found")
+    add_connection_arguments(restore)
+    restore.add_argument('dir', help="backup directory to restore from")
+    restore.add_argument('--at', type=datetime.fromisoformat, help="restore as of this time, e.g. '2024-05-01 18:00'")
+    restore.add_argument('--fast', action='store_true', help="single transaction, indexes after data, ANALYZE")
+    restore.add_argument('--maintenance-mem', type=int, default=FAST_RESTORE_MAINTENANCE_MEM, metavar='MB',
+                         help="maintenance_work_mem of --fast, split across all --workers x --jobs sessions "
+                              f"(default: {FAST_RESTORE_MAINTENANCE_MEM})")
+    restore.add_argument('--workers', type=int, default=default_backup_workers(),
+                         help="databases restored at once")
+    restore.add_argument('--jobs', type=int,
+                         help="pg_restore jobs for archives, connections for COPY exports "
+                              "(default: the --workers default split over the databases restored at once)")
+    restore.add_argument('--label', help="name recorded with the run in the history")
+    restore.set_defaults(func=run_restore)
+
+    list_parser = commands.add_parser('list', help="list the backups in the catalog")
+    list_parser.add_argument('dir', help="backup directory")
+    list_parser.add_argument('--db', help="only backups of this database")
+    list_parser.set_defaults(func=run_list)
+
+    verify = commands.add_parser('verify', help="check backups against the checksums in their manifests")
+    verify.add_argument('dir', help="backup directory")
+    verify.add_argument('--db', help="only backups of this database")
+    verify.add_argument('--strict', action='store_true', help="fail on backups without a manifest too")
+    verify.set_defaults(func=run_verify)
+
+    prune = commands.add_parser('prune', help="delete backups outside the retention policy")
+    prune.add_argument('dir', help="base backup directory")
+    prune.add_argument('--keep', type=parse_retention, default=format_retention(DEFAULT_RETENTION),
+                       help=f"retention policy (default: {format_retention(DEFAULT_RETENTION)})")
+    prune.add_argument('--host', help="only backups of this host")
+    prune.add_argument('--db', help="only backups of this database")
+    prune.add_argument('--dry-run', action='store_true', help="report what would be deleted, delete nothing")
+    prune.set_defaults(func=run_prune)
+
+    history = commands.add_parser('history', help="show recent backup and restore runs")
+    history.add_argument('--limit', type=int, default=20, help="runs to list (default: 20)")
+    history.add_argument('--days', type=int, default=30, help="days the summary covers (default: 30)")
+    history.set_defaults(func=run_history)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'env_file', None):
+        if not os.path.isfile(args.env_file):
+            parser.error(f"environment file '{args.env_file}' not found")
+        os.environ.update(read_env_file(args.env_file))
+    if hasattr(args, 'password') and args.password is None:
+        args.password = os.environ.get('PGPASSWORD', '')
+    try:
+        return args.func(args)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2357 @@
+import os
+import sys
+import subprocess
+import json
+import threading
+import time
+import hashlib
+import sqlite3
+import zlib
+import tempfile
+import shutil
+import gzip
+import importlib.util
+import statistics
+import atexit
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Backup and restore engine shared by the Qt GUI (backup_restore.py) and the command line
+# (backup_cli.py). Nothing in here may import PyQt5 or win32com. psycopg2, the thread pool and
+# the optional codecs are imported by the code that uses them, so list, verify and prune start
+# without them and hosts lacking them still get that far.
+
+# file_extension value selecting pg_dump's directory format (-F d)
+DIRECTORY_FORMAT = 'directory'
+# file_extension value selecting pg_dump's custom archive format (-F c)
+CUSTOM_FORMAT = 'backup'
+# Archives cannot carry our CREATE ROLE header, the roles are stored beside them
+ROLES_FILE_SUFFIX = '.roles.sql'
+# Roles, memberships and tablespaces belong to the cluster, not to a database. Each backup run
+# captures them once into base/host/.globals/<timestamp>.globals.sql, a new file only when they
+# changed, and the manifest of every backup names the one it goes with. Older backups carry the
+# roles themselves, in a header or a roles file.
+GLOBALS_DIR = '.globals'
+GLOBALS_FILE_SUFFIX = '.globals.sql'
+# Backup type exporting table data with COPY over several connections, restored by loading it back
+# the same way, see copy_engine.py. It always writes a db.copy directory whose copy_toc.json,
+# written last, marks it complete.
+COPY_BACKUP = 'Copy'
+COPY_FORMAT = 'copy'
+COPY_TOC_FILE = 'copy_toc.json'
+# Every custom-format archive starts with this magic
+CUSTOM_ARCHIVE_MAGIC = b'PGDMP'
+DEFAULT_COMPRESSION_LEVEL = 6
+# backup_type value for changed-tables-only backups on top of the last full one
+INCREMENTAL_BACKUP = 'Incremental'
+# Incremental backups taken in a row before the next one is forced to be full
+MAX_INCREMENTAL_CHAIN = 30
+# Written into every host/db/timestamp directory next to the backup
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+# Deduplicated plain dumps: unique chunks live once in base_backup_dir/chunks, each backup
+# directory only holds the list of chunks its dump is made of
+CHUNK_STORE_DIR = 'chunks'
+CHUNK_LIST_SUFFIX = '.chunks'
+# Chunks end at a line whose hash falls under a threshold scaled by its length, so the
+# boundaries follow the content and an insert early in a dump does not shift every later chunk
+CHUNK_TARGET_SIZE = 256 * 1024
+CHUNK_MIN_SIZE = 64 * 1024
+CHUNK_MAX_SIZE = 1024 * 1024
+# Grandfather-father-son retention: keep the newest backup of each of the last N hours, days,
+# ISO weeks and months, per host/db directory
+RETENTION_PERIODS = ('hourly', 'daily', 'weekly', 'monthly')
+DEFAULT_RETENTION = {'hourly': 24, 'daily': 7, 'weekly': 4, 'monthly': 12}
+# Backup directories deleted between two catalog updates
+PRUNE_BATCH_SIZE = 50
+# Chunks younger than this are never collected, a running backup may be about to list them
+CHUNK_GC_GRACE = 24 * 3600
+# Name of the timestamp directory each backup is written to, host/db/timestamp
+BACKUP_TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+# SQLite index of the backups below a backup directory, kept in that directory
+CATALOG_FILE = 'backup_catalog.sqlite'
+# Directories modified this recently are listed again on the next sync, file systems
+# with coarse timestamps could otherwise hide a change made in the same tick
+CATALOG_MTIME_SLACK = 2
+# SQLite record of every backup and restore run, one per user unless BACKUP_RUN_HISTORY names another
+RUN_HISTORY_FILE = 'run_history.sqlite'
+RUN_HISTORY_ENV = 'BACKUP_RUN_HISTORY'
+# A run is flagged slow when it takes this many times the median of the previous runs like it
+SLOW_RUN_FACTOR = 1.5
+SLOW_RUN_BASELINE_RUNS = 10
+# Shorter runs vary too much to compare
+SLOW_RUN_MIN_SECONDS = 5
+# pg_dump output is copied in large binary chunks, never decoded
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Minimum number of seconds between two progress/status signals from a stream
+PROGRESS_INTERVAL = 0.25
+# Size of a compressed custom or directory archive as a share of the table data in it, the guess
+# used until a previous archive of the same database shows the real ratio
+ARCHIVE_COMPRESSION_RATIO = 0.3
+# Fast restore: session settings for psql/pg_restore, and the statements wrapped around a plain dump
+FAST_RESTORE_PGOPTIONS = '-c synchronous_commit=off'
+# maintenance_work_mem of a fast restore in MB, shared by all the sessions it runs at once. A share
+# below the server's own default is not set at all.
+FAST_RESTORE_MAINTENANCE_MEM = 1024
+MIN_MAINTENANCE_WORK_MEM = 64
+FAST_RESTORE_BEGIN = b"\\set ON_ERROR_STOP on\nBEGIN;\n"
+FAST_RESTORE_END = b"COMMIT;\nANALYZE;\n"
+ROLE_HEADER_PREFIX = b'CREATE ROLE '
+# How pg_restore sums up the statements it skipped when it got through the archive regardless
+PG_RESTORE_IGNORED_ERRORS = 'errors ignored on restore'
+# Compression applied to plain SQL dumps: method -> (file suffix, magic bytes)
+COMPRESSION_METHODS = {
+    'none': ('', None),
+    'gzip': ('.gz', b'\x1f\x8b'),
+    'zstd': ('.zst', b'\x28\xb5\x2f\xfd'),
+    'lz4': ('.lz4', b'\x04\x22\x4d\x18'),
+}
+
+def default_backup_workers():
+    # Leave half of the cores to the server itself and the rest of the host
+    return max(1, (os.cpu_count() or 2) // 2)
+
+def default_jobs_per_database(databases_at_once):
+    # The same budget split over the databases worked on at once, so databases x jobs stays near
+    # default_backup_workers() connections instead of its square
+    return max(1, default_backup_workers() // max(1, databases_at_once))
+
+def find_pg_executable(name):
+    # Get the absolute path of the script/executable
+    if getattr(sys, 'frozen', False):
+        # Running as compiled executable
+        base_path = sys._MEIPASS
+    else:
+        # Running as script
+        base_path = os.path.dirname(os.path.abspath(__file__))
+
+    executable_path = os.path.join(base_path, 'resources', 'bin', f'{name}.exe')
+
+    if os.path.exists(executable_path):
+        return executable_path
+
+    # Fallback to system paths if embedded executable not found
+    possible_paths = [
+        rf"D:\SETUP PROGRAMS\PostgreSQL\16\bin\{name}.exe",
+        rf"C:\Program Files\PostgreSQL\15\bin\{name}.exe",
+        rf"C:\Program Files\PostgreSQL\14\bin\{name}.exe",
+        rf"C:\Program Files\PostgreSQL\13\bin\{name}.exe",
+        rf"C:\Program Files\PostgreSQL\12\bin\{name}.exe"
+    ]
+
+    for path in possible_paths:
+        if os.path.exists(path):
+            return path
+
+    # Headless Linux and macOS hosts run the CLI with the client tools on PATH
+    on_path = shutil.which(name)
+    if on_path:
+        return on_path
+
+    raise FileNotFoundError(f"{name}.exe not found in embedded resources or system paths.")
+
+def remove_backup_path(path):
+    # Backups are either a single file or a pg_dump directory archive
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def is_directory_archive(path):
+    return os.path.isfile(os.path.join(path, 'toc.dat'))
+
+def is_copy_export(path):
+    return os.path.isfile(os.path.join(path, COPY_TOC_FILE))
+
+def is_backup_directory(path):
+    return is_directory_archive(path) or is_copy_export(path)
+
+def is_custom_archive(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(CUSTOM_ARCHIVE_MAGIC)) == CUSTOM_ARCHIVE_MAGIC
+    except OSError:
+        return False
+
+def roles_file_for(backup_path):
+    return os.path.splitext(backup_path)[0] + ROLES_FILE_SUFFIX
+
+def available_compression_methods():
+    # Looked up without importing, the GUI lists these on startup
+    methods = ['none', 'gzip']
+    if importlib.util.find_spec('zstandard') is not None:
+        methods.append('zstd')
+    if importlib.util.find_spec('lz4') is not None:
+        methods.append('lz4')
+    return methods
+
+def load_codec(method):
+    # The zstandard module or lz4.frame, None when the package is not installed
+    try:
+        if method == 'zstd':
+            import zstandard
+            return zstandard
+        if method == 'lz4':
+            import lz4.frame
+            return lz4.frame
+    except ImportError:
+        pass
+    return None
+
+def compression_suffix(method):
+    return COMPRESSION_METHODS.get(method or 'none', ('', None))[0]
+
+def open_compressed_writer(target, method, level=DEFAULT_COMPRESSION_LEVEL, threads=0):
+    # target is an open binary file, closing the returned writer flushes the codec but target stays ours
+    if method == 'gzip':
+        return gzip.GzipFile(fileobj=target, mode='wb', compresslevel=level)
+    if method == 'zstd':
+        zstandard = load_codec('zstd')
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the 'zstandard' package.")
+        # zstd is the only codec here with built-in multi-threaded compression
+        compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+        return compressor.stream_writer(target, closefd=False)
+    if method == 'lz4':
+        lz4_frame = load_codec('lz4')
+        if lz4_frame is None:
+            raise RuntimeError("lz4 compression requires the 'lz4' package.")
+        return lz4_frame.LZ4FrameFile(target, 'wb', compression_level=level)
+    return UnclosedWriter(target)
+
+class UnclosedWriter:
+    # Stand-in codec for uncompressed dumps, leaves closing the file to its owner
+    def __init__(self, target):
+        self.target = target
+
+    def write(self, data):
+        return self.target.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.target.flush()
+
+# Stands in for a compressed writer when deduplicating: cuts the stream into content-defined chunks,
+# stores the ones the chunk store does not have yet and writes the chunk list to target on exit.
+class ChunkingWriter:
+    def __init__(self, target, store, compression='none', level=DEFAULT_COMPRESSION_LEVEL):
+        self.target = target
+        self.store = store
+        self.compression = compression
+        # A chunk the store already has under another codec is reused as it is
+        self.reuse_order = [compression] + [method for method in COMPRESSION_METHODS if method != compression]
+        self.level = level
+        self.buffer = bytearray()
+        # Where the boundary search stopped in buffer, and where the line being scanned starts
+        self.scan_pos = 0
+        self.line_start = 0
+        self.chunks = 0
+        self.new_chunks = 0
+        self.new_bytes = 0
+
+    def write(self, data):
+        self.buffer += data
+        while True:
+            end = self.find_boundary()
+            if end is None:
+                break
+            self.store_chunk(end)
+        return len(data)
+
+    def find_boundary(self, final=False):
+        buffer = self.buffer
+        threshold = (1 << 32) // CHUNK_TARGET_SIZE
+        if self.scan_pos < CHUNK_MIN_SIZE:
+            # Lines ending before the minimum size can never end a chunk
+            if len(buffer) < CHUNK_MIN_SIZE:
+                return len(buffer) if final and buffer else None
+            self.line_start = buffer.rfind(b'\n', 0, CHUNK_MIN_SIZE - 1) + 1
+            self.scan_pos = CHUNK_MIN_SIZE - 1
+        view = memoryview(buffer)
+        try:
+            limit = min(len(buffer), CHUNK_MAX_SIZE)
+            pos = self.scan_pos
+            line_start = self.line_start
+            while True:
+                end = buffer.find(b'\n', pos, limit)
+                if end < 0:
+                    break
+                end += 1
+                if zlib.crc32(view[line_start:end]) < (end - line_start) * threshold:
+                    return end
+                pos = line_start = end
+            self.scan_pos = pos
+            self.line_start = line_start
+        finally:
+            view.release()
+        if len(buffer) >= CHUNK_MAX_SIZE:
+            # No boundary in time, cut after the last complete line or else at the maximum size
+            end = buffer.rfind(b'\n', CHUNK_MIN_SIZE, CHUNK_MAX_SIZE)
+            return end + 1 if end >= 0 else CHUNK_MAX_SIZE
+        if final and buffer:
+            return len(buffer)
+        return None
+
+    def store_chunk(self, end):
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        self.scan_pos = self.line_start = 0
+        digest = hashlib.sha256(data).hexdigest()
+        for compression in self.reuse_order:
+            path = chunk_path(self.store, digest, compression)
+            try:
+                stored_size = os.path.getsize(path)
+                # A fresh mtime keeps pruning from collecting a chunk before this backup's list is written
+                os.utime(path)
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            compression = self.compression
+            path = chunk_path(self.store, digest, compression)
+            stored = compress_bytes(data, compression, self.level)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Concurrent backups may store the same chunk, the rename makes whichever finishes last win
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(stored)
+            os.replace(temp_path, path)
+            stored_size = len(stored)
+            self.new_chunks += 1
+            self.new_bytes += stored_size
+        self.chunks += 1
+        self.target.write(f"{digest} {stored_size} {len(data)} {compression}\n".encode('ascii'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            end = self.find_boundary(final=True)
+            while end is not None:
+                self.store_chunk(end)
+                end = self.find_boundary(final=True)
+        self.target.flush()
+
+# Reassembles a deduplicated dump on the fly, chunk by chunk, for feeding into psql
+class ChunkedBackupReader:
+    def __init__(self, path):
+        self.path = path
+        self.store = find_chunk_store(path)
+        self.chunks = read_chunk_list(path)
+        self.index = 0
+        self.consumed = 0
+        self.raw = None
+        self.source = None
+
+    def read(self, size=-1):
+        while True:
+            if self.source is None:
+                if self.index >= len(self.chunks):
+                    return b''
+                digest, _stored_size, _size, compression = self.chunks[self.index]
+                self.raw, self.source = open_chunk_reader(self.store, digest, compression)
+            data = self.source.read(size)
+            if data:
+                return data
+            self.consumed += self.chunks[self.index][1]
+            self.index += 1
+            self.close_chunk()
+
+    def tell(self):
+        return self.consumed + (self.raw.tell() if self.raw else 0)
+
+    def close_chunk(self):
+        if self.source is not None:
+            self.source.close()
+            self.raw.close()
+        self.raw = self.source = None
+
+    def close(self):
+        self.close_chunk()
+        self.index = len(self.chunks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class HashingWriter:
+    # Binary file wrapper that keeps SHA-256 and size of everything written through it
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return self.f.write(data)
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    @property
+    def closed(self):
+        return self.f.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def file_checksum(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def directory_checksums(path):
+    return {entry.name: {'bytes': entry.stat().st_size, 'sha256': file_checksum(entry.path)}
+            for entry in sorted(os.scandir(path), key=lambda entry: entry.name) if entry.is_file()}
+
+def record_phase(phases, name, started):
+    finished = datetime.now()
+    phases[name] = {
+        'started_at': started.isoformat(timespec='seconds'),
+        'finished_at': finished.isoformat(timespec='seconds'),
+        'seconds': round((finished - started).total_seconds(), 3),
+    }
+
+def compress_bytes(data, method, level=DEFAULT_COMPRESSION_LEVEL):
+    # One-shot counterpart of open_compressed_writer, open_backup_reader reads either
+    if method == 'gzip':
+        return gzip.compress(data, compresslevel=level)
+    if method == 'zstd':
+        zstandard = load_codec('zstd')
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the 'zstandard' package.")
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if method == 'lz4':
+        lz4_frame = load_codec('lz4')
+        if lz4_frame is None:
+            raise RuntimeError("lz4 compression requires the 'lz4' package.")
+        return lz4_frame.compress(data, compression_level=level)
+    return data
+
+def open_compressed_reader(raw, method, path=None):
+    # Decompresses raw, an open binary file, with a codec known up front; the counterpart of
+    # open_compressed_writer for data whose first bytes could look like any codec's magic
+    if method == 'gzip':
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if method in ('zstd', 'lz4'):
+        codec = load_codec(method)
+        if codec is None:
+            raise RuntimeError(f"{path or 'Backup'} is {method} compressed but its package is not installed.")
+        if method == 'zstd':
+            return codec.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        return codec.LZ4FrameFile(raw, 'rb')
+    if method not in (None, 'none'):
+        raise ValueError(f"Unknown compression method '{method}'")
+    return raw
+
+def open_backup_reader(path, raw=None):
+    # Plain dumps are decompressed on the fly, picked by magic rather than by name.
+    # Pass an already open binary file as raw to keep track of how much of it was consumed.
+    if raw is None:
+        raw = open(path, 'rb')
+    header = raw.read(4)
+    raw.seek(0)
+    for method, (_suffix, magic) in COMPRESSION_METHODS.items():
+        if magic and header.startswith(magic):
+            return open_compressed_reader(raw, method, path)
+    return raw
+
+def split_backup_name(file_name):
+    # "db.sql.zst" -> ("db", ".sql"), "db.backup" -> ("db", ".backup"), "db.sql.chunks" -> ("db", ".sql")
+    if file_name.endswith(CHUNK_LIST_SUFFIX):
+        return os.path.splitext(file_name[:-len(CHUNK_LIST_SUFFIX)])
+    for suffix, _magic in COMPRESSION_METHODS.values():
+        if suffix and file_name.endswith(suffix):
+            file_name = file_name[:-len(suffix)]
+            break
+    return os.path.splitext(file_name)
+
+def read_manifest(backup_dir):
+    try:
+        with open(os.path.join(backup_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(backup_dir, manifest):
+    temp_path = os.path.join(backup_dir, MANIFEST_FILE + '.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, os.path.join(backup_dir, MANIFEST_FILE))
+
+def latest_backup_manifest(database_dir):
+    # (timestamp, manifest) of the newest backup in host/db that still has its backup file
+    if not os.path.isdir(database_dir):
+        return None, None
+    for timestamp in sorted(os.listdir(database_dir), reverse=True):
+        manifest = read_manifest(os.path.join(database_dir, timestamp))
+        if manifest and os.path.exists(os.path.join(database_dir, timestamp, manifest.get('file', ''))):
+            return timestamp, manifest
+    return None, None
+
+def resolve_backup_chain(backup_path):
+    # Full backup first, then every incremental up to backup_path
+    chain = [backup_path]
+    manifest = read_manifest(os.path.dirname(backup_path))
+    while manifest and manifest.get('backup_type') == INCREMENTAL_BACKUP:
+        database_dir = os.path.dirname(os.path.dirname(chain[0]))
+        parent_path = os.path.join(database_dir, *manifest['parent'].split('/'))
+        if not os.path.exists(parent_path):
+            raise FileNotFoundError(f"Backup chain of {backup_path} is broken, {parent_path} is missing.")
+        chain.insert(0, parent_path)
+        manifest = read_manifest(os.path.dirname(parent_path))
+    return chain
+
+def backup_timestamp(backup_path):
+    # When a backup was taken, from its host/db/timestamp directory or else from the file itself
+    try:
+        return datetime.strptime(os.path.basename(os.path.dirname(backup_path)), BACKUP_TIMESTAMP_FORMAT)
+    except ValueError:
+        return datetime.fromtimestamp(os.path.getmtime(backup_path))
+
+def is_schema_backup(backup_path):
+    return os.path.basename(os.path.dirname(os.path.dirname(backup_path))).startswith('schema_')
+
+def backup_host(backup_path):
+    # The host directory of a host/db/timestamp backup
+    return os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(backup_path))))
+
+def select_restore_backups(backups, restore_point=None):
+    # One backup per (host, db_name): the latest one, or the latest at or before restore_point.
+    # Databases of the same name on different servers are told apart by the host directory.
+    # Schema-only backups are only picked for databases that have nothing else.
+    selected = {}
+    for db_name, backup_path in backups:
+        taken = backup_timestamp(backup_path)
+        if restore_point is not None and taken > restore_point:
+            continue
+        database = (backup_host(backup_path), db_name)
+        key = (not is_schema_backup(backup_path), taken, backup_path)
+        if database not in selected or key > selected[database]:
+            selected[database] = key
+    return {database: key[2] for database, key in sorted(selected.items())}
+
+def find_chunk_store(backup_path):
+    # The store sits in base_backup_dir, found from host/db/timestamp/db.sql.chunks even if the tree moved
+    directory = os.path.dirname(os.path.abspath(backup_path))
+    while True:
+        store = os.path.join(directory, CHUNK_STORE_DIR)
+        if os.path.isdir(store):
+            return store
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            raise FileNotFoundError(f"No {CHUNK_STORE_DIR} directory found above {backup_path}.")
+        directory = parent
+
+def chunk_path(store, digest, compression='none'):
+    # The codec suffix keeps one content stored with different codecs apart
+    return os.path.join(store, digest[:2], digest + compression_suffix(compression))
+
+def read_chunk_list(path):
+    # (sha256, stored bytes, bytes, codec) per line, in stream order. Lists written before the codec
+    # was recorded have no fourth column, their codec is None and found by magic.
+    chunks = []
+    with open(path, encoding='ascii') as f:
+        for line in f:
+            fields = line.split()
+            compression = fields[3] if len(fields) > 3 else None
+            if compression is not None and compression not in COMPRESSION_METHODS:
+                raise ValueError(f"Unknown compression method '{compression}' in {path}")
+            chunks.append((fields[0], int(fields[1]), int(fields[2]), compression))
+    return chunks
+
+def open_chunk_reader(store, digest, compression):
+    # (raw, source) for one chunk, decoded with the codec its chunk list names
+    path = chunk_path(store, digest, compression)
+    raw = open(path, 'rb')
+    if compression is None:
+        return raw, open_backup_reader(path, raw)
+    return raw, open_compressed_reader(raw, compression, path)
+
+def open_restore_reader(path):
+    # (raw, source): raw.tell() is how much of the stored backup is consumed, source yields the SQL
+    if path.endswith(CHUNK_LIST_SUFFIX):
+        reader = ChunkedBackupReader(path)
+        return reader, reader
+    raw = open(path, 'rb')
+    return raw, open_backup_reader(path, raw)
+
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def role_header_length(data, at_eof=False):
+    # Length of the CREATE ROLE lines our plain backups carry in front of pg_dump's output,
+    # or None while data ends before the end of that header can be known
+    pos = 0
+    while True:
+        rest = data[pos:pos + len(ROLE_HEADER_PREFIX)]
+        if not at_eof and len(rest) < len(ROLE_HEADER_PREFIX) and ROLE_HEADER_PREFIX.startswith(rest):
+            return None
+        if rest != ROLE_HEADER_PREFIX:
+            return pos
+        end = data.find(b'\n', pos)
+        if end < 0:
+            return len(data) if at_eof else None
+        pos = end + 1
+
+def format_size(num_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+def path_size(path):
+    # Size of a backup file, of every file inside a directory archive or of the chunks a chunk list uses
+    if path.endswith(CHUNK_LIST_SUFFIX):
+        try:
+            return sum(chunk[1] for chunk in read_chunk_list(path))
+        except (OSError, ValueError):
+            return 0
+    if os.path.isdir(path):
+        total = 0
+        for entry in os.scandir(path):
+            if entry.is_file():
+                total += entry.stat().st_size
+        return total
+    if os.path.exists(path):
+        return os.path.getsize(path)
+    return 0
+
+# Byte counters for one or more concurrent streams, rendered as percent, MB/s and ETA.
+# The aggregate never passes 99% until every stream is finished, estimates are only estimates.
+class TransferProgress:
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._estimates = {}
+        self._done = {}
+        self._finished = set()
+        self._started = time.monotonic()
+        self._last_emit = 0.0
+
+    def set_estimate(self, key, estimated_bytes):
+        with self._lock:
+            self._estimates[key] = max(int(estimated_bytes or 0), 1)
+            self._done.setdefault(key, 0)
+
+    def update(self, key, done_bytes):
+        with self._lock:
+            self._done[key] = done_bytes
+
+    def finish(self, key):
+        with self._lock:
+            self._finished.add(key)
+            self._done[key] = max(self._done.get(key, 0), self._estimates.get(key, 1))
+            self._estimates[key] = max(self._estimates.get(key, 1), self._done[key])
+
+    def due(self):
+        # True at most once per interval, so many writers share one signal budget
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_emit < self.interval:
+                return False
+            self._last_emit = now
+            return True
+
+    def snapshot(self):
+        # (percent, bytes streamed, estimated total, bytes per second, seconds left or None)
+        with self._lock:
+            total = sum(self._estimates.values())
+            done = sum(min(self._done.get(key, 0), estimate) for key, estimate in self._estimates.items())
+            streamed = sum(self._done.values())
+            all_finished = bool(self._estimates) and len(self._finished) == len(self._estimates)
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        rate = streamed / elapsed
+        percent = 100 if all_finished else min(99, int(done * 100 / total)) if total else 0
+        eta = (total - done) / rate if rate > 0 and not all_finished else None
+        return percent, streamed, total, rate, eta
+
+    def describe(self, label):
+        _percent, streamed, total, rate, eta = self.snapshot()
+        text = f"{label}: {format_size(streamed)} of ~{format_size(total)}, {format_size(rate)}/s"
+        if eta is not None:
+            text += f", ETA {format_duration(eta)}"
+        return text
+
+def backup_entry(path):
+    # (db_name, extension) when path is something restore can use, else None
+    if os.path.isdir(path):
+        if is_directory_archive(path):
+            return os.path.splitext(os.path.basename(path))[0], DIRECTORY_FORMAT
+        if is_copy_export(path):
+            return os.path.splitext(os.path.basename(path))[0], COPY_FORMAT
+        return None
+    file_name = os.path.basename(path)
+    if file_name.endswith((ROLES_FILE_SUFFIX, GLOBALS_FILE_SUFFIX)) or file_name.endswith('.tmp'):
+        return None
+    db_name, extension = split_backup_name(file_name)
+    if extension in ('.sql', '.backup'):
+        return db_name, extension
+    return None
+
+def walk_backups(root):
+    # (db_name, path) for every dump file or directory archive below root, the slow full scan
+    backups = []
+    for current, dirs, files in os.walk(root):
+        if current == root and CHUNK_STORE_DIR in dirs:
+            # Only chunk lists point into the store, it holds no backups of its own
+            dirs.remove(CHUNK_STORE_DIR)
+        entry = backup_entry(current)
+        if entry:
+            # A pg_dump directory archive is restored as a whole
+            dirs[:] = []
+            backups.append((entry[0], current))
+            continue
+        for file in files:
+            entry = backup_entry(os.path.join(current, file))
+            if entry:
+                backups.append((entry[0], os.path.join(current, file)))
+    # host/db/timestamp paths sort oldest first within each database
+    return sorted(backups)
+
+def find_catalog_root(path):
+    # The base backup directory whose catalog covers path, at path or above it like find_chunk_store;
+    # None for a tree no backup was ever written to
+    directory = os.path.abspath(path)
+    while True:
+        if os.path.isfile(os.path.join(directory, CATALOG_FILE)):
+            return directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+def is_below(path, directory):
+    # path is directory itself or somewhere inside it, both absolute
+    return path == directory or path.startswith(os.path.join(directory, ''))
+
+# Index of every backup below root. A sync only lists directories whose mtime changed since the
+# previous one; backup directories holding a manifest are never changed in place and are not even
+# stat'ed again, removing one shows up as a change of its parent.
+class BackupCatalog:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.conn = sqlite3.connect(os.path.join(self.root, CATALOG_FILE), timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime REAL,
+                sealed INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS backups (
+                path TEXT PRIMARY KEY,
+                directory TEXT NOT NULL,
+                host TEXT,
+                db_name TEXT NOT NULL,
+                backup_type TEXT,
+                format TEXT,
+                timestamp TEXT,
+                size INTEGER,
+                sha256 TEXT
+            );
+            CREATE INDEX IF NOT EXISTS backups_db_name ON backups (db_name, path);
+            CREATE INDEX IF NOT EXISTS backups_directory ON backups (directory);
+            CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def relative(self, path):
+        rel = os.path.relpath(os.path.abspath(path), self.root)
+        return '' if rel == '.' else rel.replace(os.sep, '/')
+
+    def absolute(self, rel):
+        return os.path.join(self.root, *rel.split('/')) if rel else self.root
+
+    def backup_row(self, path, manifest=None):
+        entry = backup_entry(path)
+        if entry is None:
+            return None
+        db_name, extension = entry
+        directory = os.path.dirname(path)
+        if manifest is None:
+            manifest = read_manifest(directory) or {}
+        if manifest.get('file') != os.path.basename(path):
+            # Older backups without a manifest only have what the path tells
+            manifest = {}
+        return (
+            self.relative(path),
+            self.relative(directory),
+            manifest.get('host'),
+            db_name,
+            manifest.get('backup_type'),
+            manifest.get('file_extension', extension.lstrip('.')),
+            os.path.basename(directory),
+            manifest['bytes'] if 'bytes' in manifest else path_size(path),
+            manifest.get('sha256'),
+        )
+
+    def add_backup(self, path, manifest=None):
+        # Called right after a backup is written, the next sync then finds nothing new there
+        row = self.backup_row(path, manifest)
+        if row is None:
+            return
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def sync(self):
+        known = {path: (mtime, sealed) for path, mtime, sealed in
+                 self.conn.execute("SELECT path, mtime, sealed FROM directories")}
+        children = {}
+        for path, parent in self.conn.execute("SELECT path, parent FROM directories"):
+            children.setdefault(parent, []).append(path)
+        seen = set()
+        pending = ['']
+        now = time.time()
+        with self.conn:
+            while pending:
+                rel = pending.pop()
+                seen.add(rel)
+                mtime, sealed = known.get(rel, (None, 0))
+                if sealed:
+                    continue
+                full = self.absolute(rel)
+                try:
+                    current_mtime = os.stat(full).st_mtime
+                except FileNotFoundError:
+                    seen.discard(rel)
+                    continue
+                if mtime == current_mtime:
+                    pending.extend(children.get(rel, []))
+                    continue
+                pending.extend(self.list_directory(rel, full, known))
+                if now - current_mtime < CATALOG_MTIME_SLACK:
+                    current_mtime = None
+                self.conn.execute("UPDATE directories SET mtime = ? WHERE path = ?", (current_mtime, rel))
+            # Whatever was not reached any more is gone from disk
+            for rel in set(known) - seen:
+                self.conn.execute("DELETE FROM directories WHERE path = ?", (rel,))
+                self.conn.execute("DELETE FROM backups WHERE directory = ?", (rel,))
+
+    def list_directory(self, rel, full, known):
+        # Brings the rows of one changed directory up to date, returns its subdirectories to visit
+        subdirectories = []
+        found = set()
+        try:
+            entries = list(os.scandir(full))
+        except OSError as e:
+            print(f"Error listing backup directory '{full}': {e}")
+            return subdirectories
+        sealed = 1 if any(entry.name == MANIFEST_FILE for entry in entries) else 0
+        if rel not in known:
+            parent = rel.rsplit('/', 1)[0] if '/' in rel else ('' if rel else None)
+            self.conn.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, NULL, ?)", (rel, parent, sealed))
+        elif sealed:
+            self.conn.execute("UPDATE directories SET sealed = 1 WHERE path = ?", (rel,))
+        existing = {path for path, in self.conn.execute("SELECT path FROM backups WHERE directory = ?", (rel,))}
+        for entry in entries:
+            child = f"{rel}/{entry.name}" if rel else entry.name
+            if child == CHUNK_STORE_DIR:
+                # Thousands of chunk files that change with every backup, never worth listing
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if is_backup_directory(entry.path):
+                    found.add(child)
+                else:
+                    subdirectories.append(child)
+                    if child not in known:
+                        known[child] = (None, 0)
+                        self.conn.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, NULL, 0)",
+                                          (child, rel))
+            elif backup_entry(entry.path):
+                found.add(child)
+        # A manifest appears last, once it is there the rows are read again to pick it up
+        for child in (found if sealed else found - existing):
+            row = self.backup_row(self.absolute(child))
+            if row:
+                self.conn.execute("INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        for child in existing - found:
+            self.conn.execute("DELETE FROM backups WHERE path = ?", (child,))
+        return subdirectories
+
+    def backups(self, db_name=None):
+        # (db_name, path) sorted like walk_backups, host/db/timestamp paths oldest first per database
+        query = "SELECT db_name, path FROM backups"
+        params = ()
+        if db_name is not None:
+            query += " WHERE db_name = ?"
+            params = (db_name,)
+        return [(name, self.absolute(rel)) for name, rel in self.conn.execute(query + " ORDER BY db_name, path", params)]
+
+    def entries(self, db_name=None):
+        # Every column of the backups below root, as dicts, in the order of backups()
+        query = "SELECT * FROM backups"
+        params = ()
+        if db_name is not None:
+            query += " WHERE db_name = ?"
+            params = (db_name,)
+        cursor = self.conn.execute(query + " ORDER BY db_name, path", params)
+        columns = [column[0] for column in cursor.description]
+        entries = []
+        for row in cursor:
+            entry = dict(zip(columns, row))
+            entry['path'] = self.absolute(entry['path'])
+            entries.append(entry)
+        return entries
+
+    def backup_directories(self):
+        # (directory, backup_type, size) per backup directory, a directory archive or chunk list
+        # and its roles file or manifest count as one
+        return list(self.conn.execute("""
+            SELECT directory, MAX(backup_type), SUM(size) FROM backups GROUP BY directory ORDER BY directory
+        """))
+
+    def chunk_lists(self):
+        return [self.absolute(rel) for rel, in
+                self.conn.execute("SELECT path FROM backups WHERE path LIKE ?", (f"%{CHUNK_LIST_SUFFIX}",))]
+
+    def remove_directories(self, rels):
+        with self.conn:
+            for rel in rels:
+                self.conn.execute("DELETE FROM backups WHERE directory = ?", (rel,))
+                self.conn.execute("DELETE FROM directories WHERE path = ? OR path LIKE ?", (rel, f"{rel}/%"))
+
+def retention_period(taken, period):
+    if period == 'hourly':
+        return taken.strftime("%Y-%m-%d %H")
+    if period == 'daily':
+        return taken.date()
+    if period == 'weekly':
+        return taken.isocalendar()[:2]
+    return taken.year, taken.month
+
+def parse_retention(spec):
+    # "daily=7,weekly=4" -> {'daily': 7, 'weekly': 4}, the form scheduled tasks pass it in
+    policy = {}
+    for item in filter(None, spec.split(',')):
+        period, _, count = item.partition('=')
+        if period.strip() not in RETENTION_PERIODS:
+            raise ValueError(f"Unknown retention period '{period.strip()}', use one of {', '.join(RETENTION_PERIODS)}.")
+        policy[period.strip()] = int(count)
+    return policy
+
+def format_retention(policy):
+    return ",".join(f"{period}={policy[period]}" for period in RETENTION_PERIODS if policy.get(period))
+
+def plan_retention(directories, policy):
+    # directories: (directory, backup_type, size) rows of one host/db directory.
+    # Returns the set of directories to keep, the newest one and incremental chains are always kept.
+    dated = []
+    for directory, backup_type, size in directories:
+        try:
+            taken = datetime.strptime(directory.rsplit('/', 1)[-1], BACKUP_TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+        dated.append((taken, directory, backup_type))
+    dated.sort(reverse=True)
+    keep = {dated[0][1]} if dated else set()
+    for period in RETENTION_PERIODS:
+        count = policy.get(period, 0)
+        last = None
+        for taken, directory, _backup_type in dated:
+            if count <= 0:
+                break
+            current = retention_period(taken, period)
+            if current != last:
+                keep.add(directory)
+                last = current
+                count -= 1
+    return keep
+
+def prune_backups(root, policy, host=None, db_name=None, dry_run=False):
+    # Applies policy to every host/db directory of the catalog below root, or only to the ones of
+    # host and db_name. Returns the report lines, deleted directories are listed as "prune".
+    report = []
+    with BackupCatalog(root) as catalog:
+        catalog.sync()
+        groups = {}
+        for directory, backup_type, size in catalog.backup_directories():
+            if '/' not in directory:
+                continue  # Only host/db/timestamp directories are ever deleted
+            group = directory.rsplit('/', 1)[0]
+            group_host = group.split('/', 1)[0]
+            group_db = group.rsplit('/', 1)[-1]
+            if host is not None and group_host != host:
+                continue
+            if db_name is not None and group_db not in (db_name, f"schema_{db_name}"):
+                continue
+            groups.setdefault(group, []).append((directory, backup_type, size))
+
+        doomed = []
+        freed = 0
+        for group, directories in sorted(groups.items()):
+            keep = plan_retention(directories, policy)
+            # Incrementals are useless without the backups they build on
+            pending = [directory for directory, backup_type, _size in directories
+                       if directory in keep and backup_type == INCREMENTAL_BACKUP]
+            while pending:
+                manifest = read_manifest(catalog.absolute(pending.pop()))
+                if manifest and manifest.get('parent'):
+                    parent = f"{group}/{manifest['parent'].split('/')[0]}"
+                    if parent not in keep:
+                        keep.add(parent)
+                        pending.append(parent)
+            pruned = [(directory, size) for directory, _backup_type, size in directories
+                      if directory not in keep and is_timestamp_directory(directory)]
+            group_size = sum(size or 0 for _directory, size in pruned)
+            report.append(f"{group}: keep {len(directories) - len(pruned)}, prune {len(pruned)} ({format_size(group_size)})")
+            report.extend(f"  prune {directory}" for directory, _size in pruned)
+            doomed.extend(directory for directory, _size in pruned)
+            freed += group_size
+
+        report.append(f"{'Would free' if dry_run else 'Freed'} {format_size(freed)} in {len(doomed)} backup(s)")
+        if dry_run or not doomed:
+            return report
+
+        for start in range(0, len(doomed), PRUNE_BATCH_SIZE):
+            batch = doomed[start:start + PRUNE_BATCH_SIZE]
+            removed = []
+            for directory in batch:
+                try:
+                    shutil.rmtree(catalog.absolute(directory))
+                    removed.append(directory)
+                except OSError as e:
+                    report.append(f"Error pruning {directory}: {e}")
+            # The catalog follows every batch, an interrupted prune leaves it accurate
+            catalog.remove_directories(removed)
+
+        store = os.path.join(catalog.root, CHUNK_STORE_DIR)
+        if os.path.isdir(store):
+            collected, collected_bytes = collect_chunks(store, catalog.chunk_lists())
+            report.append(f"Collected {collected} unused chunk(s) ({format_size(collected_bytes)})")
+    return report
+
+def verify_backup(backup_path):
+    # Problems found checking a backup against its manifest, None when there is no manifest to check against
+    directory = os.path.dirname(backup_path)
+    manifest = read_manifest(directory)
+    if not manifest or manifest.get('file') != os.path.basename(backup_path):
+        return None
+    problems = []
+    if not os.path.exists(backup_path):
+        return [f"{backup_path} is missing"]
+    if 'files' in manifest:
+        # Directory archive, every file pg_dump wrote was hashed when the backup was taken
+        actual = directory_checksums(backup_path)
+        for name, expected in manifest['files'].items():
+            if name not in actual:
+                problems.append(f"{name} is missing from the archive")
+            elif actual[name]['sha256'] != expected['sha256']:
+                problems.append(f"{name} does not match its checksum")
+        problems.extend(f"{name} is not part of the archive" for name in set(actual) - set(manifest['files']))
+    elif manifest.get('sha256') and file_checksum(backup_path) != manifest['sha256']:
+        problems.append(f"{os.path.basename(backup_path)} does not match its checksum")
+    if manifest.get('roles_sha256'):
+        roles_file = os.path.join(directory, manifest['roles_file'])
+        if not os.path.exists(roles_file):
+            problems.append(f"{manifest['roles_file']} is missing")
+        elif file_checksum(roles_file) != manifest['roles_sha256']:
+            problems.append(f"{manifest['roles_file']} does not match its checksum")
+    if manifest.get('globals_sha256'):
+        globals_file = os.path.normpath(os.path.join(directory, manifest['globals_file']))
+        if not os.path.exists(globals_file):
+            problems.append(f"{globals_file} is missing")
+        elif file_checksum(globals_file) != manifest['globals_sha256']:
+            problems.append(f"{globals_file} does not match its checksum")
+    if backup_path.endswith(CHUNK_LIST_SUFFIX) and not problems:
+        problems.extend(verify_chunks(backup_path))
+    if manifest.get('backup_type') == INCREMENTAL_BACKUP:
+        try:
+            resolve_backup_chain(backup_path)
+        except FileNotFoundError as e:
+            problems.append(str(e))
+    return problems
+
+def backup_globals_file(backup_path):
+    # The globals file a backup goes with, None for older backups that carry their roles themselves
+    directory = os.path.dirname(backup_path)
+    manifest = read_manifest(directory)
+    if not manifest or not manifest.get('globals_file'):
+        return None
+    path = os.path.normpath(os.path.join(directory, manifest['globals_file']))
+    return path if os.path.exists(path) else None
+
+def globals_sql(cursor):
+    # CREATE ROLE, GRANT role TO member and CREATE TABLESPACE statements for the whole cluster.
+    # Replayed on a server that has some of them already, those statements fail and the rest go on.
+    cursor.execute("""
+        SELECT r.rolname, r.rolsuper, r.rolinherit, r.rolcreaterole,
+               r.rolcreatedb, r.rolcanlogin, r.rolpassword
+        FROM pg_authid r JOIN pg_roles u ON r.oid = u.oid
+        ORDER BY r.rolname;
+    """)
+    lines = []
+    for rolename, rolsuper, rolinherit, rolcreaterole, rolcreatedb, rolcanlogin, rolpassword in cursor.fetchall():
+        line = f'CREATE ROLE {quote_ident(rolename)} WITH '
+        if rolsuper:
+            line += "SUPERUSER "
+        if not rolinherit:
+            line += "NOINHERIT "
+        if rolcreaterole:
+            line += "CREATEROLE "
+        if rolcreatedb:
+            line += "CREATEDB "
+        if rolcanlogin:
+            line += "LOGIN "
+        if rolpassword:
+            line += f"ENCRYPTED PASSWORD '{rolpassword}' "
+        lines.append(line + ";\n")
+    cursor.execute("""
+        SELECT r.rolname, m.rolname, a.admin_option
+        FROM pg_auth_members a
+        JOIN pg_roles r ON r.oid = a.roleid
+        JOIN pg_roles m ON m.oid = a.member
+        ORDER BY 1, 2;
+    """)
+    for role, member, admin_option in cursor.fetchall():
+        lines.append(f"GRANT {quote_ident(role)} TO {quote_ident(member)}{' WITH ADMIN OPTION' if admin_option else ''};\n")
+    cursor.execute("""
+        SELECT t.spcname, pg_get_userbyid(t.spcowner), pg_tablespace_location(t.oid)
+        FROM pg_tablespace t
+        WHERE t.spcname NOT IN ('pg_default', 'pg_global')
+        ORDER BY 1;
+    """)
+    for name, owner, location in cursor.fetchall():
+        location = location.replace("'", "''")
+        lines.append(f"CREATE TABLESPACE {quote_ident(name)} OWNER {quote_ident(owner)} LOCATION '{location}';\n")
+    return "".join(lines).encode('utf-8')
+
+def store_globals(host_dir, data, timestamp):
+    # Path of the globals file holding data: the latest one when nothing changed, else a new one
+    globals_dir = os.path.join(host_dir, GLOBALS_DIR)
+    os.makedirs(globals_dir, exist_ok=True)
+    checksum = hashlib.sha256(data).hexdigest()
+    existing = sorted(name for name in os.listdir(globals_dir) if name.endswith(GLOBALS_FILE_SUFFIX))
+    if existing:
+        latest = os.path.join(globals_dir, existing[-1])
+        if file_checksum(latest) == checksum:
+            return latest, checksum
+    path = os.path.join(globals_dir, timestamp + GLOBALS_FILE_SUFFIX)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    return path, checksum
+
+def verify_chunks(chunk_list_path):
+    # Every chunk must be there and decompress to the content its name is the SHA-256 of
+    problems = []
+    store = find_chunk_store(chunk_list_path)
+    for digest, _stored_size, size, compression in read_chunk_list(chunk_list_path):
+        if not os.path.exists(chunk_path(store, digest, compression)):
+            problems.append(f"chunk {digest} is missing")
+            continue
+        sha256 = hashlib.sha256()
+        length = 0
+        raw, source = open_chunk_reader(store, digest, compression)
+        with raw, source:
+            for block in iter(lambda: source.read(STREAM_CHUNK_SIZE), b''):
+                sha256.update(block)
+                length += len(block)
+        if sha256.hexdigest() != digest or length != size:
+            problems.append(f"chunk {digest} is corrupt")
+    return problems
+
+def is_timestamp_directory(directory):
+    try:
+        datetime.strptime(directory.rsplit('/', 1)[-1], BACKUP_TIMESTAMP_FORMAT)
+        return True
+    except ValueError:
+        return False
+
+def collect_chunks(store, chunk_lists):
+    # Deletes chunks no remaining chunk list refers to, skipping recent ones a running backup may still use
+    referenced = set()
+    for path in chunk_lists:
+        try:
+            referenced.update(chunk[0] for chunk in read_chunk_list(path))
+        except (OSError, ValueError) as e:
+            # Without every list the set of live chunks is unknown, nothing may be deleted
+            print(f"Error reading chunk list '{path}', skipping chunk collection: {e}")
+            return 0, 0
+    cutoff = time.time() - CHUNK_GC_GRACE
+    collected = 0
+    collected_bytes = 0
+    for prefix in os.scandir(store):
+        if not prefix.is_dir():
+            continue
+        for entry in os.scandir(prefix.path):
+            name = entry.name.split('.', 1)[0]
+            stat = entry.stat()
+            if name in referenced or stat.st_mtime > cutoff:
+                continue
+            try:
+                os.remove(entry.path)
+                collected += 1
+                collected_bytes += stat.st_size
+            except OSError as e:
+                print(f"Error removing chunk '{entry.path}': {e}")
+    return collected, collected_bytes
+
+def state_directory():
+    # Per-user files that belong to no backup directory: run history, scheduler state
+    base = os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(base, 'mo-backup')
+
+def run_history_path():
+    return os.environ.get(RUN_HISTORY_ENV) or os.path.join(state_directory(), RUN_HISTORY_FILE)
+
+def median_or_none(values):
+    return statistics.median(values) if values else None
+
+def throughput(runs):
+    seconds = sum(run['seconds'] for run in runs)
+    return sum(run['bytes'] for run in runs) / seconds if seconds else None
+
+# Every backup and restore run, whoever started it: the GUI, backup_cli.py or a scheduled script.
+# databases holds one dict per database with its bytes, seconds, phase seconds and error.
+class RunHistory:
+    def __init__(self, path=None):
+        self.path = path or run_history_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                source TEXT,
+                label TEXT,
+                host TEXT,
+                backup_type TEXT,
+                format TEXT,
+                run_key TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                finished_at TEXT NOT NULL,
+                seconds REAL NOT NULL,
+                bytes INTEGER NOT NULL,
+                success INTEGER NOT NULL,
+                error TEXT,
+                baseline_seconds REAL,
+                phases TEXT,
+                databases TEXT
+            );
+            CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+            CREATE INDEX IF NOT EXISTS runs_run_key ON runs (run_key, started_at);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def baseline(self, run_key):
+        # Median duration of the last successful runs of the same kind, host, databases and format
+        seconds = [row[0] for row in self.conn.execute(
+            "SELECT seconds FROM runs WHERE run_key = ? AND success = 1 ORDER BY started_at DESC LIMIT ?",
+            (run_key, SLOW_RUN_BASELINE_RUNS))]
+        return median_or_none(seconds)
+
+    def record(self, kind, started_at, finished_at, databases, success, error=None, source=None, label=None,
+               host=None, backup_type=None, file_format=None):
+        names = ','.join(sorted(database['db_name'] for database in databases))
+        run_key = '|'.join([kind, host or '', names, backup_type or '', file_format or ''])
+        phases = {}
+        for database in databases:
+            for phase, seconds in database.get('phases', {}).items():
+                phases[phase] = round(phases.get(phase, 0) + seconds, 3)
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (kind, source, label, host, backup_type, format, run_key, started_at, finished_at, "
+                "seconds, bytes, success, error, baseline_seconds, phases, databases) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, source, label, host, backup_type, file_format, run_key,
+                 started_at.isoformat(timespec='seconds'), finished_at.isoformat(timespec='seconds'),
+                 round((finished_at - started_at).total_seconds(), 3),
+                 sum(database.get('bytes', 0) for database in databases), int(bool(success)), error,
+                 self.baseline(run_key), json.dumps(phases), json.dumps(databases)))
+        return cursor.lastrowid
+
+    def runs(self, limit=50, since=None, kind=None):
+        # Newest first, as dicts; slow is set on runs that took SLOW_RUN_FACTOR times their baseline
+        query = "SELECT * FROM runs WHERE 1 = 1"
+        params = []
+        if since is not None:
+            query += " AND started_at >= ?"
+            params.append(since.isoformat(timespec='seconds'))
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        query += " ORDER BY started_at DESC, id DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        cursor = self.conn.execute(query, params)
+        columns = [column[0] for column in cursor.description]
+        runs = []
+        for row in cursor:
+            run = dict(zip(columns, row))
+            run['success'] = bool(run['success'])
+            run['phases'] = json.loads(run['phases'] or '{}')
+            run['databases'] = json.loads(run['databases'] or '[]')
+            baseline = run['baseline_seconds']
+            run['slow'] = bool(run['success'] and baseline and baseline >= SLOW_RUN_MIN_SECONDS
+                               and run['seconds'] > baseline * SLOW_RUN_FACTOR)
+            runs.append(run)
+        return runs
+
+    def summary(self, days=30, window=10, now=None):
+        # Aggregates for the statistics panel. Throughput is bytes over seconds of the last window
+        # successful backups, and of the window before that for comparison.
+        runs = self.runs(limit=None, since=(now or datetime.now()) - timedelta(days=days))
+        backups = [run for run in runs if run['kind'] == 'backup' and run['success'] and run['seconds'] > 0]
+        finished = [run for run in runs if run['success']]
+        return {
+            'runs': len(runs),
+            'failed': sum(not run['success'] for run in runs),
+            'success_rate': len(finished) / len(runs) if runs else None,
+            'median_seconds': median_or_none([run['seconds'] for run in finished]),
+            'bytes': sum(run['bytes'] for run in finished),
+            'throughput': throughput(backups[:window]),
+            'previous_throughput': throughput(backups[window:window * 2]),
+            'slow_runs': [run for run in runs if run['slow']],
+        }
+
+def record_run(kind, started_at, databases, success, error=None, **details):
+    # The history is a record, never a reason for a backup or restore to fail
+    try:
+        with RunHistory() as history:
+            return history.record(kind, started_at, datetime.now(), databases, success, error, **details)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error recording the run in the history: {e}")
+        return None
+
+def phase_seconds(phases):
+    return {name: phase['seconds'] for name, phase in phases.items()}
+
+# Minimal stand-in for pyqtSignal, BackupThread and RestoreThread forward these to their Qt signals
+class Signal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        for slot in self.slots:
+            slot(*args)
+
+# Idle connections kept per server and role, and how long one may sit unused before it is closed.
+# Whole-server runs touch every database once; what gets reused is the maintenance database the
+# catalog queries and CREATE DATABASE go to, and whatever the next run in the same process needs.
+POOL_MAX_IDLE = 4
+POOL_IDLE_SECONDS = 300
+# A connection idle longer than this gets a SELECT 1 before it is handed out again
+POOL_CHECK_SECONDS = 30
+
+class ConnectionPool:
+    # psycopg2 connections in autocommit, shared by every engine and thread of the process. Taking
+    # one never waits: a new connection is opened whenever no idle one fits, so the number of
+    # connections follows the number of workers and not the number of operations.
+    def __init__(self, max_idle=POOL_MAX_IDLE, idle_seconds=POOL_IDLE_SECONDS, now=time.monotonic):
+        self.max_idle = max_idle
+        self.idle_seconds = idle_seconds
+        self.now = now
+        self.lock = threading.Lock()
+        # (host, port, user, password) -> [(dbname, connection, idle since)], oldest first
+        self.idle = {}
+        # id(connection) -> (key, dbname) while it is out
+        self.taken = {}
+        self.opened = 0
+        self.reused = 0
+
+    def acquire(self, host, port, user, password, dbname='postgres'):
+        import psycopg2
+        key = (host, str(port), user, password)
+        while True:
+            with self.lock:
+                self.expire()
+                entries = self.idle.get(key, [])
+                match = next((entry for entry in reversed(entries) if entry[0] == dbname), None)
+                if match:
+                    entries.remove(match)
+            if not match:
+                break
+            conn, since = match[1], match[2]
+            if self.now() - since > POOL_CHECK_SECONDS:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT 1;")
+                except psycopg2.Error:
+                    # The server restarted or dropped us, try the next one
+                    close_quietly(conn)
+                    continue
+            with self.lock:
+                self.reused += 1
+                self.taken[id(conn)] = (key, dbname)
+            return conn
+        conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+        conn.set_session(autocommit=True)
+        with self.lock:
+            self.opened += 1
+            self.taken[id(conn)] = (key, dbname)
+        return conn
+
+    def release(self, conn):
+        from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+        with self.lock:
+            key, dbname = self.taken.pop(id(conn))
+            # A broken connection, or one left inside a transaction, is not worth handing out
+            if conn.closed or conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                surplus = [conn]
+            else:
+                entries = self.idle.setdefault(key, [])
+                entries.append((dbname, conn, self.now()))
+                surplus = [entry[1] for entry in entries[:-self.max_idle]] if self.max_idle else [conn]
+                del entries[:len(surplus)]
+        for extra in surplus:
+            close_quietly(extra)
+
+    @contextmanager
+    def connection(self, host, port, user, password, dbname='postgres'):
+        conn = self.acquire(host, port, user, password, dbname)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def expire(self):
+        # Called with the lock held
+        cutoff = self.now() - self.idle_seconds
+        for key, entries in list(self.idle.items()):
+            for entry in [entry for entry in entries if entry[2] < cutoff]:
+                entries.remove(entry)
+                close_quietly(entry[1])
+            if not entries:
+                del self.idle[key]
+
+    def close(self):
+        with self.lock:
+            entries = [entry for entries in self.idle.values() for entry in entries]
+            self.idle = {}
+        for entry in entries:
+            close_quietly(entry[1])
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+# The pool of the process, engines use it unless they are given their own
+CONNECTION_POOL = ConnectionPool()
+atexit.register(CONNECTION_POOL.close)
+
+class BackupEngine:
+    def __init__(self, backup_type, file_extension, db_name, db_host, db_port, db_user, db_password, base_backup_dir,
+                 max_workers=None, largest_first=True, dump_jobs=None, compression_level=DEFAULT_COMPRESSION_LEVEL,
+                 compression='none', compression_threads=None, deduplicate=False, source=None, label=None, pool=None,
+                 copy_format='binary'):
+        self.progress = Signal()
+        self.status = Signal()
+        self.backup_type = backup_type
+        self.file_extension = file_extension
+        self.db_name = db_name
+        self.db_host = db_host
+        self.db_port = db_port
+        self.db_user = db_user
+        self.db_password = db_password
+        self.base_backup_dir = base_backup_dir
+        # Number of databases dumped concurrently when backing up a whole server
+        self.max_workers = max_workers or default_backup_workers()
+        self.largest_first = largest_first
+        # pg_dump -j for the directory format, connections per database for COPY exports.
+        # None leaves it to jobs_per_database.
+        self.dump_jobs = dump_jobs
+        self.databases_at_once = 1
+        # 'binary' or 'csv', the COPY format of COPY_BACKUP data files
+        self.copy_format = copy_format
+        # pg_dump -Z for the custom and directory formats, codec level for plain dumps
+        self.compression_level = compression_level
+        # Codec applied while streaming plain dumps, see COMPRESSION_METHODS
+        self.compression = compression
+        self.compression_threads = compression_threads or default_backup_workers()
+        # Plain dumps go to the chunk store under base_backup_dir, see ChunkingWriter
+        self.deduplicate = deduplicate
+        # Who started the run and for what, kept with it in the run history
+        self.source = source
+        self.label = label
+        self.failed_databases = []
+        self.run_databases = []
+        self.transfer = TransferProgress()
+        self._pg_dump_version = None
+        # (path, sha256) of the globals file, captured by the first database of a run
+        self.globals = None
+        self.globals_lock = threading.Lock()
+        self.pool = pool or CONNECTION_POOL
+
+    def run(self):
+        # (success, message), the outcome BackupThread passes on with its finished signal
+        started_at = datetime.now()
+        self.run_databases = []
+        self.globals = None
+        try:
+            if self.db_name:
+                success = self.backup_database(self.backup_type, self.file_extension, self.db_name)
+            else:
+                success = self.backup_all_databases(self.backup_type, self.file_extension)
+            if success:
+                message = "Backup completed successfully."
+            elif self.failed_databases:
+                message = f"Backup failed for: {', '.join(self.failed_databases)}"
+            else:
+                message = "Backup failed."
+        except Exception as e:
+            success, message = False, f"An error occurred: {str(e)}"
+        record_run('backup', started_at, self.run_databases, success, None if success else message,
+                   source=self.source, label=self.label, host=self.db_host, backup_type=self.backup_type,
+                   file_format=COPY_FORMAT if self.backup_type == COPY_BACKUP else self.file_extension)
+        return success, message
+
+    def report_database_progress(self, db_name, done_bytes):
+        # Called for every chunk, only every PROGRESS_INTERVAL turns into Qt signals
+        self.transfer.update(db_name, done_bytes)
+        if self.transfer.due():
+            label = f"Backing up {self.db_name}" if self.db_name else "Backing up databases"
+            self.progress.emit(self.transfer.snapshot()[0])
+            self.status.emit(self.transfer.describe(label))
+
+    def finish_database_progress(self, db_name):
+        self.transfer.finish(db_name)
+        self.progress.emit(self.transfer.snapshot()[0])
+
+    def estimate_dump_size(self, cursor, backup_type):
+        if backup_type == 'Schema':
+            # A schema-only dump grows with the catalogs describing the objects, not with the data
+            cursor.execute("""
+                SELECT COALESCE(SUM(pg_relation_size(c.oid)), 0)
+                FROM pg_class c
+                WHERE c.relnamespace = 'pg_catalog'::regnamespace
+                  AND c.relname IN ('pg_class', 'pg_attribute', 'pg_constraint', 'pg_index',
+                                    'pg_proc', 'pg_trigger', 'pg_rewrite', 'pg_description');
+            """)
+        else:
+            # Table and TOAST data is what pg_dump writes out, index pages are not
+            cursor.execute("""
+                SELECT COALESCE(SUM(pg_table_size(c.oid)), 0)
+                FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.relkind IN ('r', 'm', 'p')
+                  AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+                  AND n.nspname NOT LIKE 'pg_toast%';
+            """)
+        estimate = cursor.fetchone()[0]
+        if not estimate:
+            cursor.execute("SELECT pg_database_size(current_database());")
+            estimate = cursor.fetchone()[0]
+        return estimate
+
+    def archive_size_estimate(self, database_dir, file_extension, estimate):
+        # Archives are followed by their size on disk, which pg_dump -Z keeps well below the table
+        # data estimate; scaled by what the previous archive of this database came to
+        if self.compression_level == 0:
+            return estimate
+        _timestamp, previous = latest_backup_manifest(database_dir)
+        if previous and previous.get('file_extension') == file_extension and previous.get('estimate') \
+                and previous.get('compression_level') == self.compression_level:
+            return estimate * previous['bytes'] / previous['estimate']
+        return estimate * ARCHIVE_COMPRESSION_RATIO
+
+    def find_pg_dump(self):
+        return find_pg_executable('pg_dump')
+
+    def backup_database(self, backup_type, file_extension, db_name):
+        import psycopg2
+        started_at = datetime.now()
+        timestamp = started_at.strftime(BACKUP_TIMESTAMP_FORMAT)
+        phases = {}
+        pg_dump_path = self.find_pg_dump()
+        is_copy = backup_type == COPY_BACKUP
+        if is_copy:
+            file_extension = COPY_FORMAT
+        is_archive = file_extension in (DIRECTORY_FORMAT, CUSTOM_FORMAT)
+        # Archive formats compress themselves, only plain dumps and COPY data files go through our codecs
+        compression = 'none' if is_archive else (self.compression or 'none')
+        deduplicate = self.deduplicate and not is_archive and not is_copy
+        if is_copy:
+            # The data files inside carry the codec suffix
+            backup_file_name = f"{db_name}.{COPY_FORMAT}"
+        elif deduplicate:
+            # Chunks are compressed one by one, the list itself stays plain text
+            backup_file_name = f"{db_name}.{file_extension}{CHUNK_LIST_SUFFIX}"
+        else:
+            backup_file_name = f"{db_name}.{file_extension}{compression_suffix(compression)}"
+        temp_backup_file = os.path.join(self.base_backup_dir, backup_file_name)
+        conn = None
+        cursor = None
+
+        try:
+            phase_start = datetime.now()
+            conn = self.pool.acquire(self.db_host, self.db_port, self.db_user, self.db_password, db_name)
+            cursor = conn.cursor()
+
+            if backup_type == 'Schema':
+                database_dir = os.path.join(self.base_backup_dir, self.db_host, f"schema_{db_name}")
+            else:
+                database_dir = os.path.join(self.base_backup_dir, self.db_host, db_name)
+
+            table_state = None
+            incremental = None
+            if backup_type not in ('Schema', COPY_BACKUP) and not is_archive:
+                # Recorded with every plain full backup so a later incremental can build on it
+                table_state = self.read_table_state(cursor)
+            if backup_type == INCREMENTAL_BACKUP:
+                if is_archive:
+                    self.status.emit(f"Incremental backups need the .sql format, taking a full backup of {db_name}")
+                else:
+                    incremental = self.plan_incremental(database_dir, table_state)
+
+            estimate = incremental['estimate'] if incremental else self.estimate_dump_size(cursor, backup_type)
+            if is_archive:
+                self.transfer.set_estimate(db_name, self.archive_size_estimate(database_dir, file_extension, estimate))
+            else:
+                self.transfer.set_estimate(db_name, estimate)
+            record_phase(phases, 'prepare', phase_start)
+
+            phase_start = datetime.now()
+            globals_path, globals_checksum = self.capture_globals(cursor)
+            record_phase(phases, 'globals', phase_start)
+            # Back to the pool for the next worker while pg_dump runs with its own connections
+            server_version = conn.server_version
+            cursor.close()
+            self.pool.release(conn)
+            conn = cursor = None
+            if file_extension in (DIRECTORY_FORMAT, COPY_FORMAT):
+                # pg_dump refuses to write into an existing directory
+                remove_backup_path(temp_backup_file)
+
+            phase_start = datetime.now()
+            self.status.emit(f"Backing up database {db_name}")
+            os.environ['PGPASSWORD'] = self.db_password
+            pg_dump_cmd = [
+                pg_dump_path,
+                "-h", self.db_host,
+                "-p", self.db_port,
+                "-U", self.db_user,
+                "-d", db_name
+            ]
+            if file_extension == DIRECTORY_FORMAT:
+                # Directory format is the only one pg_dump can write with several jobs
+                pg_dump_cmd += ["-F", "d", "-j", str(self.jobs_per_database()), "-f", temp_backup_file]
+            elif file_extension == CUSTOM_FORMAT:
+                # Written to a file, not a pipe: only then can pg_dump go back and store the data
+                # offsets in the archive's TOC, which pg_restore -j needs
+                pg_dump_cmd += ["-F", "c", "-f", temp_backup_file]
+            else:
+                pg_dump_cmd += ["-F", "p"]  # Plain text format for SQL output
+            if is_archive:
+                pg_dump_cmd += ["-Z", str(self.compression_level)]
+            if backup_type == 'Schema':
+                pg_dump_cmd.append("-s")  # Schema-only
+            if incremental:
+                # Only the data of tables modified since the previous backup
+                pg_dump_cmd.append("--data-only")
+                for schema, table in incremental['tables']:
+                    pg_dump_cmd += ["-t", f"{quote_ident(schema)}.{quote_ident(table)}"]
+
+            stream_bytes = 0
+            checksum = None
+            # stderr goes to a spool file so a chatty pg_dump can never block on a full pipe
+            with tempfile.TemporaryFile() as stderr_file:
+                if is_copy:
+                    process = None
+                    export = self.export_tables(pg_dump_path, db_name, temp_backup_file, compression)
+                    stream_bytes = export['stream_bytes']
+                elif is_archive:
+                    process = subprocess.Popen(pg_dump_cmd, stdout=subprocess.DEVNULL, stderr=stderr_file)
+                    # pg_dump writes the archive itself, follow it by its (compressed) size on disk
+                    while process.poll() is None:
+                        time.sleep(PROGRESS_INTERVAL)
+                        self.report_database_progress(db_name, path_size(temp_backup_file))
+                elif incremental and not incremental['tables']:
+                    # Nothing changed, the incremental only records the table state
+                    process = None
+                    with HashingWriter(open(temp_backup_file, "wb")) as raw:
+                        with self.open_dump_writer(raw, compression, deduplicate) as f:
+                            f.write(b"-- No table changed since the previous backup\n")
+                    checksum = raw.sha256.hexdigest()
+                else:
+                    process = subprocess.Popen(pg_dump_cmd, stdout=subprocess.PIPE, stderr=stderr_file,
+                                               bufsize=0)
+                    # The checksum covers the bytes as they land on disk, no second read is needed
+                    with HashingWriter(open(temp_backup_file, "wb")) as raw:
+                        with self.open_dump_writer(raw, compression, deduplicate) as f:
+                            if incremental:
+                                f.write(self.incremental_header(incremental['tables']))
+                            stream_bytes = self.stream_dump(process.stdout, f, db_name)
+                            if incremental:
+                                f.write(b"RESET session_replication_role;\n")
+                    checksum = raw.sha256.hexdigest()
+                    process.stdout.close()
+                if deduplicate:
+                    chunk_stats = {'chunks': f.chunks, 'new_chunks': f.new_chunks, 'new_chunk_bytes': f.new_bytes}
+                if process is not None and process.wait() != 0:
+                    stderr_file.seek(0)
+                    raise subprocess.CalledProcessError(process.returncode, pg_dump_cmd,
+                                                        stderr=stderr_file.read().decode('utf-8', 'replace'))
+            if file_extension == CUSTOM_FORMAT:
+                checksum = file_checksum(temp_backup_file)
+                stream_bytes = os.path.getsize(temp_backup_file)
+            record_phase(phases, 'dump', phase_start)
+
+            phase_start = datetime.now()
+            backup_dir = os.path.join(database_dir, timestamp)
+
+            os.makedirs(backup_dir, exist_ok=True)
+            final_backup_file = os.path.join(backup_dir, backup_file_name)
+            os.rename(temp_backup_file, final_backup_file)
+
+            manifest = {
+                'manifest_version': MANIFEST_VERSION,
+                'db_name': db_name,
+                'host': self.db_host,
+                'port': self.db_port,
+                'backup_type': INCREMENTAL_BACKUP if incremental else backup_type,
+                'file_extension': file_extension,
+                'file': backup_file_name,
+                'compression': compression if not is_archive else f"pg_dump -Z {self.compression_level}",
+                'compression_level': self.compression_level,
+                'bytes': path_size(final_backup_file),
+                'stream_bytes': stream_bytes,
+                'estimate': estimate,
+                'sha256': checksum,
+                'pg_dump_version': self.pg_dump_version(pg_dump_path),
+                'server_version': server_version,
+                'started_at': started_at.isoformat(timespec='seconds'),
+            }
+            if file_extension == DIRECTORY_FORMAT:
+                # pg_dump wrote these files itself, they are the only ones hashed after the fact
+                manifest['files'] = directory_checksums(final_backup_file)
+            elif is_copy:
+                manifest['files'] = export['files']
+                manifest['copy_format'] = export['format']
+                manifest['table_count'] = len(export['tables'])
+                manifest['rows'] = sum(piece['rows'] or 0 for table in export['tables'] for piece in table['pieces'])
+            # Relative, the backup directory can move together with its host directory
+            manifest['globals_file'] = os.path.relpath(globals_path, backup_dir).replace(os.sep, '/')
+            manifest['globals_sha256'] = globals_checksum
+            if deduplicate:
+                manifest.update(chunk_stats)
+            if table_state is not None:
+                # The table state taken before the dump is what the next incremental compares to
+                manifest['tables'] = table_state['tables']
+                manifest['schema_signature'] = table_state['schema_signature']
+                manifest['chain_length'] = incremental['chain_length'] if incremental else 0
+            if incremental:
+                manifest['parent'] = incremental['parent']
+                manifest['changed_tables'] = [f"{schema}.{table}" for schema, table in incremental['tables']]
+            record_phase(phases, 'finalize', phase_start)
+            manifest['phases'] = phases
+            manifest['finished_at'] = datetime.now().isoformat(timespec='seconds')
+            write_manifest(backup_dir, manifest)
+            try:
+                with BackupCatalog(self.base_backup_dir) as catalog:
+                    catalog.add_backup(final_backup_file, manifest)
+            except sqlite3.Error as e:
+                # The next sync of the catalog picks the backup up from disk
+                print(f"Error adding backup of '{db_name}' to the catalog: {e}")
+
+            self.finish_database_progress(db_name)
+            self.run_databases.append({'db_name': db_name, 'success': True, 'bytes': manifest['bytes'],
+                                       'seconds': round((datetime.now() - started_at).total_seconds(), 3),
+                                       'phases': phase_seconds(phases), 'path': final_backup_file})
+            return True
+
+        except (psycopg2.Error, subprocess.CalledProcessError, IOError, OSError) as e:
+            if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+                print(e.stderr)
+            print(f"Error during backup of database '{db_name}': {e}")
+            remove_backup_path(temp_backup_file)
+            error = e.stderr.strip() if isinstance(e, subprocess.CalledProcessError) and e.stderr else str(e)
+            self.run_databases.append({'db_name': db_name, 'success': False, 'error': error,
+                                       'seconds': round((datetime.now() - started_at).total_seconds(), 3),
+                                       'phases': phase_seconds(phases)})
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                self.pool.release(conn)
+
+    def export_tables(self, pg_dump_path, db_name, target_dir, compression):
+        from copy_engine import CopyExporter
+        exporter = CopyExporter(self.db_host, self.db_port, self.db_user, self.db_password, db_name, pg_dump_path,
+                                workers=self.jobs_per_database(), copy_format=self.copy_format, compression=compression,
+                                compression_level=self.compression_level, pool=self.pool,
+                                progress=lambda done: self.report_database_progress(db_name, done),
+                                status=self.status.emit)
+        return exporter.run(target_dir)
+
+    def jobs_per_database(self):
+        return self.dump_jobs or default_jobs_per_database(self.databases_at_once)
+
+    def open_dump_writer(self, raw, compression, deduplicate):
+        if deduplicate:
+            return ChunkingWriter(raw, os.path.join(self.base_backup_dir, CHUNK_STORE_DIR),
+                                  compression, self.compression_level)
+        return open_compressed_writer(raw, compression, self.compression_level, self.compression_threads)
+
+    def pg_dump_version(self, pg_dump_path):
+        if self._pg_dump_version is None:
+            result = subprocess.run([pg_dump_path, "--version"], capture_output=True, encoding='utf-8')
+            self._pg_dump_version = result.stdout.strip()
+        return self._pg_dump_version
+
+    def read_table_state(self, cursor):
+        # Modification counters plus the relfilenode, which catches TRUNCATE and table rewrites
+        cursor.execute("""
+            SELECT schemaname, relname, n_tup_ins, n_tup_upd, n_tup_del,
+                   pg_relation_filenode(relid), pg_table_size(relid)
+            FROM pg_stat_user_tables;
+        """)
+        tables = {}
+        sizes = {}
+        for schema, table, inserted, updated, deleted, filenode, size in cursor.fetchall():
+            key = f"{quote_ident(schema)}.{quote_ident(table)}"
+            tables[key] = [schema, table, inserted, updated, deleted, filenode]
+            sizes[key] = size
+        # Any column change makes a data-only incremental unusable on top of the old schema
+        cursor.execute("""
+            SELECT md5(COALESCE(string_agg(format('%s.%s:%s:%s', c.oid::regclass, a.attname, a.atttypid, a.attnum),
+                                           ',' ORDER BY c.oid::regclass::text, a.attnum), ''))
+            FROM pg_class c
+            JOIN pg_attribute a ON a.attrelid = c.oid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'p') AND a.attnum > 0 AND NOT a.attisdropped
+              AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+              AND n.nspname NOT LIKE 'pg_toast%';
+        """)
+        return {'tables': tables, 'sizes': sizes, 'schema_signature': cursor.fetchone()[0]}
+
+    def plan_incremental(self, database_dir, table_state):
+        # None means a full backup has to be taken instead
+        timestamp, previous = latest_backup_manifest(database_dir)
+        if not previous or 'tables' not in previous:
+            self.status.emit("No previous backup with table state, taking a full backup")
+            return None
+        if previous.get('chain_length', 0) >= MAX_INCREMENTAL_CHAIN:
+            self.status.emit("Incremental chain is at its maximum length, taking a full backup")
+            return None
+        if previous.get('schema_signature') != table_state['schema_signature'] \
+                or set(previous['tables']) != set(table_state['tables']):
+            self.status.emit("Tables or columns changed since the previous backup, taking a full backup")
+            return None
+
+        changed = [key for key, state in table_state['tables'].items() if previous['tables'].get(key) != state]
+        return {
+            'parent': f"{timestamp}/{previous['file']}",
+            'chain_length': previous.get('chain_length', 0) + 1,
+            'tables': [tuple(table_state['tables'][key][:2]) for key in changed],
+            'estimate': sum(table_state['sizes'][key] for key in changed),
+        }
+
+    def incremental_header(self, tables):
+        # Changed tables are replaced as a whole. TRUNCATE refuses tables referenced by foreign keys
+        # from unchanged tables, DELETE works there since replica mode skips the FK triggers.
+        names = [f"ONLY {quote_ident(schema)}.{quote_ident(table)}" for schema, table in tables]
+        deletes = " ".join(f"DELETE FROM {name};" for name in names)
+        return (
+            "SET session_replication_role = replica;\n"
+            f"DO $$BEGIN TRUNCATE {', '.join(names)}; "
+            f"EXCEPTION WHEN feature_not_supported THEN {deletes} END$$;\n"
+        ).encode('utf-8')
+
+    def stream_dump(self, source, target, db_name):
+        # Copy raw bytes through one reusable buffer, progress is throttled by report_database_progress
+        buffer = bytearray(STREAM_CHUNK_SIZE)
+        view = memoryview(buffer)
+        total_bytes = 0
+        while True:
+            count = source.readinto(buffer)
+            if not count:
+                break
+            target.write(view[:count])
+            total_bytes += count
+            self.report_database_progress(db_name, total_bytes)
+        return total_bytes
+
+    def capture_globals(self, cursor):
+        # Once per run: the first database to get here queries the cluster, the others wait for it
+        with self.globals_lock:
+            if self.globals is None:
+                self.status.emit(f"Backing up roles and tablespaces of {self.db_host}")
+                self.globals = store_globals(os.path.join(self.base_backup_dir, self.db_host), globals_sql(cursor),
+                                             datetime.now().strftime(BACKUP_TIMESTAMP_FORMAT))
+            return self.globals
+
+    def backup_all_databases(self, backup_type, file_extension):
+        import psycopg2
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        conn = None
+        cursor = None
+        try:
+            conn = self.pool.acquire(self.db_host, self.db_port, self.db_user, self.db_password)
+            cursor = conn.cursor()
+
+            # Start the largest databases first so one big dump picked up last
+            # does not set the wall clock of the whole run.
+            # The sizes also seed the progress estimates until each worker refines its own
+            cursor.execute("""
+                SELECT datname, pg_database_size(datname) FROM pg_database
+                WHERE datistemplate = false
+                ORDER BY 2 DESC;
+            """ if self.largest_first else """
+                SELECT datname, pg_database_size(datname) FROM pg_database
+                WHERE datistemplate = false;
+            """)
+            database_sizes = cursor.fetchall()
+            databases = [row[0] for row in database_sizes]
+            if databases:
+                # Before the workers start, none of them has to wait for it
+                self.capture_globals(cursor)
+        except (psycopg2.Error, OSError) as e:
+            print(f"Error connecting to PostgreSQL: {e}")
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                self.pool.release(conn)
+
+        total_dbs = len(databases)
+        if total_dbs == 0:
+            self.progress.emit(100)
+            return True
+
+        for db_name, size in database_sizes:
+            self.transfer.set_estimate(db_name, size)
+        self.failed_databases = []
+        completed = 0
+        workers = min(self.max_workers, total_dbs)
+        self.databases_at_once = workers
+        self.status.emit(f"Backing up {total_dbs} databases with {workers} parallel workers")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self.backup_database, backup_type, file_extension, db_name): db_name
+                for db_name in databases
+            }
+            for future in as_completed(futures):
+                db_name = futures[future]
+                try:
+                    success = future.result()
+                except Exception as e:
+                    print(f"Error during backup of database '{db_name}': {e}")
+                    success = False
+                completed += 1
+                self.finish_database_progress(db_name)
+                if success:
+                    self.status.emit(f"Backed up {db_name} ({completed}/{total_dbs})")
+                else:
+                    self.failed_databases.append(db_name)
+                    print(f"Failed to backup {db_name}")
+                    self.status.emit(f"Failed to back up {db_name} ({completed}/{total_dbs})")
+
+        return not self.failed_databases
+
+class RestoreEngine:
+    def __init__(self, db_host, db_port, db_user, db_password, backup_dir, restore_jobs=None, restore_workers=None,
+                 fast_restore=False, restore_point=None, source=None, label=None, pool=None,
+                 maintenance_work_mem=FAST_RESTORE_MAINTENANCE_MEM):
+        self.progress = Signal()
+        self.status = Signal()
+        self.db_host = db_host
+        self.db_port = db_port
+        self.db_user = db_user
+        self.db_password = db_password
+        self.backup_dir = backup_dir
+        # pg_restore -j for archives that support parallel restore, connections for COPY exports.
+        # None leaves it to jobs_per_database.
+        self.restore_jobs = restore_jobs
+        self.databases_at_once = 1
+        # Number of databases restored concurrently
+        self.restore_workers = restore_workers or default_backup_workers()
+        # Single transaction, data before indexes, relaxed session settings and a final ANALYZE
+        self.fast_restore = fast_restore
+        # MB of maintenance_work_mem a fast restore may use across every session, see restore_env
+        self.maintenance_work_mem = maintenance_work_mem
+        # datetime to restore each database as of, None restores the latest backups
+        self.restore_point = restore_point
+        self.source = source
+        self.label = label
+        self.transfer = TransferProgress()
+        self.last_output = {}
+        self.failed_databases = {}
+        self.run_databases = []
+        self.pool = pool or CONNECTION_POOL
+
+    def run(self):
+        # (success, message), the outcome RestoreThread passes on with its finished signal
+        started_at = datetime.now()
+        self.run_databases = []
+        try:
+            failed = self.restore_databases()
+            if failed:
+                details = "\n".join(f"{db_name}: {error}" for db_name, error in failed.items())
+                success, message = False, f"Restore failed for {len(failed)} database(s):\n{details}"
+            else:
+                success, message = True, "Restore completed successfully."
+        except Exception as e:
+            success, message = False, f"An error occurred during restore: {str(e)}"
+        for db_name, error in self.failed_databases.items():
+            if not any(database['db_name'] == db_name for database in self.run_databases):
+                self.run_databases.append({'db_name': db_name, 'success': False, 'error': error})
+        record_run('restore', started_at, self.run_databases, success, None if success else message,
+                   source=self.source, label=self.label, host=self.db_host)
+        return success, message
+
+    def jobs_per_database(self):
+        return self.restore_jobs or default_jobs_per_database(self.databases_at_once)
+
+    def find_psql(self):
+        return find_pg_executable('psql')
+
+    def find_pg_restore(self):
+        return find_pg_executable('pg_restore')
+
+    def restore_databases(self):
+        psql_path = self.find_psql()
+        os.environ['PGPASSWORD'] = self.db_password
+
+        # A folder holds every backup ever taken, only one of them per database is restored
+        backups = {}
+        self.failed_databases = {}
+        selected = select_restore_backups(self.find_backups(), self.restore_point)
+        if not selected:
+            raise FileNotFoundError(f"No backup found in {self.backup_dir}" +
+                                    (f" taken at or before {self.restore_point}" if self.restore_point else ""))
+        hosts = {}
+        for host, db_name in selected:
+            hosts.setdefault(db_name, []).append(host)
+        for (host, db_name), backup_path in selected.items():
+            if len(hosts[db_name]) > 1:
+                # Each backup goes into the database of its name on db_host, one server's would overwrite the other's
+                self.failed_databases[db_name] = (f"Backups from {len(hosts[db_name])} hosts ({', '.join(hosts[db_name])}), "
+                                                  f"pick the folder of one host to restore {db_name}")
+                continue
+            try:
+                # An incremental is replayed on top of its full backup and the incrementals before it
+                backups[db_name] = resolve_backup_chain(backup_path) if self.is_incremental(backup_path) \
+                    else [backup_path]
+            except FileNotFoundError as e:
+                self.failed_databases[db_name] = str(e)
+                continue
+            for chain_path in backups[db_name]:
+                # Progress is measured in bytes of the backup files consumed, across all of them
+                self.transfer.set_estimate(chain_path, path_size(chain_path))
+
+        import psycopg2
+        self.restore_globals(backups)
+
+        for db_name in list(backups):
+            self.status.emit(f"Creating database: {db_name}")
+            try:
+                self.create_database(db_name)
+            except psycopg2.Error as e:
+                self.failed_databases[db_name] = str(e).strip()
+                for backup_path in backups.pop(db_name):
+                    self.transfer.finish(backup_path)
+
+        total_dbs = len(backups)
+        completed = 0
+        if total_dbs:
+            from concurrent.futures import ThreadPoolExecutor, as_completed
+            workers = min(self.restore_workers, total_dbs)
+            self.databases_at_once = workers
+            self.status.emit(f"Restoring {total_dbs} databases with {workers} parallel workers")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(self.restore_database, psql_path, db_name, backup_paths): db_name
+                    for db_name, backup_paths in backups.items()
+                }
+                for future in as_completed(futures):
+                    db_name = futures[future]
+                    completed += 1
+                    try:
+                        future.result()
+                        self.status.emit(f"Restored {db_name} ({completed}/{total_dbs})")
+                    except Exception as e:
+                        # A failed database never stops the others, all failures are reported at the end
+                        self.failed_databases[db_name] = str(e)
+                        self.status.emit(f"Failed to restore {db_name} ({completed}/{total_dbs})")
+                    self.progress.emit(self.transfer.snapshot()[0])
+
+        self.progress.emit(100)
+        return self.failed_databases
+
+    def restore_globals(self, backups):
+        # Roles and tablespaces go in once, before any database; the newest globals file per host
+        # covers every backup taken with the older ones too
+        import psycopg2
+        from psycopg2 import errorcodes
+        latest = {}
+        for backup_paths in backups.values():
+            path = backup_globals_file(backup_paths[-1])
+            if path:
+                host_dir = os.path.dirname(os.path.dirname(path))
+                latest[host_dir] = max(latest.get(host_dir, path), path)
+        if not latest:
+            return
+        with self.pool.connection(self.db_host, self.db_port, self.db_user, self.db_password) as conn:
+            with conn.cursor() as cursor:
+                for path in sorted(latest.values()):
+                    self.status.emit(f"Restoring roles and tablespaces from {os.path.basename(path)}")
+                    with open(path, encoding='utf-8') as f:
+                        # One statement per line, each in its own transaction
+                        for statement in f:
+                            if not statement.strip():
+                                continue
+                            try:
+                                cursor.execute(statement)
+                            except psycopg2.Error as e:
+                                # Roles and tablespaces the server has already are fine
+                                if e.pgcode != errorcodes.DUPLICATE_OBJECT:
+                                    print(f"Error restoring '{path}': {str(e).strip()}")
+
+    def restore_database(self, psql_path, db_name, backup_paths):
+        self.status.emit(f"Restoring database: {db_name}")
+        started_at = datetime.now()
+        # backup_paths is a full backup, possibly followed by its incrementals, applied in order
+        for backup_path in backup_paths:
+            try:
+                if is_copy_export(backup_path):
+                    self.restore_copy_export(psql_path, db_name, backup_path)
+                # psql -f cannot read archives, older .backup files are plain SQL
+                elif os.path.isdir(backup_path) or is_custom_archive(backup_path):
+                    self.restore_archive(psql_path, db_name, backup_path)
+                else:
+                    self.restore_sql_file(psql_path, db_name, backup_path)
+            finally:
+                self.transfer.finish(backup_path)
+        self.run_databases.append({'db_name': db_name, 'success': True,
+                                   'bytes': sum(path_size(path) for path in backup_paths),
+                                   'seconds': round((datetime.now() - started_at).total_seconds(), 3),
+                                   'path': backup_paths[-1]})
+
+    def is_incremental(self, backup_path):
+        manifest = read_manifest(os.path.dirname(backup_path))
+        return bool(manifest) and manifest.get('backup_type') == INCREMENTAL_BACKUP
+
+    def find_backups(self):
+        # (db_name, path) for every dump file or directory archive below backup_dir. The catalog is
+        # the one the backups were written with, a restore never leaves a new one in the folder it reads.
+        root = find_catalog_root(self.backup_dir)
+        if root is None:
+            return walk_backups(self.backup_dir)
+        try:
+            with BackupCatalog(root) as catalog:
+                self.status.emit("Updating the backup catalog")
+                catalog.sync()
+                backups = catalog.backups()
+        except sqlite3.Error as e:
+            # Read-only shares and the like still restore, just with a full scan
+            print(f"Error using the backup catalog in '{self.backup_dir}': {e}")
+            return walk_backups(self.backup_dir)
+        # A catalog further up also lists the backups outside the folder that was picked
+        backup_dir = os.path.abspath(self.backup_dir)
+        return [(db_name, path) for db_name, path in backups if is_below(path, backup_dir)]
+
+    def report_restore_progress(self, db_name, backup_path, done_bytes):
+        self.transfer.update(backup_path, done_bytes)
+        if self.transfer.due():
+            self.progress.emit(self.transfer.snapshot()[0])
+            status = self.transfer.describe(f"Restoring {db_name}")
+            if self.last_output.get(db_name):
+                status += f"\n{self.last_output[db_name]}"
+            self.status.emit(status)
+
+    def restore_sql_file(self, psql_path, db_name, backup_file):
+        # psql reads the dump from a pipe we feed, so we know how far into the file it is
+        restore_cmd = [
+            psql_path,
+            "-h", self.db_host,
+            "-p", self.db_port,
+            "-U", self.db_user,
+            "-d", db_name,
+            "-f", "-"
+        ]
+        process = subprocess.Popen(restore_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, env=self.restore_env())
+        reader = threading.Thread(target=self.read_output, args=(db_name, process.stdout), daemon=True)
+        reader.start()
+        try:
+            self.feed_backup(db_name, backup_file, process.stdin)
+        except BrokenPipeError:
+            pass  # psql exited early, its output tells why
+        except BaseException:
+            # A dump that cannot be read to the end, e.g. a corrupt gzip stream, must not reach psql as
+            # a clean end of input: psql would commit everything before the damage
+            process.kill()
+            raise
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            process.wait()
+            reader.join()
+        if process.returncode != 0:
+            raise RuntimeError(self.last_output.get(db_name) or f"psql exited with code {process.returncode}")
+
+    def read_output(self, db_name, stream):
+        # psql prints one line per statement, only the latest one is shown with the next status update
+        for line in stream:
+            self.last_output[db_name] = line.decode('utf-8', 'replace').strip()
+        stream.close()
+
+    def feed_backup(self, db_name, backup_file, target):
+        # Closing target is up to the caller, which has to stop psql first when this raises
+        raw, source = open_restore_reader(backup_file)
+        with raw, source:
+            if self.fast_restore:
+                # Existing roles make CREATE ROLE fail, so the role header stays outside the transaction
+                head = b''
+                header_length = None
+                while header_length is None:
+                    chunk = source.read(STREAM_CHUNK_SIZE)
+                    head += chunk
+                    header_length = role_header_length(head, at_eof=not chunk)
+                target.write(head[:header_length])
+                target.write(FAST_RESTORE_BEGIN)
+                target.write(head[header_length:])
+                self.report_restore_progress(db_name, backup_file, raw.tell())
+            while True:
+                chunk = source.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                target.write(chunk)
+                self.report_restore_progress(db_name, backup_file, raw.tell())
+            if self.fast_restore:
+                # pg_dump already puts indexes and constraints after the data
+                target.write(FAST_RESTORE_END)
+
+    def create_database(self, db_name):
+        # Over a pooled connection to the maintenance database, not a psql process per database
+        with self.pool.connection(self.db_host, self.db_port, self.db_user, self.db_password) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"CREATE DATABASE {quote_ident(db_name)} WITH ENCODING 'UTF8'")
+
+    def restore_archive(self, psql_path, db_name, archive_path):
+        # Custom and directory archives are both restored with pg_restore -j
+        roles_file = roles_file_for(archive_path)
+        if os.path.exists(roles_file):
+            # Roles that already exist only produce errors psql skips over
+            subprocess.run([
+                psql_path,
+                "-h", self.db_host,
+                "-p", self.db_port,
+                "-U", self.db_user,
+                "-d", db_name,
+                "-f", roles_file
+            ], capture_output=True, encoding='utf-8')
+
+        restore_cmd = [
+            self.find_pg_restore(),
+            "-h", self.db_host,
+            "-p", self.db_port,
+            "-U", self.db_user,
+            "-d", db_name
+        ]
+        if self.fast_restore:
+            # Tables first, then the data in parallel, then indexes and constraints in parallel
+            passes = [
+                ["--section=pre-data", "--single-transaction"],
+                ["--section=data", "-j", str(self.jobs_per_database())],
+                ["--section=post-data", "-j", str(self.jobs_per_database())],
+            ]
+        else:
+            passes = [["-j", str(self.jobs_per_database())]]
+
+        # Untranslated messages, the summary line of skipped errors is looked for below
+        env = dict(self.restore_env() or os.environ)
+        env['LC_MESSAGES'] = 'C'
+        for options in passes:
+            with tempfile.TemporaryFile() as stderr_file:
+                process = subprocess.Popen(restore_cmd + options + [archive_path], stdout=subprocess.DEVNULL,
+                                           stderr=stderr_file, env=env)
+                # pg_restore does not tell how far it is, keep rate and ETA of the whole run ticking
+                while process.poll() is None:
+                    time.sleep(PROGRESS_INTERVAL)
+                    self.report_restore_progress(db_name, archive_path, 0)
+                stderr_file.seek(0)
+                errors = stderr_file.read().decode('utf-8', 'replace')
+            # pg_restore also exits non-zero when it went on past failing statements, e.g. an owner
+            # missing on this server, and says so on its last line. That is reported and the restore
+            # goes on; any other failure fails the database.
+            if process.returncode != 0 and PG_RESTORE_IGNORED_ERRORS not in errors:
+                raise RuntimeError(errors.strip() or f"pg_restore exited with code {process.returncode}")
+            for line in errors.splitlines()[-5:]:
+                self.status.emit(line.strip())
+
+        if self.fast_restore:
+            self.status.emit(f"Analyzing database: {db_name}")
+            subprocess.run([
+                psql_path,
+                "-h", self.db_host,
+                "-p", self.db_port,
+                "-U", self.db_user,
+                "-d", db_name,
+                "-c", "ANALYZE"
+            ], check=True, capture_output=True, encoding='utf-8', env=self.restore_env())
+
+    def restore_copy_export(self, psql_path, db_name, export_dir):
+        # Data files load in parallel over restore_jobs pooled connections, see copy_engine.py
+        from copy_engine import CopyLoader
+        loader = CopyLoader(self.db_host, self.db_port, self.db_user, self.db_password, db_name, psql_path,
+                            workers=self.jobs_per_database(), fast=self.fast_restore, env=self.restore_env(), pool=self.pool,
+                            progress=lambda done: self.report_restore_progress(db_name, export_dir, done),
+                            status=self.status.emit)
+        loader.run(export_dir)
+
+    def restore_env(self):
+        if not self.fast_restore:
+            return None
+        # Session-level settings for every connection psql and pg_restore open. Up to
+        # jobs_per_database() sessions in each database restored at once build indexes, each gets its share.
+        options = FAST_RESTORE_PGOPTIONS
+        share = self.maintenance_work_mem // (self.jobs_per_database() * self.databases_at_once)
+        if share >= MIN_MAINTENANCE_WORK_MEM:
+            options += f" -c maintenance_work_mem={share}MB"
+        env = dict(os.environ)
+        env['PGOPTIONS'] = f"{env.get('PGOPTIONS', '')} {options}".strip()
+        return env
@@ -1,11 +1,7 @@
 import sys
 import os
-import win32com.client
 import subprocess
-import argparse
-import psycopg2
-import json
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+import sqlite3
 from datetime import datetime, timedelta
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, 
@@ -14,14 +10,23 @@ from PyQt5.QtWidgets import (
     QCheckBox, QGroupBox, QTextEdit, QScrollArea, QStyleFactory, QComboBox, QDateEdit, QFormLayout, QDialog, QDialogButtonBox, QGridLayout,
     QListWidget, QListWidgetItem
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QDate, QUrl, QSize
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal, QDate, QUrl, QSize
 from PyQt5.QtGui import QIcon, QFont, QPixmap, QDesktopServices
 import tempfile
-import textwrap
-import smtplib
 import platform
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from backup_engine import (
+    BackupEngine, RestoreEngine, RunHistory, DIRECTORY_FORMAT, DEFAULT_COMPRESSION_LEVEL, INCREMENTAL_BACKUP, COPY_BACKUP,
+    RETENTION_PERIODS, DEFAULT_RETENTION, available_compression_methods, default_backup_workers,
+    format_duration, format_retention, format_size, prune_backups
+)
+import backup_cli
+from backup_cli import BACKUP_TYPES
+from task_schedulers import CLI_ARGUMENT, TaskDefinition, backup_cli_command, default_scheduler_backend, task_statistics
+
+# How often the Schedule Management tab reloads its snapshot of the scheduled tasks
+TASK_SNAPSHOT_INTERVAL_MS = 30000
+# Days of run history the statistics panel sums up
+HISTORY_SUMMARY_DAYS = 30
 
 class NoScrollComboBox(QComboBox):
     def wheelEvent(self, event):
@@ -32,268 +37,64 @@ class BackupThread(QThread):
     status = pyqtSignal(str)
     finished = pyqtSignal(bool, str)
 
-    def __init__(self, backup_type, file_extension, db_name, db_host, db_port, db_user, db_password, base_backup_dir):
+    def __init__(self, *args, **kwargs):
         QThread.__init__(self)
-        self.backup_type = backup_type
-        self.file_extension = file_extension
-        self.db_name = db_name
-        self.db_host = db_host
-        self.db_port = db_port
-        self.db_user = db_user
-        self.db_password = db_password
-        self.base_backup_dir = base_backup_dir
+        # Takes the arguments of BackupEngine, which does the work outside of Qt
+        self.engine = BackupEngine(*args, **kwargs)
+        self.engine.progress.connect(self.progress.emit)
+        self.engine.status.connect(self.status.emit)
 
     def run(self):
-        try:
-            if self.db_name:
-                success = self.backup_database(self.backup_type, self.file_extension, self.db_name)
-            else:
-                success = self.backup_all_databases(self.backup_type, self.file_extension)
-            self.finished.emit(success, "Backup completed successfully." if success else "Backup failed.")
-        except Exception as e:
-            self.finished.emit(False, f"An error occurred: {str(e)}")
-
-    def find_pg_dump(self):
-        # Get the absolute path of the script/executable
-        if getattr(sys, 'frozen', False):
-            # Running as compiled executable
-            base_path = sys._MEIPASS
-        else:
-            # Running as script
-            base_path = os.path.dirname(os.path.abspath(__file__))
-        
-        pg_dump_path = os.path.join(base_path, 'resources', 'bin', 'pg_dump.exe')
-        
-        if os.path.exists(pg_dump_path):
-            return pg_dump_path
-        
-        # Fallback to system paths if embedded executable not found
-        possible_pg_paths = [
-            r"D:\SETUP PROGRAMS\PostgreSQL\16\bin\pg_dump.exe",
-            r"C:\Program Files\PostgreSQL\15\bin\pg_dump.exe",
-            r"C:\Program Files\PostgreSQL\14\bin\pg_dump.exe",
-            r"C:\Program Files\PostgreSQL\13\bin\pg_dump.exe",
-            r"C:\Program Files\PostgreSQL\12\bin\pg_dump.exe"
-        ]
-        
-        for path in possible_pg_paths:
-            if os.path.exists(path):
-                return path
-                
-        raise FileNotFoundError("pg_dump.exe not found in embedded resources or system paths.")
-
-    def backup_database(self, backup_type, file_extension, db_name):
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        pg_dump_path = self.find_pg_dump()
-        temp_backup_file = os.path.join(self.base_backup_dir, f"{db_name}.{file_extension}")
-
-        try:
-            conn = psycopg2.connect(dbname=db_name, user=self.db_user, password=self.db_password, 
-                                    host=self.db_host, port=self.db_port)
-            conn.set_session(autocommit=True)
-            cursor = conn.cursor()
-
-            self.status.emit(f"Backing up roles for {db_name}")
-            with open(temp_backup_file, "w", encoding='utf-8') as f:
-                cursor.execute("""
-                    SELECT r.rolname, r.rolsuper, r.rolinherit, r.rolcreaterole,
-                           r.rolcreatedb, r.rolcanlogin, r.rolpassword
-                    FROM pg_authid r JOIN pg_roles u ON r.oid = u.oid;
-                """)
-                roles = cursor.fetchall()
-                for role in roles:
-                    rolename, rolsuper, rolinherit, rolcreaterole, rolcreatedb, rolcanlogin, rolpassword = role
-                    f.write(f'CREATE ROLE "{rolename}" WITH ')
-                    if rolsuper:
-                        f.write("SUPERUSER ")
-                    if not rolinherit:
-                        f.write("NOINHERIT ")
-                    if rolcreaterole:
-                        f.write("CREATEROLE ")
-                    if rolcreatedb:
-                        f.write("CREATEDB ")
-                    if rolcanlogin:
-                        f.write("LOGIN ")
-                    if rolpassword:
-                        f.write(f"ENCRYPTED PASSWORD '{rolpassword}' ")
-                    f.write(";\n")
-
-            self.status.emit(f"Backing up database {db_name}")
-            os.environ['PGPASSWORD'] = self.db_password
-            pg_dump_cmd = [
-                pg_dump_path,
-                "-h", self.db_host,
-                "-p", self.db_port,
-                "-U", self.db_user,
-                "-d", db_name,
-                "-F", "p"  # Plain text format for SQL output
-            ]
-            if backup_type == 'Schema':
-                pg_dump_cmd.append("-s")  # Schema-only
-
-            process = subprocess.Popen(pg_dump_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                                       universal_newlines=True, encoding='utf-8')
-            
-            with open(temp_backup_file, "a", encoding='utf-8') as f:
-                while True:
-                    output = process.stdout.readline()
-                    if output == '' and process.poll() is not None:
-                        break
-                    if output:
-                        f.write(output)
-                        self.progress.emit(50)  # Assuming 50% progress for simplicity
-
-            if backup_type == 'Schema':
-                backup_dir = os.path.join(self.base_backup_dir, self.db_host, f"schema_{db_name}", timestamp)
-            else:
-                backup_dir = os.path.join(self.base_backup_dir, self.db_host, db_name, timestamp)
-
-            os.makedirs(backup_dir, exist_ok=True)
-            final_backup_file = os.path.join(backup_dir, f"{db_name}.{file_extension}")
-            os.rename(temp_backup_file, final_backup_file)
-
-            self.progress.emit(100)
-            return True
-
-        except (psycopg2.Error, subprocess.CalledProcessError, IOError, OSError) as e:
-            print(f"Error during backup of database '{db_name}': {e}")
-            if os.path.exists(temp_backup_file):
-                os.remove(temp_backup_file)
-            return False
-        finally:
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
-
-    def backup_all_databases(self, backup_type, file_extension):
-        try:
-            conn = psycopg2.connect(dbname='postgres', user=self.db_user, password=self.db_password, 
-                                    host=self.db_host, port=self.db_port)
-            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-            cursor = conn.cursor()
-
-            cursor.execute("SELECT datname FROM pg_database WHERE datistemplate = false;")
-            databases = cursor.fetchall()
-            total_dbs = len(databases)
-
-            for i, db in enumerate(databases):
-                db_name = db[0]
-                self.status.emit(f"Backing up database: {db_name}")
-                success = self.backup_database(backup_type, file_extension, db_name)
-                if not success:
-                    print(f"Failed to backup {db_name}")
-                self.progress.emit(int((i + 1) / total_dbs * 100))
-
-            return True
-        except psycopg2.Error as e:
-            print(f"Error connecting to PostgreSQL: {e}")
-            return False
-        finally:
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
+        self.finished.emit(*self.engine.run())
 
 class RestoreThread(QThread):
     progress = pyqtSignal(int)
     status = pyqtSignal(str)
     finished = pyqtSignal(bool, str)
 
-    def __init__(self, db_host, db_port, db_user, db_password, backup_dir):
+    def __init__(self, *args, **kwargs):
         QThread.__init__(self)
-        self.db_host = db_host
-        self.db_port = db_port
-        self.db_user = db_user
-        self.db_password = db_password
-        self.backup_dir = backup_dir
+        # Takes the arguments of RestoreEngine, which does the work outside of Qt
+        self.engine = RestoreEngine(*args, **kwargs)
+        self.engine.progress.connect(self.progress.emit)
+        self.engine.status.connect(self.status.emit)
 
     def run(self):
+        self.finished.emit(*self.engine.run())
+
+class TaskSnapshotThread(QThread):
+    loaded = pyqtSignal(list)
+    failed = pyqtSignal(str)
+
+    def __init__(self, scheduler, report_errors=False):
+        QThread.__init__(self)
+        self.scheduler = scheduler
+        self.report_errors = report_errors
+
+    def run(self):
+        # Enumerating a few hundred tasks takes a while, the tab shows the last snapshot meanwhile
         try:
-            self.restore_databases()
-            self.finished.emit(True, "Restore completed successfully.")
+            self.loaded.emit(self.scheduler.list_tasks())
         except Exception as e:
-            self.finished.emit(False, f"An error occurred during restore: {str(e)}")
-
-    def find_psql(self):
-        # Get the absolute path of the script/executable
-        if getattr(sys, 'frozen', False):
-            # Running as compiled executable
-            base_path = sys._MEIPASS
-        else:
-            # Running as script
-            base_path = os.path.dirname(os.path.abspath(__file__))
-        
-        psql_path = os.path.join(base_path, 'resources', 'bin', 'psql.exe')
-        
-        if os.path.exists(psql_path):
-            return psql_path
-        
-        # Fallback to system paths if embedded executable not found
-        possible_psql_paths = [
-            r"D:\SETUP PROGRAMS\PostgreSQL\16\bin\psql.exe",
-            r"C:\Program Files\PostgreSQL\15\bin\psql.exe",
-            r"C:\Program Files\PostgreSQL\14\bin\psql.exe",
-            r"C:\Program Files\PostgreSQL\13\bin\psql.exe",
-            r"C:\Program Files\PostgreSQL\12\bin\psql.exe"
-        ]
-        
-        for path in possible_psql_paths:
-            if os.path.exists(path):
-                return path
-                
-        raise FileNotFoundError("psql.exe not found in embedded resources or system paths.")
-
-    def restore_databases(self):
-        psql_path = self.find_psql()
-        os.environ['PGPASSWORD'] = self.db_password
-
-        for root, dirs, files in os.walk(self.backup_dir):
-            for file in files:
-                if file.endswith('.sql') or file.endswith('.backup'):
-                    db_name = os.path.splitext(file)[0]
-                    backup_file = os.path.join(root, file)
-                    self.status.emit(f"Restoring database: {db_name}")
-
-                    # Create database if it doesn't exist
-                    create_db_cmd = [
-                        psql_path,
-                        "-h", self.db_host,
-                        "-p", self.db_port,
-                        "-U", self.db_user,
-                        "-d", "postgres",
-                        "-c", f"CREATE DATABASE \"{db_name}\" WITH ENCODING 'UTF8'"
-                    ]
-                    subprocess.run(create_db_cmd, check=True, capture_output=True, encoding='utf-8')
-
-                    # Restore the database
-                    restore_cmd = [
-                        psql_path,
-                        "-h", self.db_host,
-                        "-p", self.db_port,
-                        "-U", self.db_user,
-                        "-d", db_name,
-                        "-f", backup_file
-                    ]
-                    process = subprocess.Popen(restore_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, encoding='utf-8')
-                    
-                    while True:
-                        output = process.stdout.readline()
-                        if output == '' and process.poll() is not None:
-                            break
-                        if output:
-                            self.status.emit(output.strip())
-                    self.progress.emit(50)  # Update progress (you may want to adjust this)
-
-        self.progress.emit(100)
+            self.failed.emit(str(e))
 
 class ModernBackupRestoreGUI(QWidget):
     def __init__(self):
         super().__init__()
         self.dark_mode = False
+        self.scheduler_backend = None
+        # The Schedule Management tab filters and counts this list, only refresh_snapshot asks the scheduler
+        self.task_snapshot = []
+        self.task_list_backups_only = True
+        self.snapshot_thread = None
+        self.snapshot_stale = False
         self.set_app_icon()
         self.initUI()
-        self.update_statistics()
+        self.snapshot_timer = QTimer(self)
+        self.snapshot_timer.timeout.connect(self.refresh_snapshot)
+        self.snapshot_timer.start(TASK_SNAPSHOT_INTERVAL_MS)
+        # The first snapshot comes in once the window is up
+        QTimer.singleShot(0, self.refresh_snapshot)
         
     def set_app_icon(self):
         app_icon = QIcon("icons/app_icon.png")
@@ -473,8 +274,9 @@ class ModernBackupRestoreGUI(QWidget):
         layout = QVBoxLayout()
         tab.setLayout(layout)
 
-        self.backup_type = self.create_combobox(['Full Backup', 'Schema-only Backup'])
-        self.file_extension = self.create_combobox(['.backup', '.sql'])
+        self.backup_type = self.create_combobox(['Full Backup', 'Schema-only Backup', 'Incremental Backup',
+                                                 'Parallel COPY Export'])
+        self.file_extension = self.create_combobox(['.backup', '.sql', DIRECTORY_FORMAT])
         layout.addWidget(QLabel('Backup Type'))
         layout.addWidget(self.backup_type)
         layout.addWidget(QLabel('File Extension'))
@@ -498,6 +300,31 @@ class ModernBackupRestoreGUI(QWidget):
         layout.addWidget(self.db_password)
         layout.addWidget(QLabel('Database Name (leave blank for all)'))
         layout.addWidget(self.db_name)
+
+        self.parallel_jobs = QSpinBox()
+        self.parallel_jobs.setRange(1, 64)
+        self.parallel_jobs.setValue(default_backup_workers())
+        layout.addWidget(QLabel('Parallel Jobs (databases backed up at once)'))
+        layout.addWidget(self.parallel_jobs)
+
+        # 0 leaves it to the engine, which splits the cores over the databases dumped at once
+        self.dump_jobs = QSpinBox()
+        self.dump_jobs.setRange(0, 64)
+        self.dump_jobs.setSpecialValueText('Auto')
+        self.dump_jobs.setValue(0)
+        layout.addWidget(QLabel('Jobs per Database (directory format, COPY export)'))
+        layout.addWidget(self.dump_jobs)
+
+        self.compression_level = QSpinBox()
+        self.compression_level.setRange(0, 9)
+        self.compression_level.setValue(DEFAULT_COMPRESSION_LEVEL)
+        self.compression_method = self.create_combobox(available_compression_methods())
+        layout.addWidget(QLabel('Compression (.sql format)'))
+        layout.addWidget(self.compression_method)
+        layout.addWidget(QLabel('Compression Level'))
+        layout.addWidget(self.compression_level)
+        self.deduplicate_checkbox = QCheckBox("Deduplicate (.sql format, unchanged chunks are stored once)")
+        layout.addWidget(self.deduplicate_checkbox)
         layout.addWidget(QLabel('Backup Directory'))
 
         backup_dir_layout = QHBoxLayout()
@@ -533,6 +360,9 @@ class ModernBackupRestoreGUI(QWidget):
         self.apply_combobox_style(self.db_user)
         self.apply_combobox_style(self.db_password)
         self.apply_combobox_style(self.db_name)
+        self.apply_combobox_style(self.parallel_jobs)
+        self.apply_combobox_style(self.dump_jobs)
+        self.apply_combobox_style(self.compression_level)
         self.apply_combobox_style(self.backup_dir)
 
         tab.setLayout(layout)
@@ -626,6 +456,27 @@ class ModernBackupRestoreGUI(QWidget):
 
         layout.addWidget(options_group)
 
+        # Retention Group
+        retention_group = QGroupBox("Retention")
+        retention_layout = QFormLayout()
+        retention_group.setLayout(retention_layout)
+
+        self.prune_checkbox = QCheckBox("Prune old backups after each run")
+        retention_layout.addRow(self.prune_checkbox)
+        self.retention_spinboxes = {}
+        for period in RETENTION_PERIODS:
+            spinbox = QSpinBox()
+            spinbox.setRange(0, 1000)
+            spinbox.setValue(DEFAULT_RETENTION[period])
+            self.retention_spinboxes[period] = spinbox
+            retention_layout.addRow(f"Keep {period}:", spinbox)
+            self.apply_combobox_style(spinbox)
+        preview_prune_btn = QPushButton('Preview Pruning')
+        preview_prune_btn.clicked.connect(self.preview_pruning)
+        retention_layout.addRow(preview_prune_btn)
+
+        layout.addWidget(retention_group)
+
         # Schedule button
         schedule_btn = self.create_button('Schedule Backup', 'schedule')
         schedule_btn.clicked.connect(self.schedule_backup)
@@ -633,6 +484,34 @@ class ModernBackupRestoreGUI(QWidget):
 
         return scroll
     
+    def selected_retention(self):
+        return {period: spinbox.value() for period, spinbox in self.retention_spinboxes.items()}
+
+    def preview_pruning(self):
+        base_backup_dir = self.backup_dir.text()
+        if not base_backup_dir:
+            QMessageBox.warning(self, 'Warning', 'Please select a backup directory in the Manual Backup tab.')
+            return
+        try:
+            report = prune_backups(base_backup_dir, self.selected_retention(), host=self.db_host.text() or None,
+                                   db_name=self.db_name.text() or None, dry_run=True)
+        except (sqlite3.Error, OSError) as e:
+            QMessageBox.critical(self, 'Error', f'Failed to read the backup catalog: {str(e)}')
+            return
+        dialog = QDialog(self)
+        dialog.setWindowTitle('Pruning Preview')
+        dialog_layout = QVBoxLayout()
+        report_view = QTextEdit()
+        report_view.setReadOnly(True)
+        report_view.setPlainText("\n".join(report))
+        dialog_layout.addWidget(report_view)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok)
+        buttons.accepted.connect(dialog.accept)
+        dialog_layout.addWidget(buttons)
+        dialog.setLayout(dialog_layout)
+        dialog.resize(600, 400)
+        dialog.exec_()
+
     def create_schedule_management_tab(self):
         tab = QWidget()
         layout = QVBoxLayout()
@@ -680,33 +559,28 @@ class ModernBackupRestoreGUI(QWidget):
         stats_layout = QGridLayout()
         stats_group.setLayout(stats_layout)
 
-        # Create statistics labels with initial styling
-        stats_style = """
-            QLabel {
-                font-size: 14px;
-                padding: 5px;
-                border-radius: 3px;
-                background-color: %s;
-                color: %s;
-            }
-        """ % (('#424242' if self.dark_mode else '#f0f0f0'),
-            ('#ffffff' if self.dark_mode else '#000000'))
-
         self.total_tasks_label = QLabel("Total Tasks: 0")
         self.active_tasks_label = QLabel("Active Tasks: 0")
         self.completed_tasks_label = QLabel("Completed Tasks: 0")
         self.failed_tasks_label = QLabel("Failed Tasks: 0")
+        # From the run history, every backup and restore whether scheduled or not
+        self.history_runs_label = QLabel(f"Runs ({HISTORY_SUMMARY_DAYS} days): 0")
+        self.success_rate_label = QLabel("Success Rate: -")
+        self.throughput_label = QLabel("Backup Throughput: -")
+        self.slow_runs_label = QLabel("Slower Than Baseline: 0")
 
         # Apply styling to all statistics labels
-        for label in [self.total_tasks_label, self.active_tasks_label, 
-                    self.completed_tasks_label, self.failed_tasks_label]:
-            label.setStyleSheet(stats_style)
+        self.apply_statistics_style()
 
         # Add labels to the grid layout
         stats_layout.addWidget(self.total_tasks_label, 0, 0)
         stats_layout.addWidget(self.active_tasks_label, 0, 1)
         stats_layout.addWidget(self.completed_tasks_label, 1, 0)
         stats_layout.addWidget(self.failed_tasks_label, 1, 1)
+        stats_layout.addWidget(self.history_runs_label, 2, 0)
+        stats_layout.addWidget(self.success_rate_label, 2, 1)
+        stats_layout.addWidget(self.throughput_label, 3, 0)
+        stats_layout.addWidget(self.slow_runs_label, 3, 1)
 
         # Add the statistics group to the main layout
         layout.addWidget(stats_group)
@@ -756,6 +630,39 @@ class ModernBackupRestoreGUI(QWidget):
         restore_dir_layout.addWidget(browse_restore_btn)
         layout.addLayout(restore_dir_layout)
 
+        self.restore_jobs = QSpinBox()
+        self.restore_jobs.setRange(0, 64)
+        self.restore_jobs.setSpecialValueText('Auto')
+        self.restore_jobs.setValue(0)
+        layout.addWidget(QLabel('Restore Jobs (.backup, directory and COPY export formats)'))
+        layout.addWidget(self.restore_jobs)
+
+        self.restore_workers = QSpinBox()
+        self.restore_workers.setRange(1, 64)
+        self.restore_workers.setValue(default_backup_workers())
+        layout.addWidget(QLabel('Parallel Restores (databases restored at once)'))
+        layout.addWidget(self.restore_workers)
+
+        self.fast_restore_checkbox = QCheckBox("Fast restore (single transaction, indexes after data, ANALYZE at the end)")
+        layout.addWidget(self.fast_restore_checkbox)
+
+        # Without a restore point the latest backup of each database is restored
+        self.restore_point_checkbox = QCheckBox("Restore as of a point in time (latest backup at or before)")
+        layout.addWidget(self.restore_point_checkbox)
+        restore_point_layout = QHBoxLayout()
+        self.restore_point_date = QDateEdit()
+        self.restore_point_date.setDate(QDate.currentDate())
+        self.restore_point_date.setCalendarPopup(True)
+        self.restore_point_time = QTimeEdit()
+        self.restore_point_time.setDisplayFormat("HH:mm")
+        self.restore_point_time.setTime(self.restore_point_time.maximumTime())
+        restore_point_layout.addWidget(self.restore_point_date)
+        restore_point_layout.addWidget(self.restore_point_time)
+        layout.addLayout(restore_point_layout)
+        for widget in (self.restore_point_date, self.restore_point_time):
+            widget.setEnabled(False)
+            self.restore_point_checkbox.toggled.connect(widget.setEnabled)
+
         progress_layout = QHBoxLayout()
         self.restore_progress = QProgressBar()
         self.restore_progress.setTextVisible(False)
@@ -782,12 +689,16 @@ class ModernBackupRestoreGUI(QWidget):
         self.apply_combobox_style(self.restore_db_user)
         self.apply_combobox_style(self.restore_db_password)
         self.apply_combobox_style(self.restore_backup_dir)
+        self.apply_combobox_style(self.restore_jobs)
+        self.apply_combobox_style(self.restore_workers)
+        self.apply_combobox_style(self.restore_point_date)
+        self.apply_combobox_style(self.restore_point_time)
 
         page.setLayout(layout)
         return scroll
 
     def perform_manual_backup(self):
-        backup_type = 'Schema' if self.backup_type.currentText() == 'Schema-only Backup' else 'Data'
+        backup_type = self.selected_backup_type()
         file_extension = self.file_extension.currentText().strip('.')
         db_host = self.db_host.text()
         db_port = self.db_port.text()
@@ -800,12 +711,26 @@ class ModernBackupRestoreGUI(QWidget):
             QMessageBox.warning(self, 'Warning', 'Please select a backup directory.')
             return
 
-        self.backup_thread = BackupThread(backup_type, file_extension, db_name, db_host, db_port, db_user, db_password, base_backup_dir)
+        self.backup_thread = BackupThread(backup_type, file_extension, db_name, db_host, db_port, db_user, db_password, base_backup_dir,
+                                          max_workers=self.parallel_jobs.value(), dump_jobs=self.dump_jobs.value() or None,
+                                          compression_level=self.compression_level.value(),
+                                          compression=self.compression_method.currentText(),
+                                          deduplicate=self.deduplicate_checkbox.isChecked(), source='gui')
         self.backup_thread.progress.connect(self.update_backup_progress)
         self.backup_thread.status.connect(self.update_backup_status)
         self.backup_thread.finished.connect(self.backup_finished)
         self.backup_thread.start()
 
+    def selected_backup_type(self):
+        backup_type = self.backup_type.currentText()
+        if backup_type == 'Schema-only Backup':
+            return 'Schema'
+        if backup_type == 'Incremental Backup':
+            return INCREMENTAL_BACKUP
+        if backup_type == 'Parallel COPY Export':
+            return COPY_BACKUP
+        return 'Data'
+
     def schedule_backup(self):
         # Get the task name from the input field
         task_name = self.task_name_input.text()
@@ -831,12 +756,8 @@ class ModernBackupRestoreGUI(QWidget):
         end_date = self.end_date.date().toString("yyyy/MM/dd")
 
         # Get all settings from manual backup tab
-        backup_type = 'Schema' if self.backup_type.currentText() == 'Schema-only Backup' else 'Data'
+        backup_type = self.selected_backup_type()
         file_extension = self.file_extension.currentText().strip('.')
-        db_host = self.db_host.text()
-        db_port = self.db_port.text()
-        db_user = self.db_user.text()
-        db_password = self.db_password.text()
         db_name = self.db_name.text() or "all_databases"
         base_backup_dir = self.backup_dir.text()
 
@@ -850,12 +771,8 @@ class ModernBackupRestoreGUI(QWidget):
         email_notification = self.email_notification_checkbox.isChecked()
         email_address = self.email_address_lineedit.text() if email_notification else None
 
-        # Create a backup script
-        script_content = self.create_backup_script(db_host, db_port, db_user, db_password, db_name, base_backup_dir, backup_type, file_extension)
-        script_path = self.save_backup_script(script_content, task_name)
-
         try:
-            self.schedule_with_task_scheduler(script_path, interval, time, day, weekday, repetition, priority, task_name, email_notification, email_address, description, start_date, end_date)
+            self.schedule_with_task_scheduler(interval, time, day, weekday, repetition, priority, task_name, email_notification, email_address, description, start_date, end_date)
 
             QMessageBox.information(self, 'Backup Scheduled', 
                 f'Backup task "{task_name}" scheduled {interval} at {time}\n'
@@ -866,211 +783,64 @@ class ModernBackupRestoreGUI(QWidget):
                 f'Backup Directory: {base_backup_dir}\n'
                 f'Repetition: Every {repetition} minutes\n'
                 f'Priority: {priority}\n'
+                f'Retention: {format_retention(self.selected_retention()) if self.prune_checkbox.isChecked() else "Keep everything"}\n'
                 f'Email Notification: {"Yes" if email_notification else "No"}\n'
                 f'Start Date: {start_date}\n'
                 f'End Date: {end_date}')
 
+            self.refresh_snapshot()
+
             # Send email notification
             if email_notification and email_address:
                 self.send_email_notification(email_address, "Backup Task Scheduled", f'A new backup task "{task_name}" has been scheduled.')
 
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to schedule task: {str(e)}")
-            # Clean up the created script file if scheduling fails
-            if os.path.exists(script_path):
-                os.remove(script_path)
 
     def task_exists(self, task_name):
         try:
-            result = subprocess.run(['schtasks', '/query', '/tn', task_name], 
-                                    capture_output=True, text=True, check=True)
-            return True
-        except subprocess.CalledProcessError:
-            return False            
-
-    def create_backup_script(self, db_host, db_port, db_user, db_password, db_name, backup_dir, backup_type, file_extension):
-        script = textwrap.dedent(r"""
-        import os
-        import subprocess
-        import sys
-        import psycopg2
-        from datetime import datetime
-
-        def find_pg_dump():
-            possible_paths = [
-                r"C:\Program Files\PostgreSQL\16\bin\pg_dump.exe",
-                r"C:\Program Files\PostgreSQL\15\bin\pg_dump.exe",
-                r"C:\Program Files\PostgreSQL\14\bin\pg_dump.exe",
-                r"C:\Program Files\PostgreSQL\13\bin\pg_dump.exe",
-                r"C:\Program Files\PostgreSQL\12\bin\pg_dump.exe",
-                r"D:\SETUP PROGRAMS\PostgreSQL\16\bin\pg_dump.exe",
-            ]
-            for path in possible_paths:
-                if os.path.exists(path):
-                    return path
-            return "pg_dump"  # Default to just the command name if not found
-
-        def perform_backup(db_host, db_port, db_user, db_password, db_name, backup_dir, backup_type, file_extension):
-            os.environ['PGPASSWORD'] = db_password
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            
-            if db_name != "all_databases":
-                backup_single_database(db_host, db_port, db_user, db_name, backup_dir, backup_type, file_extension, timestamp)
-            else:
-                backup_all_databases(db_host, db_port, db_user, backup_dir, backup_type, file_extension, timestamp)
-
-        def backup_single_database(db_host, db_port, db_user, db_name, backup_dir, backup_type, file_extension, timestamp):
-            if backup_type == 'Schema':
-                backup_subdir = os.path.join(backup_dir, db_host, f"schema_{db_name}", timestamp)
-            else:
-                backup_subdir = os.path.join(backup_dir, db_host, db_name, timestamp)
-            
-            os.makedirs(backup_subdir, exist_ok=True)
-            backup_file = os.path.join(backup_subdir, f"{db_name}.{file_extension}")
-            
-            pg_dump_path = find_pg_dump()
-            cmd = [
-                pg_dump_path,
-                "-h", db_host,
-                "-p", db_port,
-                "-U", db_user,
-                "-F", "p",  # Plain text format
-                "-d", db_name
-            ]
-            
-            if backup_type == 'Schema':
-                cmd.append("-s")
-            
-            try:
-                with open(backup_file, 'w') as f:
-                    subprocess.run(cmd, stdout=f, check=True)
-                print(f"Backup created successfully: {backup_file}")
-            except subprocess.CalledProcessError as e:
-                print(f"Error during backup of {db_name}: {e}")
-
-        def backup_all_databases(db_host, db_port, db_user, backup_dir, backup_type, file_extension, timestamp):
-            try:
-                conn = psycopg2.connect(dbname='postgres', user=db_user, host=db_host, port=db_port)
-                conn.autocommit = True
-                cursor = conn.cursor()
-                
-                cursor.execute("SELECT datname FROM pg_database WHERE datistemplate = false;")
-                databases = [row[0] for row in cursor.fetchall()]
-                
-                for db_name in databases:
-                    backup_single_database(db_host, db_port, db_user, db_name, backup_dir, backup_type, file_extension, timestamp)
-                
-            except psycopg2.Error as e:
-                print(f"Error connecting to PostgreSQL: {e}")
-            finally:
-                if cursor:
-                    cursor.close()
-                if conn:
-                    conn.close()
-
-        if __name__ == "__main__":
-            if len(sys.argv) != 9:
-                print("Usage: python script.py <db_host> <db_port> <db_user> <db_password> <db_name> <backup_dir> <backup_type> <file_extension>")
-                sys.exit(1)
-            
-            perform_backup(*sys.argv[1:])
-        """)
-        return script
-
-    def save_backup_script(self, script_content, task_name):
-        script_dir = os.path.join(tempfile.gettempdir(), 'db_backup_scripts')
-        os.makedirs(script_dir, exist_ok=True)
-        safe_task_name = ''.join(c for c in task_name if c.isalnum() or c in (' ', '_')).rstrip()
-        script_path = os.path.join(script_dir, f'db_backup_{safe_task_name}.py')
-        with open(script_path, 'w', newline='') as f:
-            f.write(script_content)
-        return script_path
-
-
-    def schedule_with_task_scheduler(self, script_path, interval, time, day, weekday, repetition, priority, task_name, email_notification, email_address, description, start_date, end_date):
-        schedule_type = "/sc "
-        if interval == 'Daily':
-            schedule_type += "DAILY"
-        elif interval == 'Weekly':
-            schedule_type += f"WEEKLY /d {self.schedule_weekday.currentText()[:3].upper()}"
-        elif interval == 'Monthly':
-            schedule_type += f"MONTHLY /d {self.schedule_day.value()}"
-
-        python_path = sys.executable
-
-        safe_task_name = ''.join(c for c in task_name if c.isalnum() or c in (' ', '_')).rstrip()
-        batch_file_name = f"run_backup_{safe_task_name}.bat"
-        python_file_name = f"db_backup_{safe_task_name}.py"
-
-        script_dir = os.path.dirname(script_path)
-        batch_file_path = os.path.join(script_dir, batch_file_name)
-        new_script_path = os.path.join(script_dir, python_file_name)
-
-        os.rename(script_path, new_script_path)
+            return self.task_scheduler().task_exists(task_name)
+        except Exception as e:
+            print(f"Failed to look up task: {str(e)}")
+            return False
 
-        # Get the required arguments from the GUI
+    def schedule_with_task_scheduler(self, interval, time, day, weekday, repetition, priority, task_name, email_notification, email_address, description, start_date, end_date):
         db_host = self.db_host.text()
         db_port = self.db_port.text()
         db_user = self.db_user.text()
         db_password = self.db_password.text()
-        db_name = self.db_name.text() or "all_databases"
         backup_dir = self.backup_dir.text()
-        backup_type = 'Schema' if self.backup_type.currentText() == 'Schema-only Backup' else 'Data'
+        backup_type = self.selected_backup_type()
         file_extension = self.file_extension.currentText().strip('.')
-
-        with open(batch_file_path, 'w') as batch_file:
-            batch_file.write('@echo off\n')
-            batch_file.write(r'set PATH=%PATH%;C:\Program Files\PostgreSQL\16\bin;C:\Program Files\PostgreSQL\15\bin;C:\Program Files\PostgreSQL\14\bin;D:\SETUP PROGRAMS\PostgreSQL\16\bin' + '\n')
-            batch_file.write(f'cd /d "%~dp0"\n')
-            batch_file.write(f'start /B "" "{python_path}" "{new_script_path}" "{db_host}" "{db_port}" "{db_user}" "{db_password}" "{db_name}" "{backup_dir}" "{backup_type}" "{file_extension}" >> "{new_script_path[:-3]}_log.txt" 2>&1\n')
-
-        # Convert date format from yyyy/MM/dd to MM/dd/yyyy
-        start_date = datetime.strptime(start_date, "%Y/%m/%d").strftime("%m/%d/%Y")
-        end_date = datetime.strptime(end_date, "%Y/%m/%d").strftime("%m/%d/%Y")
-
-        cmd = f'schtasks /create /tn "{task_name}" /tr "{batch_file_path}" {schedule_type} /st {time} /sd {start_date} /ed {end_date}'
-
-        # Add repetition
-        if repetition > 0:
-            cmd += f" /ri {repetition}"
-
-        # Add additional options
-        if self.run_on_battery.isChecked():
-            cmd += " /rl HIGHEST"
-
-        # Run whether user is logged on or not
-        if self.run_whether_logged_on.isChecked():
-            cmd += " /ru \"SYSTEM\""
+        env = {}
+
+        # Every backend runs the headless CLI, the password goes in the task's environment
+        cli_types = {value: key for key, value in BACKUP_TYPES.items()}
+        command = backup_cli_command('--quiet', 'backup', '--label', task_name, '--host', db_host, '--port', db_port, '--user', db_user,
+                                     '--dir', backup_dir, '--type', cli_types[backup_type],
+                                     '--format', file_extension,
+                                     '--compression', self.compression_method.currentText(),
+                                     '--level', str(self.compression_level.value()),
+                                     '--workers', str(self.parallel_jobs.value()))
+        if self.dump_jobs.value():
+            command += ['--jobs', str(self.dump_jobs.value())]
+        if self.db_name.text():
+            command += ['--db', self.db_name.text()]
+        if self.deduplicate_checkbox.isChecked():
+            command.append('--deduplicate')
+        if self.prune_checkbox.isChecked():
+            command += ['--keep', format_retention(self.selected_retention())]
+        env['PGPASSWORD'] = db_password
 
         try:
-            result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
-            
-            # Set priority and description using Windows API
-            scheduler = win32com.client.Dispatch('Schedule.Service')
-            scheduler.Connect()
-            root_folder = scheduler.GetFolder('\\')
-            task = root_folder.GetTask(task_name)
-            task_definition = task.Definition
-            
-            # Set priority
-            if priority == "High":
-                task_definition.Settings.Priority = 7  # Highest priority
-            elif priority == "Low":
-                task_definition.Settings.Priority = 1  # Lowest priority
-            else:
-                task_definition.Settings.Priority = 4  # Normal priority
-            
-            # Set description
-            task_definition.RegistrationInfo.Description = description
-            
-            root_folder.RegisterTaskDefinition(
-                task_name,
-                task_definition,
-                6,  # Update the existing task
-                None,  # No user
-                None,  # No password
-                3  # Run whether user is logged on or not
-            )
+            definition = TaskDefinition(task_name, command, interval=interval, run_time=time, day=day, weekday=weekday,
+                                        repetition=repetition, priority=priority, description=description,
+                                        start_date=datetime.strptime(start_date, "%Y/%m/%d").date(),
+                                        end_date=datetime.strptime(end_date, "%Y/%m/%d").date(),
+                                        env=env, email_address=email_address if email_notification else None, host=db_host,
+                                        run_elevated=self.run_on_battery.isChecked(),
+                                        run_logged_off=self.run_whether_logged_on.isChecked())
+            self.task_scheduler().create_task(definition)
 
             QMessageBox.information(self, "Task Scheduled", f"Backup task '{task_name}' has been scheduled successfully.")
             
@@ -1086,103 +856,143 @@ class ModernBackupRestoreGUI(QWidget):
             error_message = f"An unexpected error occurred: {str(e)}"
             QMessageBox.critical(self, "Error", error_message)
             print(error_message)
-        finally:
-            # Print the full command for debugging purposes
-            print(f"Executed command: {cmd}")
 
-    def filter_tasks(self):
-        search_text = self.task_search.text().lower()
-        
+    def task_scheduler(self):
+        # Picked on first use: Task Scheduler on Windows, systemd timers or cron elsewhere
+        if self.scheduler_backend is None:
+            self.scheduler_backend = default_scheduler_backend()
+        return self.scheduler_backend
+
+    def task_item_text(self, task, status):
+        last_run = task.last_run.strftime("%Y-%m-%d %H:%M:%S") if task.last_run else "Never"
+        next_run = task.next_run.strftime("%Y-%m-%d %H:%M:%S") if task.next_run else "Not Scheduled"
+        return f"Task: {task.name}\nStatus: {status}\nLast Run: {last_run}\nNext Run: {next_run}"
+
+    def refresh_snapshot(self, report_errors=False):
+        # One enumeration at a time, on a background thread; asked again while one runs, it
+        # runs once more afterwards so changes made in between show up
+        if self.snapshot_thread is not None and self.snapshot_thread.isRunning():
+            self.snapshot_stale = True
+            self.snapshot_thread.report_errors |= report_errors
+            return
         try:
-            scheduler = win32com.client.Dispatch('Schedule.Service')
-            scheduler.Connect()
-            root_folder = scheduler.GetFolder('\\')
-            tasks = root_folder.GetTasks(0)
-            
-            self.task_list.clear()
-            
-            for task in tasks:
-                task_name = task.Name
-                if not task_name.startswith("Backup_"):
-                    continue
-                    
-                # Apply search filter
-                if search_text and search_text not in task_name.lower():
-                    continue
-                    
-                # Create list item without checkbox
-                item = QListWidgetItem()
-                
-                # Format task information
-                status = 'Running' if task.State == 4 else 'Not Running'
-                last_run = task.LastRunTime.strftime("%Y-%m-%d %H:%M:%S") if task.LastRunTime else "Never"
-                next_run = task.NextRunTime.strftime("%Y-%m-%d %H:%M:%S") if task.NextRunTime else "Not Scheduled"
-                
-                item_text = f"Task: {task_name}\nStatus: {status}\nLast Run: {last_run}\nNext Run: {next_run}"
-                item.setText(item_text)
-                
-                # Store task name as item data
-                item.setData(Qt.UserRole, task_name)
-                
-                self.task_list.addItem(item)
-                
-            self.update_statistics()
-            
+            scheduler = self.task_scheduler()
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to filter tasks: {str(e)}")       
+            self.snapshot_failed(str(e), report_errors)
+            return
+        thread = TaskSnapshotThread(scheduler, report_errors)
+        thread.loaded.connect(self.snapshot_loaded)
+        thread.failed.connect(lambda message: self.snapshot_failed(message, thread.report_errors))
+        self.snapshot_thread = thread
+        thread.start()
+
+    def snapshot_loaded(self, tasks):
+        self.task_snapshot = tasks
+        self.render_task_list()
+        self.update_statistics()
+        self.snapshot_finished()
+
+    def snapshot_failed(self, message, report_errors):
+        # The periodic refresh only logs, a click on View Tasks gets a message box
+        if report_errors:
+            QMessageBox.critical(self, "Error", f"Failed to refresh task list: {message}")
+        else:
+            print(f"Failed to refresh task list: {message}")
+        self.snapshot_finished()
+
+    def snapshot_finished(self):
+        if self.snapshot_stale:
+            self.snapshot_stale = False
+            QTimer.singleShot(0, self.refresh_snapshot)
+
+    def render_task_list(self):
+        search_text = self.task_search.text().lower()
+        wanted = []
+        for task in self.task_snapshot:
+            if self.task_list_backups_only and not task.name.startswith("Backup_"):
+                continue
+            # Apply search filter
+            if search_text and search_text not in task.name.lower():
+                continue
+            if self.task_list_backups_only:
+                text = self.task_item_text(task, 'Running' if task.running else 'Not Running')
+            else:
+                # Add separator line between task details
+                text = f"{self.task_item_text(task, 'Enabled' if task.enabled else 'Disabled')}\n{'-' * 50}"
+            wanted.append((task.name, text))
+
+        # Diffed into the list, items that stay keep their selection and the view does not jump
+        for row, (task_name, text) in enumerate(wanted):
+            item = self.task_list.item(row)
+            if item is None or item.data(Qt.UserRole) != task_name:
+                item = None
+                for other_row in range(row + 1, self.task_list.count()):
+                    if self.task_list.item(other_row).data(Qt.UserRole) == task_name:
+                        item = self.task_list.takeItem(other_row)
+                        break
+                if item is None:
+                    item = QListWidgetItem()
+                    # Store task name as item data
+                    item.setData(Qt.UserRole, task_name)
+                self.task_list.insertItem(row, item)
+            if item.text() != text:
+                item.setText(text)
+        while self.task_list.count() > len(wanted):
+            self.task_list.takeItem(len(wanted))
+
+    def filter_tasks(self):
+        self.task_list_backups_only = True
+        self.render_task_list()
 
     def update_statistics(self):
+        stats = task_statistics(task for task in self.task_snapshot if task.name.startswith("Backup_"))
+        self.total_tasks_label.setText(f"Total Tasks: {stats['total']}")
+        self.active_tasks_label.setText(f"Active Tasks: {stats['active']}")
+        self.completed_tasks_label.setText(f"Completed Tasks: {stats['completed']}")
+        self.failed_tasks_label.setText(f"Failed Tasks: {stats['failed']}")
+        self.update_history_statistics()
+
+    def update_history_statistics(self):
         try:
-            scheduler = win32com.client.Dispatch('Schedule.Service')
-            scheduler.Connect()
-            root_folder = scheduler.GetFolder('\\')
-            tasks = root_folder.GetTasks(0)
-            
-            total_tasks = 0
-            active_tasks = 0
-            completed_tasks = 0
-            failed_tasks = 0
-            
-            for task in tasks:
-                if not task.Name.startswith("Backup_"):
-                    continue
-                    
-                total_tasks += 1
-                
-                # Check task state
-                if task.State == 4:  # TASK_STATE_RUNNING
-                    active_tasks += 1
-                
-                # Check last run result
-                if task.LastTaskResult == 0:  # S_OK (Success)
-                    completed_tasks += 1
-                elif task.LastTaskResult != 0 and task.LastRunTime:  # Error occurred
-                    failed_tasks += 1
-                
-                # Update labels with formatted text
-                self.total_tasks_label.setText(f"Total Tasks: {total_tasks}")
-                self.active_tasks_label.setText(f"Active Tasks: {active_tasks}")
-                self.completed_tasks_label.setText(f"Completed Tasks: {completed_tasks}")
-                self.failed_tasks_label.setText(f"Failed Tasks: {failed_tasks}")
-                
-                # Apply styling to the statistics labels
-                stats_style = """
-                    QLabel {
-                        font-size: 14px;
-                        padding: 5px;
-                        border-radius: 3px;
-                        background-color: %s;
-                        color: %s;
-                    }
-                """ % (('#424242' if self.dark_mode else '#f0f0f0'),
-                    ('#ffffff' if self.dark_mode else '#000000'))
-                
-                for label in [self.total_tasks_label, self.active_tasks_label, 
-                            self.completed_tasks_label, self.failed_tasks_label]:
-                    label.setStyleSheet(stats_style)
-                    
-        except Exception as e:
-            print(f"Failed to update statistics: {str(e)}")
+            with RunHistory() as history:
+                summary = history.summary(days=HISTORY_SUMMARY_DAYS)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Failed to read the run history: {str(e)}")
+            return
+        self.history_runs_label.setText(f"Runs ({HISTORY_SUMMARY_DAYS} days): {summary['runs']}, {summary['failed']} failed")
+        if summary['success_rate'] is not None:
+            self.success_rate_label.setText(f"Success Rate: {summary['success_rate']:.0%}, "
+                                            f"median {format_duration(summary['median_seconds'] or 0)}")
+        if summary['throughput']:
+            text = f"Backup Throughput: {format_size(summary['throughput'])}/s"
+            if summary['previous_throughput']:
+                # The last ten backups against the ten before them
+                change = summary['throughput'] / summary['previous_throughput'] - 1
+                text += f" ({change:+.0%})"
+            self.throughput_label.setText(text)
+        slow_runs = summary['slow_runs']
+        self.slow_runs_label.setText(f"Slower Than Baseline: {len(slow_runs)}")
+        self.slow_runs_label.setToolTip("\n".join(
+            f"{run['started_at']} {run['kind']} {run['label'] or run['source'] or ''}: "
+            f"{format_duration(run['seconds'])}, usually {format_duration(run['baseline_seconds'])}"
+            for run in slow_runs[:20]))
+
+    def apply_statistics_style(self):
+        stats_style = """
+            QLabel {
+                font-size: 14px;
+                padding: 5px;
+                border-radius: 3px;
+                background-color: %s;
+                color: %s;
+            }
+        """ % (('#424242' if self.dark_mode else '#f0f0f0'),
+            ('#ffffff' if self.dark_mode else '#000000'))
+        for label in [self.total_tasks_label, self.active_tasks_label, 
+                    self.completed_tasks_label, self.failed_tasks_label,
+                    self.history_runs_label, self.success_rate_label,
+                    self.throughput_label, self.slow_runs_label]:
+            label.setStyleSheet(stats_style)
 
     def get_selected_task_name(self):
         selected_items = self.task_list.selectedItems()
@@ -1200,14 +1010,12 @@ class ModernBackupRestoreGUI(QWidget):
             QMessageBox.warning(self, "Warning", "Please select a task to edit")
             return
             
-        # Get task name from the selected item's text
-        task_text = selected_items[0].text()
-        task_name = task_text.split('\n')[0].replace('Task: ', '')
+        task_name = selected_items[0].data(Qt.UserRole)
         
         try:
-            scheduler = win32com.client.Dispatch('Schedule.Service')
-            scheduler.Connect()
-            task = scheduler.GetFolder('\\').GetTask(task_name)
+            task = next((task for task in self.task_snapshot if task.name == task_name), None)
+            if task is None:
+                task = self.task_scheduler().get_task(task_name)
             
             # Create edit dialog
             dialog = QDialog(self)
@@ -1216,14 +1024,14 @@ class ModernBackupRestoreGUI(QWidget):
             
             # Add edit fields
             time_edit = QTimeEdit()
-            time_edit.setTime(datetime.strptime(task.Definition.Triggers[0].StartBoundary, 
-                            "%Y-%m-%dT%H:%M:%S").time())
+            if task.run_time:
+                time_edit.setTime(datetime.strptime(task.run_time, "%H:%M").time())
             
             priority_combo = self.create_combobox(['Low', 'Normal', 'High'])
-            priority_combo.setCurrentText(self.get_task_priority(task))
+            priority_combo.setCurrentText(task.priority)
             
             email_checkbox = QCheckBox()
-            email_checkbox.setChecked(bool(task.Definition.Actions.Count > 1))
+            email_checkbox.setChecked(task.email_enabled)
             
             layout.addRow("Run Time:", time_edit)
             layout.addRow("Priority:", priority_combo)
@@ -1246,56 +1054,13 @@ class ModernBackupRestoreGUI(QWidget):
 
     def update_task(self, task_name, new_time, new_priority, email_enabled):
         try:
-            # Connect to Task Scheduler
-            scheduler = win32com.client.Dispatch('Schedule.Service')
-            scheduler.Connect()
-            root_folder = scheduler.GetFolder('\\')
-            task = root_folder.GetTask(task_name)
-            task_def = task.Definition
-            
-            # Update time
-            for trigger in task_def.Triggers:
-                # Parse existing date from trigger
-                current_datetime = datetime.strptime(trigger.StartBoundary, "%Y-%m-%dT%H:%M:%S")
-                # Create new datetime with updated time
-                new_datetime = current_datetime.replace(
-                    hour=new_time.hour(),
-                    minute=new_time.minute(),
-                    second=0
-                )
-                # Update trigger
-                trigger.StartBoundary = new_datetime.strftime("%Y-%m-%dT%H:%M:%S")
-            
-            # Update priority
-            priority_levels = {
-                "Low": 0,    # IDLE
-                "Normal": 4, # NORMAL
-                "High": 7    # HIGHEST
-            }
-            task_def.Settings.Priority = priority_levels.get(new_priority, 4)
-            
-            # Update email notification settings
-            if email_enabled and self.email_address_lineedit.text():
-                # Add or update email action if enabled
-                if task_def.Actions.Count <= 1:  # Only backup action exists
-                    email_action = task_def.Actions.Create(0)  # Create email action
-                    email_action.From = "firetiger555@gmail.com"
-                    email_action.To = self.email_address_lineedit.text()
-                    email_action.Subject = f"Backup Task '{task_name}' Completed"
-                    email_action.Body = "The scheduled backup task has been completed."
-            elif task_def.Actions.Count > 1:  # Remove email action if disabled
-                task_def.Actions.Remove(2)
-                
-            # Register the updated task
-            root_folder.RegisterTaskDefinition(
-                task_name,
-                task_def,
-                6,  # Update existing task
-                None,  # No user
-                None,  # No password
-                3  # Run whether user is logged on or not
-            )
-            
+            # An empty address removes the notification, None leaves it as it is
+            if email_enabled:
+                email_address = self.email_address_lineedit.text() or None
+            else:
+                email_address = ''
+            self.task_scheduler().update_task(task_name, run_time=new_time.toString("HH:mm"),
+                                              priority=new_priority, email_address=email_address)
             
             # Refresh the task list
             self.refresh_task_list()
@@ -1305,47 +1070,11 @@ class ModernBackupRestoreGUI(QWidget):
         except Exception as e:
             raise Exception(f"Failed to update task: {str(e)}")
 
-    def get_task_priority(self, task):
-        # Map Windows Task Scheduler priority levels to our priority options
-        priority_map = {
-            0: "Low",      # IDLE
-            4: "Normal",   # NORMAL
-            7: "High"      # HIGHEST
-        }
-        
-        task_priority = task.Definition.Settings.Priority
-        return priority_map.get(task_priority, "Normal")  # Default to Normal if priority not found
-
     def refresh_task_list(self):
-        self.task_list.clear()
-        
-        try:
-            scheduler = win32com.client.Dispatch('Schedule.Service')
-            scheduler.Connect()
-            root_folder = scheduler.GetFolder('\\')
-            tasks = root_folder.GetTasks(0)
-            
-            filter_text = self.task_search.text().lower()
-            
-            for task in tasks:
-                task_name = task.Name
-                if filter_text in task_name.lower():
-                    item = QListWidgetItem()
-                    
-                    status = "Enabled" if task.Enabled else "Disabled"
-                    last_run = task.LastRunTime.strftime("%Y-%m-%d %H:%M:%S") if task.LastRunTime else "Never"
-                    next_run = task.NextRunTime.strftime("%Y-%m-%d %H:%M:%S") if task.NextRunTime else "Not Scheduled"
-                    
-                    # Add separator line between task details
-                    item_text = f"Task: {task_name}\nStatus: {status}\nLast Run: {last_run}\nNext Run: {next_run}\n{'-' * 50}"
-                    item.setText(item_text)
-                    item.setData(Qt.UserRole, task_name)
-                    
-                    self.task_list.addItem(item)
-                    self.update_statistics()
-                        
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to refresh task list: {str(e)}")
+        # Shows every task from the snapshot right away, the fresh one follows
+        self.task_list_backups_only = False
+        self.render_task_list()
+        self.refresh_snapshot(report_errors=True)
             
     def run_task_now(self):
         # Get the currently selected item from the QListWidget
@@ -1359,11 +1088,9 @@ class ModernBackupRestoreGUI(QWidget):
         task_name = selected_item.data(Qt.UserRole)  # Get the stored task name
         
         try:
-            scheduler = win32com.client.Dispatch('Schedule.Service')
-            scheduler.Connect()
-            task = scheduler.GetFolder('\\').GetTask(task_name)
-            task.Run(0)
+            self.task_scheduler().run_task(task_name)
             
+            self.refresh_snapshot()
             
             QMessageBox.information(self, "Success", 
                 f'Task "{task_name}" has been started.')
@@ -1381,26 +1108,11 @@ class ModernBackupRestoreGUI(QWidget):
         task_name = selected_item.data(Qt.UserRole)
         
         try:
-            scheduler = win32com.client.Dispatch('Schedule.Service')
-            scheduler.Connect()
-            task = scheduler.GetFolder('\\').GetTask(task_name)
-            
-            # Get current state
-            enabled = task.Enabled
+            scheduler = self.task_scheduler()
             
             # Toggle state
-            task_definition = task.Definition
-            task_definition.Settings.Enabled = not enabled
-            
-            # Update task
-            scheduler.GetFolder('\\').RegisterTaskDefinition(
-                task_name,
-                task_definition,
-                6,  # Update existing task
-                None,  # No user
-                None,  # No password
-                3  # Run whether user is logged on or not
-            )
+            enabled = scheduler.get_task(task_name).enabled
+            scheduler.set_enabled(task_name, not enabled)
             
             # Log state change
             new_state = "Enabled" if not enabled else "Disabled"
@@ -1431,11 +1143,10 @@ class ModernBackupRestoreGUI(QWidget):
         
         if reply == QMessageBox.Yes:
             try:
-                # Delete the task using schtasks
-                subprocess.run(['schtasks', '/delete', '/tn', task_name, '/f'], 
-                            check=True, capture_output=True, text=True)
+                self.task_scheduler().delete_task(task_name)
                 
-                # Delete associated script and batch files
+                # Tasks scheduled by older versions ran a generated script through a batch file,
+                # remove what they left behind
                 script_dir = os.path.join(tempfile.gettempdir(), 'db_backup_scripts')
                 safe_task_name = ''.join(c for c in task_name if c.isalnum() or c in (' ', '_')).rstrip()
                 
@@ -1456,7 +1167,6 @@ class ModernBackupRestoreGUI(QWidget):
                 
                 # Refresh the task list
                 self.refresh_task_list()
-                self.update_statistics()
                 
                 QMessageBox.information(self, "Success", 
                     f'Task "{task_name}" and associated files have been deleted.')
@@ -1468,6 +1178,10 @@ class ModernBackupRestoreGUI(QWidget):
 
 
     def send_email_notification(self, email_address, subject, message):
+        import smtplib
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+
         # Email configuration
         sender_email = "firetiger555@gmail.com"  # Replace with your Gmail address
         sender_password = "jqfs zlyt rprs ehtb"   # Replace with your Gmail app password
@@ -1537,6 +1251,7 @@ class ModernBackupRestoreGUI(QWidget):
             QMessageBox.critical(self, 'Error', message)
         self.backup_progress.setValue(0)
         self.backup_percentage.setText('0%')
+        self.update_history_statistics()
 
     def perform_restore(self):
         db_host = self.restore_db_host.text()
@@ -1549,7 +1264,16 @@ class ModernBackupRestoreGUI(QWidget):
             QMessageBox.warning(self, 'Warning', 'Please select a restore directory.')
             return
 
-        self.restore_thread = RestoreThread(db_host, db_port, db_user, db_password, backup_dir)
+        restore_point = None
+        if self.restore_point_checkbox.isChecked():
+            restore_point = datetime.combine(self.restore_point_date.date().toPyDate(),
+                                             self.restore_point_time.time().toPyTime().replace(second=59))
+
+        self.restore_thread = RestoreThread(db_host, db_port, db_user, db_password, backup_dir,
+                                            restore_jobs=self.restore_jobs.value() or None,
+                                            restore_workers=self.restore_workers.value(),
+                                            fast_restore=self.fast_restore_checkbox.isChecked(),
+                                            restore_point=restore_point, source='gui')
         self.restore_thread.progress.connect(self.update_restore_progress)
         self.restore_thread.status.connect(self.update_restore_status)
         self.restore_thread.finished.connect(self.restore_finished)
@@ -1569,12 +1293,14 @@ class ModernBackupRestoreGUI(QWidget):
             QMessageBox.critical(self, 'Error', message)
         self.restore_progress.setValue(0)
         self.restore_percentage.setText('0%')
+        self.update_history_statistics()
 
     def toggle_dark_mode(self):
         self.dark_mode = not self.dark_mode
         self.setStyleSheet(self.get_stylesheet())
         self.update_dark_mode_button()
         self.update_icons()
+        self.apply_statistics_style()
         
         # Reapply styles to all widgets
         for page in [self.main_page, self.backup_page, self.restore_page]:
@@ -2022,6 +1748,9 @@ class ModernBackupRestoreGUI(QWidget):
             self.schedule_weekday.setEnabled(False)
 
 def main():
+    # Scheduled tasks of the frozen build run the CLI through this executable, see backup_cli_command
+    if sys.argv[1:2] == [CLI_ARGUMENT]:
+        sys.exit(backup_cli.main(sys.argv[2:]))
     app = QApplication(sys.argv)
     app.setWindowIcon(QIcon("icons/app_icon.png"))
     ex = ModernBackupRestoreGUI()
@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Cold-start benchmark: every run is a fresh interpreter, like a cron job or a double-click.
+# Run it from anywhere; --record appends the medians to a JSON lines file so regressions show
+# up over time, --budget makes it fail when a target's overhead over the bare interpreter, the
+# cost of our own imports, exceeds the given milliseconds.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (code run in the fresh interpreter, module that must be importable for it to make sense)
+TARGETS = {
+    'cli': ("import sys; sys.argv = ['backup_cli.py', '--help']\n"
+            "import backup_cli\n"
+            "try:\n    backup_cli.main()\nexcept SystemExit:\n    pass", None),
+    'engine': ("import backup_engine", None),
+    'gui': ("import backup_restore", 'PyQt5'),
+}
+
+def measure(code, runs):
+    # Bytecode is cached like on an installed host, the first, untimed run writes it
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    timings = []
+    for run in range(runs + 1):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if run:
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold-start time of the CLI, engine and GUI.")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--record', metavar='FILE', help="append the results to this JSON lines file")
+    parser.add_argument('--budget', type=float, metavar='MS',
+                        help="fail when a target's median overhead over the bare interpreter exceeds this")
+    args = parser.parse_args(argv)
+
+    # The interpreter alone, subtracted so the numbers are what our imports cost
+    baseline = statistics.median(measure("pass", args.runs))
+    results = {'baseline_ms': round(baseline, 1)}
+    # Every target gets its key in the record, null with the reason when it could not be measured,
+    # so entries from hosts without PyQt5 still line up with the others
+    skipped = {}
+    over_budget = []
+    print(f"{'interpreter':<12}{baseline:8.1f} ms")
+    for name, (code, requirement) in TARGETS.items():
+        if requirement and subprocess.run([sys.executable, "-c", f"import {requirement}"],
+                                          capture_output=True).returncode != 0:
+            print(f"{name:<12}  skipped, {requirement} is not installed")
+            results[f"{name}_ms"] = None
+            skipped[name] = f"{requirement} is not installed"
+            continue
+        try:
+            median = statistics.median(measure(code, args.runs))
+        except subprocess.CalledProcessError:
+            print(f"{name:<12}  failed to start")
+            results[f"{name}_ms"] = None
+            skipped[name] = "failed to start"
+            over_budget.append(name)
+            continue
+        results[f"{name}_ms"] = round(median, 1)
+        print(f"{name:<12}{median:8.1f} ms  (+{median - baseline:.1f} ms over the interpreter)")
+        # The budget is for what our imports add, the interpreter's own start is not ours to cut
+        if args.budget is not None and median - baseline > args.budget:
+            over_budget.append(name)
+
+    if args.record:
+        results.update({
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'runs': args.runs,
+            'skipped': skipped,
+        })
+        with open(args.record, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(results) + "\n")
+
+    if over_budget:
+        print(f"Over budget: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,445 @@
+import os
+import json
+import queue
+import subprocess
+import threading
+
+from backup_engine import (
+    CONNECTION_POOL, COPY_TOC_FILE, DEFAULT_COMPRESSION_LEVEL, STREAM_CHUNK_SIZE, HashingWriter, compression_suffix,
+    file_checksum, open_compressed_reader, open_compressed_writer, quote_ident
+)
+
+# Table data exported with COPY instead of pg_dump. The coordinator opens a repeatable read
+# transaction and exports its snapshot; pg_dump writes the schema and every worker connection
+# copies tables out under that same snapshot, so the export is as consistent as one pg_dump.
+# Large tables are split into block (ctid) or primary key ranges that workers take in parallel.
+#
+# Layout of a db.copy directory, flat so the manifest can hash it like a directory archive:
+#   pre-data.sql     tables, types, functions: what has to exist before the data goes in
+#   post-data.sql    indexes, constraints, triggers: applied after the data
+#   0001.000.bin     data of the first table, first range (.csv for CSV, plus codec suffix)
+#   copy_toc.json    written last, lists tables, columns, files and sequence values; until it is
+#                    there the export is incomplete
+#
+# CopyLoader restores one: pre-data with psql, then every data file through COPY FROM STDIN on
+# several connections at once, then post-data. Primary and foreign keys, indexes and triggers
+# are all post-data, so the files load in any order and no constraint is checked during the load.
+
+COPY_FORMATS = ('binary', 'csv')
+COPY_FILE_EXTENSIONS = {'binary': '.bin', 'csv': '.csv'}
+PRE_DATA_FILE = 'pre-data.sql'
+POST_DATA_FILE = 'post-data.sql'
+COPY_TOC_VERSION = 1
+# Tables larger than this are split into ranges of about this size
+COPY_RANGE_BYTES = 128 * 1024 * 1024
+COPY_MAX_RANGES = 64
+# TID range scans arrived in PostgreSQL 14, before that a ctid range reads the whole table
+TID_RANGE_SCAN_VERSION = 140000
+# Generated columns cannot be copied back in, they exist from PostgreSQL 12
+GENERATED_COLUMNS_VERSION = 120000
+
+class CopyPieceWriter:
+    # Collects the many small writes copy_expert makes, one per row, into STREAM_CHUNK_SIZE blocks
+    def __init__(self, target, progress=None):
+        self.target = target
+        self.progress = progress
+        self.buffer = bytearray()
+        self.bytes = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer += data
+        if len(self.buffer) >= STREAM_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.target.write(self.buffer)
+            self.bytes += len(self.buffer)
+            if self.progress:
+                self.progress(len(self.buffer))
+            self.buffer = bytearray()
+
+class CopyPieceReader:
+    # What copy_expert reads a data file through: decompressed data out, raw file position reported
+    def __init__(self, source, raw, progress=None):
+        self.source = source
+        self.raw = raw
+        self.progress = progress
+        self.position = 0
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        if self.progress:
+            position = self.raw.tell()
+            self.progress(position - self.position)
+            self.position = position
+        return data
+
+def copy_ranges(blocks, count):
+    # count (start, end) block ranges over a table of blocks blocks; the first has no start and
+    # the last no end, so rows in blocks added after the size was read are still covered
+    bounds = [blocks * i // count for i in range(count + 1)]
+    ranges = []
+    for i in range(count):
+        ranges.append((bounds[i] if i else None, bounds[i + 1] if i < count - 1 else None))
+    return ranges
+
+def range_condition(column, start, end):
+    conditions = []
+    if start is not None:
+        conditions.append(f"{column} >= {start}")
+    if end is not None:
+        conditions.append(f"{column} < {end}")
+    return " AND ".join(conditions) or None
+
+def copy_out_sql(table, condition, copy_format):
+    qualified = f"{quote_ident(table['schema'])}.{quote_ident(table['table'])}"
+    columns = ", ".join(quote_ident(column) for column in table['columns'])
+    if condition:
+        source = f"(SELECT {columns} FROM {qualified} WHERE {condition})"
+    else:
+        source = f"{qualified} ({columns})" if columns else qualified
+    return f"COPY {source} TO STDOUT WITH (FORMAT {copy_format})"
+
+def copy_in_sql(table, copy_format):
+    qualified = f"{quote_ident(table['schema'])}.{quote_ident(table['table'])}"
+    columns = ", ".join(quote_ident(column) for column in table['columns'])
+    return f"COPY {qualified}{f' ({columns})' if columns else ''} FROM STDIN WITH (FORMAT {copy_format})"
+
+class CopyJob:
+    # What exporter and loader share: pooled connections to one database, a set of workers taking
+    # pieces from a queue, and progress summed over them. progress is called from the worker
+    # threads with the bytes done so far; status gets messages meant for the user.
+    def __init__(self, db_host, db_port, db_user, db_password, db_name, workers=2, pool=None, progress=None,
+                 status=None):
+        self.db_host = db_host
+        self.db_port = db_port
+        self.db_user = db_user
+        self.db_password = db_password
+        self.db_name = db_name
+        self.workers = max(1, workers)
+        self.pool = pool or CONNECTION_POOL
+        self.progress = progress
+        self.status = status or (lambda message: None)
+        self.progress_lock = threading.Lock()
+        self.done_bytes = 0
+
+    def connect(self):
+        return self.pool.acquire(self.db_host, self.db_port, self.db_user, self.db_password, self.db_name)
+
+    def report(self, count):
+        with self.progress_lock:
+            self.done_bytes += count
+            done = self.done_bytes
+        if self.progress:
+            self.progress(done)
+
+    def run_workers(self, pieces, work, begin=None, end=None):
+        # work(cursor, piece) for every piece, in order, on up to self.workers connections; begin and
+        # end run once per connection. The first error stops the other workers and is raised here.
+        work_queue = queue.Queue()
+        for piece in pieces:
+            work_queue.put(piece)
+        failed = threading.Event()
+        errors = []
+
+        def worker():
+            conn = None
+            try:
+                conn = self.connect()
+                with conn.cursor() as cursor:
+                    if begin:
+                        begin(cursor)
+                    while not failed.is_set():
+                        try:
+                            piece = work_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        work(cursor, piece)
+                    if end and not failed.is_set():
+                        end(cursor)
+            except Exception as e:
+                errors.append(e)
+                failed.set()
+            finally:
+                if conn is not None:
+                    # Left inside a transaction after an error, the pool closes it instead of keeping it
+                    self.pool.release(conn)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(self.workers, len(pieces)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+class CopyExporter(CopyJob):
+    # progress counts uncompressed bytes copied out
+    def __init__(self, db_host, db_port, db_user, db_password, db_name, pg_dump_path, workers=2,
+                 copy_format='binary', compression='none', compression_level=DEFAULT_COMPRESSION_LEVEL,
+                 pool=None, progress=None, status=None):
+        if copy_format not in COPY_FORMATS:
+            raise ValueError(f"Unknown COPY format '{copy_format}'")
+        CopyJob.__init__(self, db_host, db_port, db_user, db_password, db_name, workers, pool, progress, status)
+        self.pg_dump_path = pg_dump_path
+        self.copy_format = copy_format
+        self.compression = compression or 'none'
+        self.compression_level = compression_level
+
+    def list_tables(self, cursor, server_version):
+        generated = "AND a.attgenerated = ''" if server_version >= GENERATED_COLUMNS_VERSION else ""
+        # Ordinary tables and leaf partitions, not the catalogs and not the tables of extensions
+        cursor.execute(f"""
+            SELECT n.nspname, c.relname, pg_relation_size(c.oid),
+                   ARRAY(SELECT a.attname FROM pg_attribute a
+                         WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped {generated}
+                         ORDER BY a.attnum),
+                   (SELECT a.attname FROM pg_index i
+                    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                    WHERE i.indrelid = c.oid AND i.indisprimary AND i.indnatts = 1
+                      AND a.atttypid IN ('int2'::regtype, 'int4'::regtype, 'int8'::regtype))
+            FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'r' AND c.relpersistence <> 't'
+              AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+              AND n.nspname NOT LIKE 'pg_toast%'
+              AND NOT EXISTS (SELECT 1 FROM pg_depend d
+                              WHERE d.classid = 'pg_class'::regclass AND d.objid = c.oid AND d.deptype = 'e')
+            ORDER BY 3 DESC, 1, 2;
+        """)
+        return [{'schema': schema, 'table': table, 'bytes': size, 'columns': list(columns), 'primary_key': key}
+                for schema, table, size, columns, key in cursor.fetchall()]
+
+    def read_sequences(self, cursor):
+        # Sequence values belong to pg_dump's data section, which the export leaves out
+        cursor.execute("""
+            SELECT n.nspname, c.relname
+            FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'S' AND c.relpersistence <> 't'
+              AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+              AND NOT EXISTS (SELECT 1 FROM pg_depend d
+                              WHERE d.classid = 'pg_class'::regclass AND d.objid = c.oid AND d.deptype = 'e')
+            ORDER BY 1, 2;
+        """)
+        sequences = []
+        for schema, name in cursor.fetchall():
+            cursor.execute(f"SELECT last_value, is_called FROM {quote_ident(schema)}.{quote_ident(name)};")
+            last_value, is_called = cursor.fetchone()
+            sequences.append({'schema': schema, 'sequence': name, 'last_value': last_value, 'is_called': is_called})
+        return sequences
+
+    def plan_ranges(self, cursor, table, server_version, block_size):
+        # (split, [condition, ...]) for one table, a single None condition copies it whole
+        count = min(COPY_MAX_RANGES, -(-table['bytes'] // COPY_RANGE_BYTES))
+        if count < 2:
+            return None, [None]
+        if server_version >= TID_RANGE_SCAN_VERSION:
+            blocks = table['bytes'] // block_size
+            return 'ctid', [range_condition('ctid', *(f"'({block},0)'::tid" if block is not None else None
+                                                       for block in bounds))
+                            for bounds in copy_ranges(blocks, count)]
+        if table['primary_key']:
+            key = quote_ident(table['primary_key'])
+            cursor.execute(f"SELECT min({key}), max({key}) FROM "
+                           f"{quote_ident(table['schema'])}.{quote_ident(table['table'])};")
+            low, high = cursor.fetchone()
+            if low is not None and high > low:
+                ranges = copy_ranges(high - low + 1, count)
+                return 'primary_key', [range_condition(key, *(low + bound if bound is not None else None
+                                                              for bound in bounds))
+                                       for bounds in ranges]
+        return None, [None]
+
+    def start_schema_dump(self, snapshot, section, path, stderr):
+        # pg_dump takes the schema from the very snapshot the data is copied under
+        return subprocess.Popen([
+            self.pg_dump_path,
+            "-h", self.db_host,
+            "-p", self.db_port,
+            "-U", self.db_user,
+            "-d", self.db_name,
+            "--snapshot", snapshot,
+            "--section", section,
+            "-f", path
+        ], stdout=subprocess.DEVNULL, stderr=stderr)
+
+    def export_piece(self, cursor, target_dir, piece):
+        path = os.path.join(target_dir, piece['file'])
+        with HashingWriter(open(path, 'wb')) as raw:
+            with open_compressed_writer(raw, self.compression, self.compression_level) as codec:
+                writer = CopyPieceWriter(codec, self.report)
+                cursor.copy_expert(copy_out_sql(piece['table'], piece['where'], self.copy_format), writer)
+                writer.flush()
+        piece['bytes'] = raw.bytes
+        piece['sha256'] = raw.sha256.hexdigest()
+        piece['stream_bytes'] = writer.bytes
+        piece['rows'] = cursor.rowcount if cursor.rowcount >= 0 else None
+
+    def run(self, target_dir):
+        # Writes the export into target_dir, which must not exist yet, and returns its table of contents
+        os.makedirs(target_dir)
+        conn = self.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("BEGIN ISOLATION LEVEL REPEATABLE READ, READ ONLY;")
+                cursor.execute("SELECT pg_export_snapshot(), current_setting('block_size')::int;")
+                snapshot, block_size = cursor.fetchone()
+                server_version = conn.server_version
+                tables = self.list_tables(cursor, server_version)
+                sequences = self.read_sequences(cursor)
+                if tables:
+                    # Nobody can drop or rewrite a table between the snapshot and its COPY
+                    cursor.execute("LOCK TABLE " + ", ".join(
+                        f"{quote_ident(table['schema'])}.{quote_ident(table['table'])}" for table in tables
+                    ) + " IN ACCESS SHARE MODE;")
+
+                with open(os.path.join(target_dir, 'pg_dump.log'), 'wb') as stderr:
+                    schema_dumps = [self.start_schema_dump(snapshot, section, os.path.join(target_dir, name), stderr)
+                                    for section, name in (('pre-data', PRE_DATA_FILE), ('post-data', POST_DATA_FILE))]
+
+                    pieces = []
+                    extension = COPY_FILE_EXTENSIONS[self.copy_format] + compression_suffix(self.compression)
+                    for number, table in enumerate(tables, 1):
+                        table['split'], conditions = self.plan_ranges(cursor, table, server_version, block_size)
+                        table['pieces'] = []
+                        for index, condition in enumerate(conditions):
+                            piece = {'file': f"{number:04d}.{index:03d}{extension}", 'where': condition, 'table': table}
+                            table['pieces'].append(piece)
+                            pieces.append(piece)
+                    workers = min(self.workers, len(pieces)) or 1
+                    self.status(f"Copying {len(tables)} tables of {self.db_name} in {len(pieces)} parts "
+                                f"with {workers} connections")
+
+                    def begin(worker_cursor):
+                        worker_cursor.execute("BEGIN ISOLATION LEVEL REPEATABLE READ, READ ONLY;")
+                        worker_cursor.execute("SET TRANSACTION SNAPSHOT %s;", (snapshot,))
+
+                    def export(worker_cursor, piece):
+                        self.export_piece(worker_cursor, target_dir, piece)
+
+                    def end(worker_cursor):
+                        worker_cursor.execute("COMMIT;")
+
+                    try:
+                        # Largest tables were listed first, their ranges go out first
+                        self.run_workers(pieces, export, begin, end)
+                    finally:
+                        schema_failed = [process.wait() != 0 for process in schema_dumps]
+                cursor.execute("COMMIT;")
+        finally:
+            self.pool.release(conn)
+
+        if any(schema_failed):
+            with open(os.path.join(target_dir, 'pg_dump.log'), encoding='utf-8', errors='replace') as f:
+                raise subprocess.CalledProcessError(1, self.pg_dump_path, stderr=f.read())
+        os.remove(os.path.join(target_dir, 'pg_dump.log'))
+
+        for table in tables:
+            for piece in table['pieces']:
+                del piece['table']
+        toc = {
+            'version': COPY_TOC_VERSION,
+            'format': self.copy_format,
+            'compression': self.compression,
+            'snapshot': snapshot,
+            'server_version': server_version,
+            'pre_data': PRE_DATA_FILE,
+            'post_data': POST_DATA_FILE,
+            'tables': tables,
+            'sequences': sequences,
+        }
+        files = {piece['file']: {'bytes': piece['bytes'], 'sha256': piece['sha256']}
+                 for table in tables for piece in table['pieces']}
+        for name in (PRE_DATA_FILE, POST_DATA_FILE):
+            path = os.path.join(target_dir, name)
+            files[name] = {'bytes': os.path.getsize(path), 'sha256': file_checksum(path)}
+        # The table of contents goes in last, it is what marks the export complete
+        toc_path = os.path.join(target_dir, COPY_TOC_FILE)
+        with open(toc_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(toc, f, indent=2)
+        os.replace(toc_path + '.tmp', toc_path)
+        files[COPY_TOC_FILE] = {'bytes': os.path.getsize(toc_path), 'sha256': file_checksum(toc_path)}
+        toc['files'] = dict(sorted(files.items()))
+        toc['stream_bytes'] = sum(piece['stream_bytes'] for table in tables for piece in table['pieces'])
+        return toc
+
+class CopyLoader(CopyJob):
+    # progress counts bytes of the export's files consumed. fast sets synchronous_commit off for
+    # the load and runs ANALYZE at the end, env is what psql runs with.
+    def __init__(self, db_host, db_port, db_user, db_password, db_name, psql_path, workers=2, fast=False, env=None,
+                 pool=None, progress=None, status=None):
+        CopyJob.__init__(self, db_host, db_port, db_user, db_password, db_name, workers, pool, progress, status)
+        self.psql_path = psql_path
+        self.fast = fast
+        self.env = env
+
+    def run_psql(self, path):
+        result = subprocess.run([
+            self.psql_path,
+            "-h", self.db_host,
+            "-p", self.db_port,
+            "-U", self.db_user,
+            "-d", self.db_name,
+            "-f", path
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, encoding='utf-8', errors='replace', env=self.env)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f"psql exited with code {result.returncode}")
+        # Errors psql skipped over, e.g. owners missing on this server, are reported and the load goes on
+        for line in result.stderr.splitlines()[-5:]:
+            self.status(line.strip())
+        self.report(os.path.getsize(path))
+
+    def load_piece(self, cursor, export_dir, table, piece, copy_format, compression):
+        path = os.path.join(export_dir, piece['file'])
+        with open(path, 'rb') as raw:
+            # The codec comes from the toc, CSV data may well start with bytes that look like a codec's magic
+            source = open_compressed_reader(raw, compression, path)
+            reader = CopyPieceReader(source, raw, self.report)
+            # One transaction per file, a failed one leaves nothing of itself behind
+            cursor.execute("BEGIN;")
+            if self.fast:
+                cursor.execute("SET LOCAL synchronous_commit TO off;")
+            cursor.copy_expert(copy_in_sql(table, copy_format), reader, size=STREAM_CHUNK_SIZE)
+            cursor.execute("COMMIT;")
+            self.report(os.path.getsize(path) - reader.position)
+
+    def set_sequences(self, sequences):
+        if not sequences:
+            return
+        with self.pool.connection(self.db_host, self.db_port, self.db_user, self.db_password, self.db_name) as conn:
+            with conn.cursor() as cursor:
+                for sequence in sequences:
+                    cursor.execute("SELECT pg_catalog.setval(%s, %s, %s);", (
+                        f"{quote_ident(sequence['schema'])}.{quote_ident(sequence['sequence'])}",
+                        sequence['last_value'], sequence['is_called']))
+
+    def run(self, export_dir):
+        with open(os.path.join(export_dir, COPY_TOC_FILE), encoding='utf-8') as f:
+            toc = json.load(f)
+        if toc.get('version', 0) > COPY_TOC_VERSION:
+            raise RuntimeError(f"{export_dir} was written by a newer version of this program")
+
+        self.status(f"Creating tables of {self.db_name}")
+        self.run_psql(os.path.join(export_dir, toc['pre_data']))
+
+        pieces = [(table, piece) for table in toc['tables'] for piece in table['pieces']]
+        self.status(f"Loading {len(toc['tables'])} tables into {self.db_name} in {len(pieces)} parts "
+                    f"with {min(self.workers, len(pieces)) or 1} connections")
+
+        def load(cursor, item):
+            self.load_piece(cursor, export_dir, item[0], item[1], toc['format'], toc['compression'])
+
+        self.run_workers(pieces, load)
+        self.set_sequences(toc.get('sequences', []))
+
+        self.status(f"Creating indexes and constraints of {self.db_name}")
+        self.run_psql(os.path.join(export_dir, toc['post_data']))
+        if self.fast:
+            self.status(f"Analyzing database: {self.db_name}")
+            with self.pool.connection(self.db_host, self.db_port, self.db_user, self.db_password,
+                                      self.db_name) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("ANALYZE;")
@@ -0,0 +1,245 @@
+import argparse
+import os
+import sys
+import signal
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+from task_schedulers import (
+    DAEMON_REQUESTS_DIR, DAEMON_STATE_FILE, DaemonScheduler, daemon_directory, next_run_time,
+    parse_daemon_time, read_json, task_slug, write_json
+)
+
+# Long-running alternative to Task Scheduler, cron and systemd timers: holds the tasks saved with
+# BACKUP_SCHEDULER=daemon, queues them when due and starts them from one pool, at most --workers at
+# a time and --per-host against one database server. Run it at login or as a service:
+#   python scheduler_daemon.py --workers 2 --per-host 1 --jitter 60 --stagger 30
+
+CATCH_UP_POLICIES = ('skip', 'once', 'all')
+# A run more than this late counts as missed, e.g. the machine was off or the daemon stopped
+MISSED_AFTER = timedelta(minutes=2)
+# Catch-up with 'all' stops after this many runs of one task
+MAX_CATCH_UP = 24
+
+class Job:
+    def __init__(self, name, host, due, not_before, command, env, catch_up=False):
+        self.name = name
+        self.host = host
+        self.due = due
+        self.not_before = not_before
+        self.command = command
+        self.env = env
+        self.catch_up = catch_up
+        self.process = None
+        self.started = None
+
+def log(message):
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {message}", flush=True)
+
+class SchedulerDaemon:
+    # One tick: pick up changed definitions and Run Now requests, queue what fell due since the
+    # last tick, reap finished jobs, start queued ones the limits allow. now and launch are
+    # callables so tests can run it against a fake clock without starting processes.
+    def __init__(self, directory=None, max_workers=2, per_host=1, jitter=0, stagger=0, catch_up='once',
+                 now=datetime.now, launch=None):
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy '{catch_up}'")
+        self.backend = DaemonScheduler(directory)
+        self.directory = self.backend.directory
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.jitter = jitter
+        self.stagger = stagger
+        self.catch_up = catch_up
+        self.now = now
+        self.launch = launch or self.start_process
+        self.tasks = {}
+        self.tasks_mtime = None
+        self.queue = []
+        self.running = []
+        self.last_start = None
+        self.stopping = False
+        os.makedirs(os.path.join(self.directory, 'logs'), exist_ok=True)
+        state = read_json(os.path.join(self.directory, DAEMON_STATE_FILE), {})
+        self.states = state.get('tasks', {})
+        for task_state in self.states.values():
+            # Whatever ran under a previous daemon is not ours to wait for
+            task_state['running'] = False
+
+    def reload_tasks(self):
+        try:
+            mtime = os.stat(self.backend.tasks_path()).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.tasks_mtime:
+            return
+        self.tasks_mtime = mtime
+        self.tasks = self.backend.load()
+        # Queued runs of deleted or disabled tasks are dropped
+        self.queue = [job for job in self.queue if self.tasks.get(job.name, (None, False))[1]]
+        for name in list(self.states):
+            if name not in self.tasks:
+                del self.states[name]
+        log(f"Loaded {len(self.tasks)} task(s)")
+
+    def enqueue(self, definition, due, catch_up=False, delay=True):
+        host = definition.host or 'localhost'
+        not_before = due
+        if delay and self.jitter:
+            not_before += timedelta(seconds=random.uniform(0, self.jitter))
+        self.queue.append(Job(definition.name, host, due, not_before, definition.command, definition.env, catch_up))
+        self.queue.sort(key=lambda job: (job.not_before, job.due))
+
+    def is_pending(self, name):
+        return any(job.name == name for job in self.queue) or any(job.name == name for job in self.running)
+
+    def plan(self, now):
+        for name, (definition, enabled) in self.tasks.items():
+            state = self.states.setdefault(name, {})
+            checked = parse_daemon_time(state.get('checked'))
+            state['checked'] = now.isoformat()
+            # A task seen for the first time starts from now, nothing before it is missed
+            if checked is None or not enabled:
+                continue
+            due, missed = [], []
+            run = next_run_time(definition, checked)
+            while run is not None and run <= now:
+                (missed if now - run > MISSED_AFTER else due).append(run)
+                run = next_run_time(definition, run)
+            if missed and self.catch_up != 'skip':
+                catch_up = missed[-MAX_CATCH_UP:] if self.catch_up == 'all' else missed[-1:]
+                log(f"{name}: missed {len(missed)} run(s), catching up {len(catch_up)}")
+                for run in catch_up:
+                    self.enqueue(definition, run, catch_up=True)
+            elif missed:
+                log(f"{name}: missed {len(missed)} run(s), skipped")
+            if due:
+                # A run still queued or going covers this one
+                if self.is_pending(name):
+                    log(f"{name}: due at {due[-1]:%H:%M}, still pending from before, skipped")
+                else:
+                    self.enqueue(definition, due[-1])
+
+    def take_requests(self, now):
+        requests = os.path.join(self.directory, DAEMON_REQUESTS_DIR)
+        if not os.path.isdir(requests):
+            return
+        for entry in os.listdir(requests):
+            path = os.path.join(requests, entry)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    name = f.read().strip()
+                os.remove(path)
+            except OSError:
+                continue
+            if name in self.tasks:
+                log(f"{name}: run requested")
+                self.enqueue(self.tasks[name][0], now, delay=False)
+
+    def start_process(self, job):
+        env = dict(os.environ)
+        env.update(job.env)
+        log_file = open(os.path.join(self.directory, 'logs', task_slug(job.name) + '.log'), 'a')
+        try:
+            return subprocess.Popen(job.command, env=env, stdin=subprocess.DEVNULL, stdout=log_file,
+                                    stderr=subprocess.STDOUT)
+        finally:
+            log_file.close()
+
+    def dispatch(self, now):
+        started = []
+        for job in self.queue:
+            if len(self.running) >= self.max_workers:
+                break
+            if job.not_before > now:
+                break
+            if self.stagger and self.last_start and (now - self.last_start).total_seconds() < self.stagger:
+                break
+            # One run of a task at a time, and the per-host limit; later jobs may still fit
+            if any(other.name == job.name for other in self.running):
+                continue
+            if sum(other.host == job.host for other in self.running) >= self.per_host:
+                continue
+            try:
+                job.process = self.launch(job)
+            except OSError as e:
+                log(f"{job.name}: failed to start: {e}")
+                self.finish(job, now, -1)
+                started.append(job)
+                continue
+            job.started = now
+            self.last_start = now
+            self.running.append(job)
+            started.append(job)
+            self.states.setdefault(job.name, {})['running'] = True
+            late = (now - job.due).total_seconds()
+            log(f"{job.name}: started on {job.host}" + (f", {late:.0f}s after due" if late >= 1 else ""))
+        self.queue = [job for job in self.queue if job not in started]
+
+    def finish(self, job, now, result):
+        state = self.states.setdefault(job.name, {})
+        state.update({'running': False, 'last_run': (job.started or now).isoformat(), 'last_result': result})
+
+    def reap(self, now):
+        for job in list(self.running):
+            result = job.process.poll()
+            if result is None:
+                continue
+            self.running.remove(job)
+            self.finish(job, now, result)
+            log(f"{job.name}: finished with exit code {result} after {(now - job.started).total_seconds():.0f}s")
+
+    def save_state(self, now):
+        write_json(os.path.join(self.directory, DAEMON_STATE_FILE),
+                   {'pid': os.getpid(), 'updated': now.isoformat(), 'tasks': self.states})
+
+    def tick(self):
+        now = self.now()
+        self.reap(now)
+        if not self.stopping:
+            self.reload_tasks()
+            self.plan(now)
+            self.take_requests(now)
+            self.dispatch(now)
+        self.save_state(now)
+
+    def stop(self, signum=None, frame=None):
+        if not self.stopping:
+            log("Stopping, waiting for running jobs")
+        self.stopping = True
+
+    def run_forever(self, interval=1.0):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        log(f"Scheduler started in {self.directory}: {self.max_workers} worker(s), {self.per_host} per host, "
+            f"catch-up {self.catch_up}")
+        while not (self.stopping and not self.running):
+            self.tick()
+            time.sleep(interval)
+        log("Scheduler stopped")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run scheduled backups with shared concurrency limits.")
+    parser.add_argument('--dir', default=daemon_directory(), help="task and state directory")
+    parser.add_argument('--workers', type=int, default=2, help="jobs running at once")
+    parser.add_argument('--per-host', type=int, default=1, help="jobs running at once against one database host")
+    parser.add_argument('--jitter', type=float, default=0, metavar='SECONDS',
+                        help="delay each scheduled start by up to this much, at random")
+    parser.add_argument('--stagger', type=float, default=0, metavar='SECONDS',
+                        help="minimum time between two starts")
+    parser.add_argument('--catch-up', choices=CATCH_UP_POLICIES, default='once',
+                        help="runs missed while the daemon was not running: skip them, run the latest once, "
+                             f"or run each (at most {MAX_CATCH_UP})")
+    parser.add_argument('--interval', type=float, default=1.0, help="seconds between ticks")
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.per_host < 1:
+        parser.error("--workers and --per-host must be at least 1")
+    daemon = SchedulerDaemon(args.dir, max_workers=args.workers, per_host=args.per_host, jitter=args.jitter,
+                             stagger=args.stagger, catch_up=args.catch_up)
+    daemon.run_forever(args.interval)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,784 @@
+import os
+import sys
+import json
+import shlex
+import shutil
+import hashlib
+import platform
+import subprocess
+import tempfile
+from datetime import datetime, date, time, timedelta
+
+from backup_engine import state_directory
+
+# Where scheduled backups live: Windows Task Scheduler, cron or systemd user timers behind one
+# interface, so the Schedule Management tab works the same everywhere. FakeScheduler keeps its
+# tasks in memory for tests. Pick one with default_scheduler_backend(), BACKUP_SCHEDULER overrides it.
+
+PRIORITIES = ('Low', 'Normal', 'High')
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+SCHEDULER_ENV = 'BACKUP_SCHEDULER'
+TASK_PREFIX = 'mo-backup-'
+# Marks the comment line that carries a task's definition in a crontab or unit file
+TASK_MARKER = '# mo-backup-task '
+# An unprivileged user can only lower its priority, so High runs like Normal under cron
+CRON_NICE = {'Low': 10, 'Normal': 0, 'High': 0}
+# systemd lets user services weigh CPU and IO against each other instead
+SYSTEMD_WEIGHTS = {'Low': 20, 'Normal': 100, 'High': 500}
+# Files shared by DaemonScheduler and the scheduler daemon in its directory: the definitions the
+# GUI writes, the state the daemon writes, and one file per Run Now request
+DAEMON_TASKS_FILE = 'tasks.json'
+DAEMON_STATE_FILE = 'state.json'
+DAEMON_REQUESTS_DIR = 'requests'
+# First argument that makes the frozen GUI executable run backup_cli instead of the window
+CLI_ARGUMENT = '--cli'
+
+class TaskDefinition:
+    # What to run and when, as entered on the Schedule Backup tab. command is an argument list,
+    # env is added to the environment it runs in, repetition repeats it every that many minutes
+    # for the rest of the day. host is the database server it works on, for per-host limits.
+    def __init__(self, name, command, interval='Daily', run_time='00:00', day=None, weekday=None,
+                 repetition=0, priority='Normal', description='', start_date=None, end_date=None,
+                 env=None, email_address=None, run_elevated=False, run_logged_off=False, host=None):
+        if interval not in ('Daily', 'Weekly', 'Monthly'):
+            raise ValueError(f"Unknown schedule interval '{interval}'")
+        if interval == 'Weekly' and weekday not in WEEKDAYS:
+            raise ValueError(f"A weekly task needs a weekday, got '{weekday}'")
+        if interval == 'Monthly' and not 1 <= (day or 0) <= 31:
+            raise ValueError(f"A monthly task needs a day of the month, got '{day}'")
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'")
+        self.name = name
+        self.command = list(command)
+        self.interval = interval
+        self.run_time = run_time
+        self.day = day
+        self.weekday = weekday
+        self.repetition = repetition
+        self.priority = priority
+        self.description = description
+        self.start_date = start_date
+        self.end_date = end_date
+        self.env = dict(env or {})
+        self.email_address = email_address
+        self.run_elevated = run_elevated
+        self.run_logged_off = run_logged_off
+        self.host = host
+
+    def hour_minute(self):
+        hour, minute = self.run_time.split(':')[:2]
+        return int(hour), int(minute)
+
+    def to_dict(self):
+        values = dict(vars(self))
+        for key in ('start_date', 'end_date'):
+            if values[key] is not None:
+                values[key] = values[key].isoformat()
+        return values
+
+    @classmethod
+    def from_dict(cls, values):
+        values = dict(values)
+        for key in ('start_date', 'end_date'):
+            if values.get(key):
+                values[key] = date.fromisoformat(values[key])
+        return cls(**values)
+
+class TaskInfo:
+    # A scheduled task as the Schedule Management tab shows it. last_result is the exit code of
+    # the last run, None while it never ran.
+    def __init__(self, name, enabled=True, running=False, last_run=None, next_run=None, last_result=None,
+                 run_time=None, priority='Normal', description='', email_enabled=False):
+        self.name = name
+        self.enabled = enabled
+        self.running = running
+        self.last_run = last_run
+        self.next_run = next_run
+        self.last_result = last_result
+        self.run_time = run_time
+        self.priority = priority
+        self.description = description
+        self.email_enabled = email_enabled
+
+def task_statistics(tasks):
+    # Totals for the statistics labels
+    stats = {'total': 0, 'active': 0, 'completed': 0, 'failed': 0}
+    for task in tasks:
+        stats['total'] += 1
+        if task.running:
+            stats['active'] += 1
+        elif task.last_result == 0:
+            stats['completed'] += 1
+        elif task.last_result is not None and task.last_run:
+            stats['failed'] += 1
+    return stats
+
+def runs_on(definition, day):
+    if definition.interval == 'Weekly':
+        return day.weekday() == WEEKDAYS.index(definition.weekday)
+    if definition.interval == 'Monthly':
+        return day.day == definition.day
+    return True
+
+def next_run_time(definition, now):
+    # First run after now, None once the end date has passed. Monthly tasks on the 31st skip the
+    # shorter months, like Task Scheduler does.
+    hour, minute = definition.hour_minute()
+    day = now.date()
+    if definition.start_date and definition.start_date > day:
+        day = definition.start_date
+    for _ in range(366 * 4):
+        if definition.end_date and day > definition.end_date:
+            return None
+        if runs_on(definition, day):
+            run = datetime.combine(day, time(hour, minute))
+            while run.date() == day:
+                if run > now:
+                    return run
+                if not definition.repetition:
+                    break
+                run += timedelta(minutes=definition.repetition)
+        day += timedelta(days=1)
+    return None
+
+def task_slug(name):
+    # File and unit names for a task; names that had to be changed get a hash so they stay apart
+    slug = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+    if slug != name:
+        slug += '-' + hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+    return TASK_PREFIX + slug
+
+def parse_task_marker(line):
+    return TaskDefinition.from_dict(json.loads(line[len(TASK_MARKER):]))
+
+def task_marker(definition, **extra):
+    values = definition.to_dict()
+    values.update(extra)
+    return TASK_MARKER + json.dumps(values, sort_keys=True)
+
+class SchedulerBackend:
+    # The operations the GUI needs. Lookups of a task that does not exist raise LookupError,
+    # creating one that does raises ValueError, failures of the scheduler itself surface as
+    # RuntimeError or subprocess.CalledProcessError.
+    name = None
+
+    def list_tasks(self):
+        raise NotImplementedError
+
+    def task_exists(self, name):
+        return any(task.name == name for task in self.list_tasks())
+
+    def get_task(self, name):
+        for task in self.list_tasks():
+            if task.name == name:
+                return task
+        raise LookupError(f"No scheduled task named '{name}'")
+
+    def create_task(self, definition):
+        raise NotImplementedError
+
+    def update_task(self, name, run_time=None, priority=None, email_address=None):
+        # email_address '' turns the notification off, None leaves it as it is
+        raise NotImplementedError
+
+    def run_task(self, name):
+        raise NotImplementedError
+
+    def set_enabled(self, name, enabled):
+        raise NotImplementedError
+
+    def delete_task(self, name):
+        raise NotImplementedError
+
+def apply_update(definition, run_time=None, priority=None, email_address=None):
+    if run_time is not None:
+        definition.run_time = run_time
+    if priority is not None:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'")
+        definition.priority = priority
+    if email_address is not None:
+        definition.email_address = email_address or None
+
+class FakeScheduler(SchedulerBackend):
+    # Everything in memory, runs are only recorded. now is a callable so tests can move the clock.
+    name = 'In-memory scheduler'
+
+    def __init__(self, now=datetime.now):
+        self.now = now
+        self.tasks = {}
+        self.runs = []
+
+    def lookup(self, name):
+        try:
+            return self.tasks[name]
+        except KeyError:
+            raise LookupError(f"No scheduled task named '{name}'")
+
+    def list_tasks(self):
+        now = self.now()
+        tasks = []
+        for name in sorted(self.tasks):
+            definition, state = self.tasks[name]
+            tasks.append(TaskInfo(name, enabled=state['enabled'], last_run=state['last_run'],
+                                  next_run=next_run_time(definition, now) if state['enabled'] else None,
+                                  last_result=state['last_result'], run_time=definition.run_time,
+                                  priority=definition.priority, description=definition.description,
+                                  email_enabled=bool(definition.email_address)))
+        return tasks
+
+    def task_exists(self, name):
+        return name in self.tasks
+
+    def create_task(self, definition):
+        if definition.name in self.tasks:
+            raise ValueError(f"A task named '{definition.name}' already exists")
+        self.tasks[definition.name] = (definition, {'enabled': True, 'last_run': None, 'last_result': None})
+
+    def update_task(self, name, run_time=None, priority=None, email_address=None):
+        apply_update(self.lookup(name)[0], run_time, priority, email_address)
+
+    def run_task(self, name, result=0):
+        definition, state = self.lookup(name)
+        state['last_run'] = self.now()
+        state['last_result'] = result
+        self.runs.append((name, state['last_run']))
+
+    def set_enabled(self, name, enabled):
+        self.lookup(name)[1]['enabled'] = enabled
+
+    def delete_task(self, name):
+        self.lookup(name)
+        del self.tasks[name]
+
+def shell_command(definition, log_path=None, state_path=None, guard=True, env_path=None):
+    # The task as one sh command line: date range guard, environment, priority, and when a state
+    # path is given the exit code and time of the run written next to it. The environment holds
+    # the database password; the command line is visible to every user in ps, so it is sourced
+    # from env_path, a file only the owner can read, see write_env_file.
+    command = ' '.join(shlex.quote(arg) for arg in definition.command)
+    nice = CRON_NICE[definition.priority]
+    if nice:
+        command = f"nice -n {nice} {command}"
+    if definition.env:
+        if not env_path:
+            raise ValueError("A task with environment variables needs a file to keep them in")
+        command = f". {shlex.quote(env_path)} && {command}"
+    if log_path:
+        command += f" >> {shlex.quote(log_path)} 2>&1"
+    if state_path:
+        running = shlex.quote(state_path + '.running')
+        command = (f"touch {running}; {command}; rc=$?; "
+                   f"echo \"$(date +%s) $rc\" > {shlex.quote(state_path + '.last')}; rm -f {running}")
+    checks = []
+    if guard and definition.start_date:
+        checks.append(f"[ \"$(date +%Y%m%d)\" -ge {definition.start_date:%Y%m%d} ]")
+    if guard and definition.end_date:
+        checks.append(f"[ \"$(date +%Y%m%d)\" -le {definition.end_date:%Y%m%d} ]")
+    if checks:
+        command = f"{' && '.join(checks)} && {{ {command}; }}"
+    return command
+
+def write_env_file(path, env):
+    # sh syntax, readable by the owner only; replaced in one step so a run never reads half of it
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+            for key, value in sorted(env.items()):
+                f.write(f"export {key}={shlex.quote(value)}\n")
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def read_env_file(path):
+    env = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('export '):
+                    key, _, value = line[len('export '):].rstrip('\n').partition('=')
+                    env[key] = ''.join(shlex.split(value))
+    except OSError:
+        pass
+    return env
+
+class CronScheduler(SchedulerBackend):
+    # Tasks are lines in the user's crontab, each after a marker comment with its definition.
+    # Disabled tasks stay in the crontab commented out, other lines are left alone. The
+    # environment of a task is not in the crontab but in a private .env file in state_directory().
+    name = 'cron'
+
+    def __init__(self, crontab='crontab'):
+        self.crontab = crontab
+
+    def read_crontab(self):
+        result = subprocess.run([self.crontab, '-l'], capture_output=True, text=True)
+        if result.returncode != 0:
+            # A user without a crontab yet
+            if 'no crontab' in result.stderr.lower():
+                return []
+            raise RuntimeError(f"crontab -l failed: {result.stderr.strip()}")
+        return result.stdout.splitlines()
+
+    def write_crontab(self, lines):
+        subprocess.run([self.crontab, '-'], input='\n'.join(lines) + '\n', text=True,
+                       capture_output=True, check=True)
+
+    def load(self):
+        # -> (other crontab lines, {name: (definition, enabled)}) in crontab order
+        lines = self.read_crontab()
+        other, tasks = [], {}
+        index = 0
+        while index < len(lines):
+            line = lines[index]
+            if line.startswith(TASK_MARKER):
+                values = json.loads(line[len(TASK_MARKER):])
+                enabled = values.pop('enabled', True)
+                definition = TaskDefinition.from_dict(values)
+                definition.env = read_env_file(self.env_path(definition.name))
+                tasks[definition.name] = (definition, enabled)
+                index += 2  # the job line is generated again on save
+                continue
+            other.append(line)
+            index += 1
+        return other, tasks
+
+    def save(self, other, tasks):
+        lines = list(other)
+        for definition, enabled in tasks.values():
+            self.save_env(definition)
+            lines.append(task_marker(definition, enabled=enabled, env={}))
+            job = self.cron_line(definition)
+            lines.append(job if enabled else '#' + job)
+        self.write_crontab(lines)
+
+    def state_path(self, name):
+        return os.path.join(state_directory(), task_slug(name))
+
+    def env_path(self, name):
+        return self.state_path(name) + '.env'
+
+    def save_env(self, definition):
+        if definition.env:
+            os.makedirs(state_directory(), exist_ok=True)
+            write_env_file(self.env_path(definition.name), definition.env)
+        else:
+            try:
+                os.remove(self.env_path(definition.name))
+            except FileNotFoundError:
+                pass
+
+    def cron_line(self, definition):
+        hour, minute = definition.hour_minute()
+        day_of_month = str(definition.day) if definition.interval == 'Monthly' else '*'
+        # cron counts the week from Sunday
+        day_of_week = str((WEEKDAYS.index(definition.weekday) + 1) % 7) if definition.interval == 'Weekly' else '*'
+        minutes, hours = str(minute), str(hour)
+        repetition = definition.repetition
+        if repetition:
+            # cron repeats on a grid from the top of the hour, so the first hour starts on the grid
+            if repetition < 60 and 60 % repetition == 0:
+                minutes, hours = f"{minute % repetition}-59/{repetition}", f"{hour}-23"
+            elif repetition % 60 == 0:
+                hours = f"{hour}-23/{repetition // 60}"
+            else:
+                raise ValueError(f"cron cannot repeat every {repetition} minutes, "
+                                 "use a divisor of 60 or whole hours")
+        state = self.state_path(definition.name)
+        command = shell_command(definition, state + '.log', state, env_path=self.env_path(definition.name))
+        # % ends the command in a crontab unless escaped
+        return f"{minutes} {hours} {day_of_month} * {day_of_week} {command.replace('%', chr(92) + '%')}"
+
+    def read_state(self, name):
+        state = self.state_path(name)
+        last_run = last_result = None
+        try:
+            with open(state + '.last') as f:
+                stamp, code = f.read().split()
+            last_run, last_result = datetime.fromtimestamp(int(stamp)), int(code)
+        except (OSError, ValueError):
+            pass
+        return last_run, last_result, os.path.exists(state + '.running')
+
+    def list_tasks(self):
+        now = datetime.now()
+        tasks = []
+        for name, (definition, enabled) in self.load()[1].items():
+            last_run, last_result, running = self.read_state(name)
+            tasks.append(TaskInfo(name, enabled=enabled, running=running, last_run=last_run,
+                                  next_run=next_run_time(definition, now) if enabled else None,
+                                  last_result=last_result, run_time=definition.run_time,
+                                  priority=definition.priority, description=definition.description,
+                                  email_enabled=bool(definition.email_address)))
+        return tasks
+
+    def lookup(self, name):
+        other, tasks = self.load()
+        if name not in tasks:
+            raise LookupError(f"No scheduled task named '{name}'")
+        return other, tasks
+
+    def create_task(self, definition):
+        other, tasks = self.load()
+        if definition.name in tasks:
+            raise ValueError(f"A task named '{definition.name}' already exists")
+        os.makedirs(state_directory(), exist_ok=True)
+        tasks[definition.name] = (definition, True)
+        self.save(other, tasks)
+
+    def update_task(self, name, run_time=None, priority=None, email_address=None):
+        other, tasks = self.lookup(name)
+        apply_update(tasks[name][0], run_time, priority, email_address)
+        self.save(other, tasks)
+
+    def run_task(self, name):
+        definition = self.lookup(name)[1][name][0]
+        state = self.state_path(name)
+        os.makedirs(state_directory(), exist_ok=True)
+        # Detached, like cron would start it, without the date range guard
+        subprocess.Popen(['/bin/sh', '-c', shell_command(definition, state + '.log', state, guard=False,
+                                                         env_path=self.env_path(name))],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+
+    def set_enabled(self, name, enabled):
+        other, tasks = self.lookup(name)
+        tasks[name] = (tasks[name][0], enabled)
+        self.save(other, tasks)
+
+    def delete_task(self, name):
+        other, tasks = self.lookup(name)
+        del tasks[name]
+        self.save(other, tasks)
+        for suffix in ('.last', '.running', '.log', '.env'):
+            try:
+                os.remove(self.state_path(name) + suffix)
+            except FileNotFoundError:
+                pass
+
+def parse_systemd_time(value):
+    # systemctl show prints times as 'Thu 2024-05-02 02:00:03 CEST', older versions in microseconds
+    if not value or value in ('n/a', '0'):
+        return None
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value) / 1000000)
+    parts = value.split()
+    try:
+        return datetime.strptime(' '.join(parts[1:3]), "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+class SystemdTimerScheduler(SchedulerBackend):
+    # Each task is a oneshot service and a timer in the user's systemd instance. The definition
+    # rides along as a comment in the service file. Timers only fire while the user has a session
+    # unless lingering is on (loginctl enable-linger).
+    name = 'systemd timers'
+
+    def __init__(self, unit_dir=None, systemctl='systemctl'):
+        config = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+        self.unit_dir = unit_dir or os.path.join(config, 'systemd', 'user')
+        self.systemctl = systemctl
+
+    def systemctl_user(self, *args):
+        return subprocess.run([self.systemctl, '--user'] + list(args), capture_output=True, text=True, check=True)
+
+    def unit_path(self, name, suffix):
+        return os.path.join(self.unit_dir, task_slug(name) + suffix)
+
+    def definitions(self):
+        definitions = {}
+        if not os.path.isdir(self.unit_dir):
+            return definitions
+        for entry in sorted(os.listdir(self.unit_dir)):
+            if not (entry.startswith(TASK_PREFIX) and entry.endswith('.service')):
+                continue
+            with open(os.path.join(self.unit_dir, entry), encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith(TASK_MARKER):
+                        definition = parse_task_marker(line)
+                        definitions[definition.name] = definition
+                        break
+        return definitions
+
+    def lookup(self, name):
+        definitions = self.definitions()
+        if name not in definitions:
+            raise LookupError(f"No scheduled task named '{name}'")
+        return definitions[name]
+
+    def on_calendar(self, definition):
+        hour, minute = definition.hour_minute()
+        days = '*-*-*'
+        if definition.interval == 'Weekly':
+            days = f"{definition.weekday[:3]} *-*-*"
+        elif definition.interval == 'Monthly':
+            days = f"*-*-{definition.day:02d}"
+        hours, minutes = f"{hour:02d}", f"{minute:02d}"
+        repetition = definition.repetition
+        if repetition:
+            # Same grid as cron: repeats restart at the top of each hour
+            if repetition < 60 and 60 % repetition == 0:
+                hours, minutes = f"{hour:02d}..23", f"{minute % repetition:02d}/{repetition}"
+            elif repetition % 60 == 0:
+                hours = f"{hour:02d}/{repetition // 60}"
+            else:
+                raise ValueError(f"systemd timers cannot repeat every {repetition} minutes here, "
+                                 "use a divisor of 60 or whole hours")
+        return f"{days} {hours}:{minutes}:00"
+
+    def write_units(self, definition):
+        os.makedirs(self.unit_dir, exist_ok=True)
+        escape = lambda text: text.replace('%', '%%')
+        # Exec lines also expand $VARIABLES, the shell gets to see a plain $
+        escape_exec = lambda text: escape(text).replace('$', '$$')
+        service = [
+            task_marker(definition),
+            "[Unit]",
+            f"Description={escape(definition.description.splitlines()[0] if definition.description else definition.name)}",
+            "",
+            "[Service]",
+            "Type=oneshot",
+            f"CPUWeight={SYSTEMD_WEIGHTS[definition.priority]}",
+            f"IOWeight={SYSTEMD_WEIGHTS[definition.priority]}",
+        ]
+        for key, value in sorted(definition.env.items()):
+            service.append(f'Environment="{key}={escape(value)}"')
+        checks = []
+        if definition.start_date:
+            checks.append(f"[ \"$(date +%Y%m%d)\" -ge {definition.start_date:%Y%m%d} ]")
+        if definition.end_date:
+            checks.append(f"[ \"$(date +%Y%m%d)\" -le {definition.end_date:%Y%m%d} ]")
+        if checks:
+            service.append(f"ExecCondition=/bin/sh -c {escape_exec(shlex.quote(' && '.join(checks)))}")
+        service.append(f"ExecStart={escape_exec(' '.join(shlex.quote(arg) for arg in definition.command))}")
+        timer = [
+            "[Unit]",
+            f"Description=Schedule for {escape(definition.name)}",
+            "",
+            "[Timer]",
+            f"OnCalendar={self.on_calendar(definition)}",
+            "Persistent=true",
+            "",
+            "[Install]",
+            "WantedBy=timers.target",
+        ]
+        service_path = self.unit_path(definition.name, '.service')
+        # The environment holds the database password
+        descriptor = os.open(service_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(service) + '\n')
+        with open(self.unit_path(definition.name, '.timer'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(timer) + '\n')
+
+    def list_tasks(self):
+        definitions = self.definitions()
+        if not definitions:
+            return []
+        units = []
+        for name in definitions:
+            units += [task_slug(name) + '.timer', task_slug(name) + '.service']
+        # One systemctl call for every unit, blocks separated by blank lines in the order asked
+        output = self.systemctl_user('show', '-p', 'Id,UnitFileState,ActiveState,LastTriggerUSec,'
+                                     'NextElapseUSecRealtime,ExecMainStatus', *units).stdout
+        properties = {}
+        for block in output.strip().split('\n\n'):
+            values = dict(line.split('=', 1) for line in block.splitlines() if '=' in line)
+            properties[values.get('Id')] = values
+        tasks = []
+        for name, definition in definitions.items():
+            timer = properties.get(task_slug(name) + '.timer', {})
+            service = properties.get(task_slug(name) + '.service', {})
+            last_run = parse_systemd_time(timer.get('LastTriggerUSec'))
+            status = service.get('ExecMainStatus', '')
+            tasks.append(TaskInfo(name, enabled=timer.get('UnitFileState') == 'enabled',
+                                  running=service.get('ActiveState') in ('active', 'activating'),
+                                  last_run=last_run,
+                                  next_run=parse_systemd_time(timer.get('NextElapseUSecRealtime')),
+                                  last_result=int(status) if last_run and status.isdigit() else None,
+                                  run_time=definition.run_time, priority=definition.priority,
+                                  description=definition.description,
+                                  email_enabled=bool(definition.email_address)))
+        return tasks
+
+    def task_exists(self, name):
+        return os.path.exists(self.unit_path(name, '.service'))
+
+    def create_task(self, definition):
+        if self.task_exists(definition.name):
+            raise ValueError(f"A task named '{definition.name}' already exists")
+        self.write_units(definition)
+        self.systemctl_user('daemon-reload')
+        self.systemctl_user('enable', '--now', task_slug(definition.name) + '.timer')
+
+    def update_task(self, name, run_time=None, priority=None, email_address=None):
+        definition = self.lookup(name)
+        apply_update(definition, run_time, priority, email_address)
+        self.write_units(definition)
+        self.systemctl_user('daemon-reload')
+        # A stopped timer stays stopped, an active one picks up the new schedule
+        self.systemctl_user('try-restart', task_slug(name) + '.timer')
+
+    def run_task(self, name):
+        self.lookup(name)
+        self.systemctl_user('start', '--no-block', task_slug(name) + '.service')
+
+    def set_enabled(self, name, enabled):
+        self.lookup(name)
+        self.systemctl_user('enable' if enabled else 'disable', '--now', task_slug(name) + '.timer')
+
+    def delete_task(self, name):
+        self.lookup(name)
+        self.systemctl_user('disable', '--now', task_slug(name) + '.timer')
+        for suffix in ('.timer', '.service'):
+            os.remove(self.unit_path(name, suffix))
+        self.systemctl_user('daemon-reload')
+
+def write_json(path, data, private=False):
+    # Replaced in one step, a reader never sees half a file. private keeps it to the owner,
+    # task definitions carry database passwords.
+    directory = os.path.dirname(path)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        if not private:
+            os.chmod(temp_path, 0o644)
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def read_json(path, default):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+def daemon_directory():
+    return os.path.join(state_directory(), 'daemon')
+
+def parse_daemon_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+class DaemonScheduler(SchedulerBackend):
+    # Tasks for scheduler_daemon.py, which queues them and runs them under its concurrency limits.
+    # Only files are shared, the daemon picks up changes on its next tick.
+    name = 'scheduler daemon'
+
+    def __init__(self, directory=None):
+        self.directory = directory or daemon_directory()
+
+    def tasks_path(self):
+        return os.path.join(self.directory, DAEMON_TASKS_FILE)
+
+    def load(self):
+        # -> {name: (definition, enabled)}
+        tasks = {}
+        for values in read_json(self.tasks_path(), []):
+            values = dict(values)
+            enabled = values.pop('enabled', True)
+            definition = TaskDefinition.from_dict(values)
+            tasks[definition.name] = (definition, enabled)
+        return tasks
+
+    def save(self, tasks):
+        os.makedirs(self.directory, exist_ok=True)
+        data = []
+        for definition, enabled in tasks.values():
+            values = definition.to_dict()
+            values['enabled'] = enabled
+            data.append(values)
+        write_json(self.tasks_path(), data, private=True)
+
+    def lookup(self, name):
+        tasks = self.load()
+        if name not in tasks:
+            raise LookupError(f"No scheduled task named '{name}'")
+        return tasks
+
+    def list_tasks(self):
+        now = datetime.now()
+        states = read_json(os.path.join(self.directory, DAEMON_STATE_FILE), {}).get('tasks', {})
+        tasks = []
+        for name, (definition, enabled) in self.load().items():
+            state = states.get(name, {})
+            tasks.append(TaskInfo(name, enabled=enabled, running=state.get('running', False),
+                                  last_run=parse_daemon_time(state.get('last_run')),
+                                  next_run=next_run_time(definition, now) if enabled else None,
+                                  last_result=state.get('last_result'), run_time=definition.run_time,
+                                  priority=definition.priority, description=definition.description,
+                                  email_enabled=bool(definition.email_address)))
+        return tasks
+
+    def task_exists(self, name):
+        return name in self.load()
+
+    def create_task(self, definition):
+        tasks = self.load()
+        if definition.name in tasks:
+            raise ValueError(f"A task named '{definition.name}' already exists")
+        tasks[definition.name] = (definition, True)
+        self.save(tasks)
+
+    def update_task(self, name, run_time=None, priority=None, email_address=None):
+        tasks = self.lookup(name)
+        apply_update(tasks[name][0], run_time, priority, email_address)
+        self.save(tasks)
+
+    def run_task(self, name):
+        self.lookup(name)
+        requests = os.path.join(self.directory, DAEMON_REQUESTS_DIR)
+        os.makedirs(requests, exist_ok=True)
+        with open(os.path.join(requests, task_slug(name)), 'w', encoding='utf-8') as f:
+            f.write(name)
+
+    def set_enabled(self, name, enabled):
+        tasks = self.lookup(name)
+        tasks[name] = (tasks[name][0], enabled)
+        self.save(tasks)
+
+    def delete_task(self, name):
+        tasks = self.lookup(name)
+        del tasks[name]
+        self.save(tasks)
+
+def windows_scheduler():
+    # Imported on first use, the COM bindings only exist on Windows
+    from windows_task_scheduler import WindowsTaskScheduler
+    return WindowsTaskScheduler()
+
+def systemd_user_available():
+    # Booted with systemd and a user manager to talk to, not just systemctl on the PATH
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    return bool(shutil.which('systemctl') and os.path.isdir('/run/systemd/system') and runtime_dir
+                and os.path.exists(os.path.join(runtime_dir, 'systemd', 'private')))
+
+SCHEDULER_BACKENDS = {
+    'windows': windows_scheduler,
+    'systemd': SystemdTimerScheduler,
+    'cron': CronScheduler,
+    'daemon': DaemonScheduler,
+    'fake': FakeScheduler,
+}
+
+def default_scheduler_backend(name=None):
+    name = name or os.environ.get(SCHEDULER_ENV)
+    if name:
+        if name not in SCHEDULER_BACKENDS:
+            raise ValueError(f"Unknown scheduler '{name}', expected one of {', '.join(SCHEDULER_BACKENDS)}")
+        return SCHEDULER_BACKENDS[name]()
+    if platform.system() == 'Windows':
+        return windows_scheduler()
+    if systemd_user_available():
+        return SystemdTimerScheduler()
+    return CronScheduler()
+
+def backup_cli_command(*args):
+    # A backup_cli.py invocation with this interpreter. The frozen build has no backup_cli.py next
+    # to it, the bundled executable runs the CLI itself when its first argument is CLI_ARGUMENT.
+    if getattr(sys, 'frozen', False):
+        return [sys.executable, CLI_ARGUMENT] + list(args)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup_cli.py')
+    return [sys.executable, script] + list(args)
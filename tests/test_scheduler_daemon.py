@@ -0,0 +1,145 @@
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from scheduler_daemon import MAX_CATCH_UP, SchedulerDaemon
+from task_schedulers import DaemonScheduler
+from test_schedulers import Clock, task
+
+# SchedulerDaemon.tick() against a fake clock, with a launch that only records the jobs it was
+# asked to start.
+
+class FakeProcess:
+    def __init__(self):
+        self.result = None
+
+    def poll(self):
+        return self.result
+
+class SchedulerDaemonTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.backend = DaemonScheduler(self.directory)
+        self.clock = Clock()
+        self.started = []
+
+    def launch(self, job):
+        self.started.append(job)
+        job.process = FakeProcess()
+        return job.process
+
+    def daemon(self, *definitions, **options):
+        for definition in definitions:
+            self.backend.create_task(definition)
+        daemon = SchedulerDaemon(self.directory, now=self.clock, launch=self.launch, **options)
+        # The first tick only records when the tasks were first seen
+        daemon.tick()
+        self.assertEqual(self.started, [])
+        return daemon
+
+    def started_names(self):
+        return [job.name for job in self.started]
+
+    def finish(self, name, result=0):
+        job = next(job for job in self.started if job.name == name and job.process.result is None)
+        job.process.result = result
+
+    def test_per_host_limit(self):
+        daemon = self.daemon(task('a1', host='db1'), task('a2', host='db1'), task('b1', host='db2'),
+                             task('b2', host='db2'), max_workers=3, per_host=1)
+        self.clock.advance(hours=1)
+        daemon.tick()
+        self.assertEqual(self.started_names(), ['a1', 'b1'])
+        self.clock.advance(seconds=5)
+        daemon.tick()
+        self.assertEqual(len(self.started), 2)
+        self.finish('a1')
+        self.clock.advance(seconds=5)
+        daemon.tick()
+        self.assertEqual(self.started_names(), ['a1', 'b1', 'a2'])
+        self.assertEqual(daemon.states['a1']['last_result'], 0)
+
+    def test_worker_limit(self):
+        daemon = self.daemon(*(task(f"t{i}", host=f"db{i}") for i in range(5)), max_workers=2, per_host=1)
+        self.clock.advance(hours=1)
+        daemon.tick()
+        self.assertEqual(len(self.started), 2)
+        self.assertEqual(len(daemon.queue), 3)
+
+    def test_stagger(self):
+        daemon = self.daemon(*(task(f"t{i}", host=f"db{i}") for i in range(3)), max_workers=3, per_host=1,
+                             stagger=30)
+        self.clock.advance(hours=1)
+        daemon.tick()
+        self.assertEqual(len(self.started), 1)
+        self.clock.advance(seconds=20)
+        daemon.tick()
+        self.assertEqual(len(self.started), 1)
+        self.clock.advance(seconds=10)
+        daemon.tick()
+        self.assertEqual(len(self.started), 2)
+        self.clock.advance(seconds=30)
+        daemon.tick()
+        self.assertEqual([job.started - self.started[0].started for job in self.started],
+                         [timedelta(0), timedelta(seconds=30), timedelta(seconds=60)])
+
+    def missed_three_days(self, catch_up):
+        # Seen at 01:00, then the machine was off until three days later: the 02:00 runs of
+        # three days were missed
+        daemon = self.daemon(task('nightly'), catch_up=catch_up)
+        self.clock.advance(days=3)
+        daemon.tick()
+        return daemon
+
+    def test_catch_up_skip(self):
+        daemon = self.missed_three_days('skip')
+        self.assertEqual(self.started, [])
+        self.assertEqual(daemon.queue, [])
+        self.clock.advance(hours=1)
+        daemon.tick()
+        self.assertEqual([job.due for job in self.started], [datetime(2026, 3, 5, 2, 0)])
+        self.assertFalse(self.started[0].catch_up)
+
+    def test_catch_up_once(self):
+        daemon = self.missed_three_days('once')
+        self.assertEqual([job.due for job in self.started], [datetime(2026, 3, 4, 2, 0)])
+        self.assertTrue(self.started[0].catch_up)
+        self.assertEqual(daemon.queue, [])
+
+    def test_catch_up_all(self):
+        daemon = self.missed_three_days('all')
+        # One run of a task at a time, the others wait their turn
+        self.assertEqual(len(self.started), 1)
+        for _ in range(2):
+            self.finish('nightly')
+            self.clock.advance(seconds=1)
+            daemon.tick()
+        self.assertEqual([job.due for job in self.started],
+                         [datetime(2026, 3, day, 2, 0) for day in (2, 3, 4)])
+        self.assertTrue(all(job.catch_up for job in self.started))
+
+    def test_catch_up_all_is_capped(self):
+        daemon = self.daemon(task('hourly', run_time='00:00', repetition=60), catch_up='all')
+        self.clock.advance(days=3)
+        daemon.tick()
+        self.assertEqual(len(self.started) + len(daemon.queue), MAX_CATCH_UP)
+
+    def test_run_now_and_disabled_tasks(self):
+        daemon = self.daemon(task('nightly'), task('off', host='db2'))
+        self.backend.set_enabled('off', False)
+        self.backend.run_task('nightly')
+        self.clock.advance(seconds=1)
+        daemon.tick()
+        self.assertEqual(self.started_names(), ['nightly'])
+        self.finish('nightly')
+        self.clock.advance(hours=1)
+        daemon.tick()
+        self.assertEqual(self.started_names(), ['nightly', 'nightly'])
+        info = {info.name: info for info in self.backend.list_tasks()}
+        self.assertTrue(info['nightly'].running)
+        self.assertIsNone(info['off'].next_run)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from datetime import datetime, timedelta
+
+from task_schedulers import FakeScheduler, TaskDefinition
+
+# The in-memory backend against a fake clock, Clock and task are shared with the daemon tests.
+
+START = datetime(2026, 3, 2, 1, 0)
+
+class Clock:
+    def __init__(self, value=START):
+        self.value = value
+
+    def __call__(self):
+        return self.value
+
+    def advance(self, **delta):
+        self.value += timedelta(**delta)
+
+def task(name, run_time='02:00', host='db1', **options):
+    return TaskDefinition(name, ['backup', name], run_time=run_time, host=host, **options)
+
+class FakeSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.scheduler = FakeScheduler(now=self.clock)
+
+    def test_many_tasks(self):
+        for i in range(500):
+            self.scheduler.create_task(task(f"task {i:03}", run_time=f"{i % 24:02}:{i % 60:02}"))
+        tasks = self.scheduler.list_tasks()
+        self.assertEqual(len(tasks), 500)
+        self.assertEqual([info.name for info in tasks], sorted(info.name for info in tasks))
+        self.assertTrue(all(START < info.next_run <= START + timedelta(days=1) for info in tasks))
+        self.assertEqual(tasks[3].next_run, datetime(2026, 3, 2, 3, 3))
+        self.assertEqual(tasks[0].next_run, datetime(2026, 3, 3, 0, 0))
+
+    def test_lifecycle(self):
+        self.scheduler.create_task(task('nightly'))
+        with self.assertRaises(ValueError):
+            self.scheduler.create_task(task('nightly'))
+        self.scheduler.update_task('nightly', run_time='03:30', priority='Low')
+        self.assertEqual(self.scheduler.get_task('nightly').next_run, datetime(2026, 3, 2, 3, 30))
+        self.scheduler.run_task('nightly', result=1)
+        info = self.scheduler.get_task('nightly')
+        self.assertEqual((info.last_run, info.last_result, info.priority), (START, 1, 'Low'))
+        self.scheduler.set_enabled('nightly', False)
+        self.assertIsNone(self.scheduler.get_task('nightly').next_run)
+        self.scheduler.delete_task('nightly')
+        with self.assertRaises(LookupError):
+            self.scheduler.get_task('nightly')
+
+if __name__ == '__main__':
+    unittest.main()
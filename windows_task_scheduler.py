@@ -0,0 +1,166 @@
+import os
+import platform
+import subprocess
+from datetime import datetime
+
+from backup_engine import state_directory
+from task_schedulers import SchedulerBackend, TaskInfo, task_slug, write_env_file
+
+# Windows Task Scheduler over COM and schtasks. task_schedulers imports this on first use, anywhere
+# but on Windows the import fails with ImportError instead of dragging in pywin32.
+if platform.system() != 'Windows':
+    raise ImportError("The Windows Task Scheduler is only available on Windows.")
+
+import pythoncom
+import win32com.client
+
+TASK_STATE_DISABLED = 1
+TASK_STATE_RUNNING = 4
+TASK_UPDATE = 6
+TASK_LOGON_INTERACTIVE_TOKEN_OR_PASSWORD = 3
+PRIORITY_LEVELS = {'Low': 0, 'Normal': 4, 'High': 7}
+# Task Scheduler's own values for a task that never ran
+TASK_NOT_RUN_RESULTS = (0x41303, 0x41306)
+START_BOUNDARY_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+def connect():
+    # COM has to be set up on every thread that uses it, the task list loads on its own thread
+    pythoncom.CoInitialize()
+    scheduler = win32com.client.Dispatch('Schedule.Service')
+    scheduler.Connect()
+    return scheduler
+
+def com_time(value):
+    # Unset times come back as 1899-12-30
+    if not value or value.year < 1900:
+        return None
+    return datetime(value.year, value.month, value.day, value.hour, value.minute, value.second)
+
+class WindowsTaskScheduler(SchedulerBackend):
+    # Tasks in the root folder, running backup_cli.py like the other backends. Task Scheduler has
+    # no environment per task, so the environment is kept in a private file in state_directory()
+    # that the task hands to the CLI with --env-file.
+    name = 'Windows Task Scheduler'
+
+    def root_folder(self):
+        return connect().GetFolder('\\')
+
+    def lookup(self, name):
+        try:
+            return self.root_folder().GetTask(name)
+        except Exception:
+            raise LookupError(f"No scheduled task named '{name}'")
+
+    def register(self, name, task_definition):
+        self.root_folder().RegisterTaskDefinition(
+            name,
+            task_definition,
+            TASK_UPDATE,
+            None,  # No user
+            None,  # No password
+            TASK_LOGON_INTERACTIVE_TOKEN_OR_PASSWORD
+        )
+
+    def task_info(self, task):
+        definition = task.Definition
+        priority = {level: name for name, level in PRIORITY_LEVELS.items()}.get(definition.Settings.Priority, 'Normal')
+        triggers = definition.Triggers
+        run_time = None
+        if triggers.Count:
+            run_time = datetime.strptime(triggers.Item(1).StartBoundary[:19], START_BOUNDARY_FORMAT).strftime("%H:%M")
+        last_run = com_time(task.LastRunTime)
+        last_result = task.LastTaskResult
+        if last_run is None or last_result in TASK_NOT_RUN_RESULTS:
+            last_result = None
+        return TaskInfo(task.Name, enabled=task.Enabled, running=task.State == TASK_STATE_RUNNING,
+                        last_run=last_run, next_run=com_time(task.NextRunTime), last_result=last_result,
+                        run_time=run_time, priority=priority,
+                        description=definition.RegistrationInfo.Description or '',
+                        email_enabled=definition.Actions.Count > 1)
+
+    def list_tasks(self):
+        return [self.task_info(task) for task in self.root_folder().GetTasks(0)]
+
+    def task_exists(self, name):
+        result = subprocess.run(['schtasks', '/query', '/tn', name], capture_output=True, text=True)
+        return result.returncode == 0
+
+    def get_task(self, name):
+        return self.task_info(self.lookup(name))
+
+    def env_path(self, name):
+        return os.path.join(state_directory(), task_slug(name) + '.env')
+
+    def create_task(self, definition):
+        arguments = list(definition.command[1:])
+        if definition.env:
+            os.makedirs(state_directory(), exist_ok=True)
+            write_env_file(self.env_path(definition.name), definition.env)
+            arguments += ['--env-file', self.env_path(definition.name)]
+        # schtasks cuts /tr off at 261 characters, the arguments are set over COM below
+        command = ['schtasks', '/create', '/tn', definition.name, '/tr', subprocess.list2cmdline(definition.command[:1]),
+                   '/sc', definition.interval.upper()]
+        if definition.interval == 'Weekly':
+            command += ['/d', definition.weekday[:3].upper()]
+        elif definition.interval == 'Monthly':
+            command += ['/d', str(definition.day)]
+        command += ['/st', definition.run_time]
+        if definition.start_date:
+            command += ['/sd', definition.start_date.strftime("%m/%d/%Y")]
+        if definition.end_date:
+            command += ['/ed', definition.end_date.strftime("%m/%d/%Y")]
+        if definition.repetition > 0:
+            command += ['/ri', str(definition.repetition)]
+        if definition.run_elevated:
+            command += ['/rl', 'HIGHEST']
+        if definition.run_logged_off:
+            command += ['/ru', 'SYSTEM']
+        print(f"Executing command: {subprocess.list2cmdline(command)}")
+        try:
+            subprocess.run(command, check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError:
+            self.remove_env(definition.name)
+            raise
+
+        # Arguments, priority and description are only reachable through the COM interface
+        task_definition = self.lookup(definition.name).Definition
+        task_definition.Actions.Item(1).Arguments = subprocess.list2cmdline(arguments)
+        task_definition.Settings.Priority = PRIORITY_LEVELS[definition.priority]
+        task_definition.RegistrationInfo.Description = definition.description
+        self.register(definition.name, task_definition)
+
+    def update_task(self, name, run_time=None, priority=None, email_address=None):
+        task_definition = self.lookup(name).Definition
+        if run_time is not None:
+            hour, minute = (int(part) for part in run_time.split(':')[:2])
+            for trigger in task_definition.Triggers:
+                current = datetime.strptime(trigger.StartBoundary[:19], START_BOUNDARY_FORMAT)
+                trigger.StartBoundary = current.replace(hour=hour, minute=minute, second=0).strftime(START_BOUNDARY_FORMAT)
+        if priority is not None:
+            task_definition.Settings.Priority = PRIORITY_LEVELS[priority]
+        if email_address:
+            if task_definition.Actions.Count <= 1:  # Only backup action exists
+                email_action = task_definition.Actions.Create(0)
+                email_action.From = "firetiger555@gmail.com"
+                email_action.To = email_address
+                email_action.Subject = f"Backup Task '{name}' Completed"
+                email_action.Body = "The scheduled backup task has been completed."
+        elif email_address is not None and task_definition.Actions.Count > 1:
+            task_definition.Actions.Remove(2)
+        self.register(name, task_definition)
+
+    def run_task(self, name):
+        self.lookup(name).Run(0)
+
+    def set_enabled(self, name, enabled):
+        task_definition = self.lookup(name).Definition
+        task_definition.Settings.Enabled = enabled
+        self.register(name, task_definition)
+
+    def remove_env(self, name):
+        if os.path.exists(self.env_path(name)):
+            os.remove(self.env_path(name))
+
+    def delete_task(self, name):
+        subprocess.run(['schtasks', '/delete', '/tn', name, '/f'], check=True, capture_output=True, text=True)
+        self.remove_env(name)